@@ -0,0 +1,63 @@
+# Compares legacy Office conversion throughput: a fresh LibreOffice per file
+# (unoconv) against the persistent listener pool. Needs soffice and unoconv.
+# Usage: python benchmarks/bench_legacy_office.py DIR_WITH_DOC_XLS_PPT [--pool-size 2] [--concurrency 2]
+import argparse
+import logging
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+TARGETS = {"doc": ".docx", "xls": ".xlsx", "ppt": ".pptx"}
+
+def run_batch(files: list, concurrency: int) -> float:
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as pool:
+    results = list(pool.map(lambda path: main.parse_legacy_office(path, TARGETS[main.detect_file_type(path)]), files))
+  elapsed = time.perf_counter() - start
+  failures = sum(1 for r in results if r.startswith("Legacy format parsing requires"))
+  if failures:
+    print(f"  warning: {failures} conversions failed")
+  return elapsed
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("directory")
+  parser.add_argument("--pool-size", type=int, default=2)
+  parser.add_argument("--concurrency", type=int, default=2)
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+
+  for tool in ("soffice", "unoconv"):
+    if shutil.which(tool) is None:
+      sys.exit(f"{tool} is not installed")
+  files = sorted(
+    os.path.join(args.directory, name) for name in os.listdir(args.directory)
+    if main.detect_file_type(name) in TARGETS
+  )
+  if not files:
+    sys.exit("No .doc/.xls/.ppt files found")
+
+  main.SOFFICE_POOL_SIZE = 0
+  per_call = run_batch(files, args.concurrency)
+
+  main.SOFFICE_POOL_SIZE = args.pool_size
+  startup = time.perf_counter()
+  main.get_soffice_pool()
+  startup = time.perf_counter() - startup
+  try:
+    pooled = run_batch(files, args.concurrency)
+  finally:
+    main.shutdown_soffice_pool()
+
+  print(f"{len(files)} files, concurrency {args.concurrency}")
+  print(f"  per-call unoconv: {per_call:.2f}s ({len(files) / per_call:.2f} files/s)")
+  print(f"  listener pool:    {pooled:.2f}s ({len(files) / pooled:.2f} files/s), pool startup {startup:.2f}s")
+
+if __name__ == "__main__":
+  main_cli()
@@ -0,0 +1,56 @@
+# Times the column-wise dataframe_to_markdown against the previous row-by-row
+# implementation over a range of sheet sizes.
+# Usage: python benchmarks/bench_markdown.py [--rows 1000 10000 100000] [--columns 5 20]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import main
+
+def rowwise_markdown(df):
+  if df.empty:
+    return ""
+  header = "| " + " | ".join(map(str, df.columns)) + " |"
+  separator = "| " + " | ".join(["---"] * len(df.columns)) + " |"
+  rows = ["| " + " | ".join(map(str, row)) + " |" for row in df.values]
+  return "\n".join([header, separator] + rows)
+
+def make_frame(rows: int, columns: int):
+  rng = np.random.default_rng(0)
+  data = {}
+  for i in range(columns):
+    if i % 3 == 0:
+      data[f"text_{i}"] = [f"item {n} | note" for n in range(rows)]
+    elif i % 3 == 1:
+      data[f"float_{i}"] = rng.random(rows) * 1000
+    else:
+      data[f"int_{i}"] = rng.integers(0, 10 ** 6, rows)
+  return pd.DataFrame(data)
+
+def timed(fn, *args) -> float:
+  start = time.perf_counter()
+  fn(*args)
+  return time.perf_counter() - start
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+  parser.add_argument("--columns", type=int, nargs="+", default=[5, 20])
+  args = parser.parse_args()
+
+  print(f"{'rows':>8} {'cols':>5} {'row-wise (s)':>13} {'column-wise (s)':>16} {'aligned (s)':>12}")
+  for columns in args.columns:
+    for rows in args.rows:
+      df = make_frame(rows, columns)
+      old = timed(rowwise_markdown, df)
+      new = timed(main.dataframe_to_markdown, df)
+      aligned = timed(main.dataframe_to_markdown, df, True)
+      print(f"{rows:>8} {columns:>5} {old:>13.3f} {new:>16.3f} {aligned:>12.3f}")
+
+if __name__ == "__main__":
+  main_cli()
@@ -0,0 +1,80 @@
+# Times a synthetic .mbox export whose messages carry CSV, PDF and DOCX
+# attachments (the multipart email from corpus.py): attachments parsed on one
+# worker and on ARCHIVE_WORKERS, and the peak RSS while streaming one record
+# per message compared with parsing the whole mailbox.
+# Usage: python benchmarks/bench_mbox.py [--messages 40] [--attachments 3] [--workers 1 4]
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus
+import main
+
+CHILD = """
+import resource, sys
+import main
+path, mode = sys.argv[1], sys.argv[2]
+if mode == "stream":
+  for record in main.stream_document(path, "mbox"):
+    pass
+else:
+  main.parse_document(path, "mbox")
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+def make_mbox(path: str, messages: int, attachments: int):
+  eml_path = f"{path}.eml"
+  corpus.make_eml(eml_path, attachments)
+  try:
+    with open(eml_path, "rb") as f:
+      message = f.read()
+  finally:
+    os.remove(eml_path)
+  with open(path, "wb") as f:
+    for i in range(messages):
+      f.write(f"From finance{i}@example.com Mon Mar  4 09:00:00 2024\n".encode())
+      f.write(message.replace(b"\nFrom ", b"\n>From ") + b"\n")
+
+def peak_rss_mb(path: str, mode: str) -> float:
+  output = subprocess.run(
+    [sys.executable, "-c", CHILD, path, mode], capture_output=True, text=True, check=True, cwd=ROOT,
+    env=dict(os.environ, LOG_LEVEL="WARNING")
+  ).stdout
+  maxrss = int(output.strip().splitlines()[-1])
+  return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--messages", type=int, default=40)
+  parser.add_argument("--attachments", type=int, default=3)
+  parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+
+  path = tempfile.mktemp(suffix=".mbox")
+  make_mbox(path, args.messages, args.attachments)
+  try:
+    print(f"{args.messages} messages, {args.attachments} attachments each, {os.path.getsize(path) / 1e6:.1f} MB")
+    main.parse_document(path, "mbox")
+    for workers in args.workers:
+      main.ARCHIVE_WORKERS = workers
+      main.get_archive_pool().shutdown()
+      main._archive_pool = None
+      start = time.perf_counter()
+      main.parse_document(path, "mbox")
+      print(f"  {workers} attachment workers: {time.perf_counter() - start:.2f}s")
+    for mode in ["stream", "parse"]:
+      print(f"  peak RSS, {mode:>6}: {peak_rss_mb(path, mode):.0f} MB")
+  finally:
+    os.remove(path)
+
+if __name__ == "__main__":
+  main_cli()
@@ -0,0 +1,74 @@
+# Per-page OCR latency of each available engine on the synthetic scanned pages
+# from corpus.py: the first (cold) page, which includes starting the engine,
+# then p50/p90 of the warm pages, and how closely each engine's text matches
+# the first one's.
+# Usage: python benchmarks/bench_ocr_engine.py [--pages 20] [--lang eng] [--psm 3]
+import argparse
+import difflib
+import importlib.util
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus
+import main
+
+ENGINES = ["tesserocr", "pytesseract"]
+
+def engine_available(name: str) -> str:
+  # Returns why the engine cannot run, or None
+  if name == "tesserocr" and importlib.util.find_spec("tesserocr") is None:
+    return "tesserocr not installed"
+  try:
+    main.pytesseract.get_tesseract_version()
+  except Exception:
+    return "tesseract not installed"
+  return None
+
+def run_engine(name: str, images: list) -> tuple:
+  main._ocr_engines = threading.local()
+  main.OCR_ENGINE = name
+  latencies, texts = [], []
+  for img in images:
+    start = time.perf_counter()
+    texts.append(main.ocr_image(img))
+    latencies.append(time.perf_counter() - start)
+  main.get_ocr_engine().close()
+  return latencies, texts
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--pages", type=int, default=20)
+  parser.add_argument("--lang", default=main.OCR_LANG)
+  parser.add_argument("--psm", type=int, default=main.OCR_PSM)
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+  main.OCR_LANG, main.OCR_PSM = args.lang, args.psm
+
+  images = [main.apply_ocr_color_mode(corpus.scan_image(i + 1)) for i in range(args.pages)]
+  print(f"{args.pages} scanned pages, lang {args.lang}, psm {args.psm}")
+  print(f"{'engine':>12} {'cold ms':>8} {'p50 ms':>8} {'p90 ms':>8} {'pages/s':>8} {'text match':>11}")
+  reference = None
+  for name in ENGINES:
+    reason = engine_available(name)
+    if reason:
+      print(f"{name:>12}  skipped: {reason}")
+      continue
+    latencies, texts = run_engine(name, images)
+    warm = sorted(latencies[1:]) or latencies
+    p90 = warm[max(0, round(0.9 * len(warm)) - 1)]
+    reference = reference or " ".join(texts)
+    match = difflib.SequenceMatcher(None, reference.split(), " ".join(texts).split(), autojunk=False).ratio()
+    print(
+      f"{name:>12} {latencies[0] * 1000:>8.1f} {statistics.median(warm) * 1000:>8.1f} {p90 * 1000:>8.1f} "
+      f"{len(latencies) / sum(latencies):>8.2f} {match:>11.1%}"
+    )
+
+if __name__ == "__main__":
+  main_cli()
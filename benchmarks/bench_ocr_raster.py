@@ -0,0 +1,127 @@
+# Compares the old OCR rasterization (300 DPI render, then downscale to 1000 px)
+# with rendering directly at the target size, across target sizes and color
+# modes. Reports render time, pixels and, when tesseract is installed, OCR time
+# and character accuracy against the text drawn on the synthetic scanned pages.
+# Usage: python benchmarks/bench_ocr_raster.py [--pages 5] [--targets 1000 1500 2000] [--pdf scan.pdf ...]
+import argparse
+import difflib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpdf import FPDF
+from PIL import Image, ImageDraw, ImageFont
+import main
+
+LINES = [
+  "Invoice 2041 issued to Northwind Traders on 14 March",
+  "Quantity 12 units at 48.50 each, total 582.00 EUR",
+  "Payment is due within thirty days of the invoice date",
+  "Late payments accrue interest at two percent per month",
+]
+
+def make_scanned_pdf(path: str, pages: int) -> list:
+  # Each page is a single image of text, so the PDF has no text layer
+  truth = []
+  pdf = FPDF()
+  font = ImageFont.load_default()
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    for i in range(pages):
+      img = Image.new("L", (1240, 1754), 255)
+      draw = ImageDraw.Draw(img)
+      lines = [f"Page {i + 1}"] + LINES
+      for j, line in enumerate(lines):
+        draw.text((100, 120 + j * 40), line, fill=0, font=font)
+      image_path = os.path.join(tmp_dir, f"page{i}.png")
+      img.save(image_path)
+      pdf.add_page()
+      pdf.image(image_path, x=0, y=0, w=210, h=297)
+      truth.append("\n".join(lines))
+  pdf.output(path)
+  return truth
+
+def legacy_render(page, page_number: int, ctx):
+  img = page.to_image(resolution=300).original
+  w, h = img.size
+  if w > 1000 or h > 1000:
+    scale = min(1000 / w, 1000 / h)
+    img = img.resize((int(w * scale), int(h * scale)))
+  return img
+
+def adaptive_render(target_px: int, mode: str):
+  def render(page, page_number: int, ctx):
+    main.OCR_TARGET_PX = target_px
+    main.OCR_COLOR_MODE = mode
+    return main.render_page_for_ocr(page, page_number, ctx)
+  return render
+
+def tesseract_available() -> bool:
+  try:
+    main.pytesseract.get_tesseract_version()
+    return True
+  except Exception:
+    return False
+
+def run_setting(path: str, render, truth: list, with_ocr: bool) -> dict:
+  render_seconds = 0.0
+  ocr_seconds = 0.0
+  pixels = 0
+  accuracy = []
+  with main.PdfContext(path) as ctx:
+    for i, page in enumerate(ctx.pdf.pages):
+      start = time.perf_counter()
+      img = render(page, i + 1, ctx)
+      render_seconds += time.perf_counter() - start
+      pixels += img.size[0] * img.size[1]
+      if with_ocr:
+        start = time.perf_counter()
+        text = main.ocr_image(img)
+        ocr_seconds += time.perf_counter() - start
+        if truth:
+          accuracy.append(difflib.SequenceMatcher(None, " ".join(text.split()), " ".join(truth[i].split())).ratio())
+    pages = ctx.page_count
+  return {
+    "render_ms": render_seconds / pages * 1000,
+    "ocr_ms": ocr_seconds / pages * 1000 if with_ocr else None,
+    "mpixels": pixels / pages / 1e6,
+    "accuracy": sum(accuracy) / len(accuracy) if accuracy else None,
+  }
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--pages", type=int, default=5)
+  parser.add_argument("--targets", type=int, nargs="+", default=[1000, 1500, 2000])
+  parser.add_argument("--modes", nargs="+", default=["rgb", "gray", "binary"])
+  parser.add_argument("--pdf", nargs="*", default=[], help="Scanned PDFs to add to the corpus (no accuracy)")
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+
+  with_ocr = tesseract_available()
+  if not with_ocr:
+    print("tesseract not found: reporting render time only\n")
+  settings = [("legacy 300dpi+resize", legacy_render)]
+  for target in args.targets:
+    for mode in args.modes:
+      settings.append((f"{target}px {mode}", adaptive_render(target, mode)))
+
+  path = tempfile.mktemp(suffix=".pdf")
+  corpus = [(path, make_scanned_pdf(path, args.pages))] + [(pdf, None) for pdf in args.pdf]
+  try:
+    for pdf_path, truth in corpus:
+      print(os.path.basename(pdf_path) if truth is None else f"synthetic scan ({args.pages} pages)")
+      print(f"{'setting':>22} {'render ms/pg':>13} {'Mpx/pg':>7} {'ocr ms/pg':>10} {'accuracy':>9}")
+      for name, render in settings:
+        result = run_setting(pdf_path, render, truth, with_ocr)
+        ocr_ms = f"{result['ocr_ms']:.0f}" if result["ocr_ms"] is not None else "-"
+        accuracy = f"{result['accuracy']:.1%}" if result["accuracy"] is not None else "-"
+        print(f"{name:>22} {result['render_ms']:>13.1f} {result['mpixels']:>7.2f} {ocr_ms:>10} {accuracy:>9}")
+      print()
+  finally:
+    os.remove(path)
+
+if __name__ == "__main__":
+  main_cli()
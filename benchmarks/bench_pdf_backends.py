@@ -0,0 +1,79 @@
+# Compares the pdfplumber and PyMuPDF backends on the synthetic text PDF from
+# corpus.py and any PDFs given: parse time, OCR rasterization time per page and
+# how far the extracted text differs (word-level similarity and words found by
+# only one backend).
+# Usage: python benchmarks/bench_pdf_backends.py [--pages 50] [--repeat 3] [--pdf a.pdf ...]
+import argparse
+import collections
+import difflib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus
+import main
+
+BACKENDS = ["pdfplumber", "pymupdf"]
+
+def time_parse(path: str, backend: str, repeat: int) -> tuple:
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    content, _ = main.parse_document(path, "pdf", None, None, backend)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, content
+
+def time_render(path: str, backend: str, pages: int) -> float:
+  with main.PdfContext(path, backend) as ctx:
+    count = min(pages, ctx.page_count)
+    start = time.perf_counter()
+    for i in range(count):
+      main.render_page_for_ocr(ctx.page(i), i + 1, ctx)
+    return (time.perf_counter() - start) / count
+
+def compare_text(a: str, b: str) -> dict:
+  words_a, words_b = a.split(), b.split()
+  only_a = collections.Counter(words_a) - collections.Counter(words_b)
+  only_b = collections.Counter(words_b) - collections.Counter(words_a)
+  return {
+    "similarity": difflib.SequenceMatcher(None, words_a, words_b, autojunk=False).ratio(),
+    "only_pdfplumber": sum(only_a.values()),
+    "only_pymupdf": sum(only_b.values()),
+  }
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--pages", type=int, default=50)
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--render-pages", type=int, default=5)
+  parser.add_argument("--pdf", nargs="*", default=[])
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+
+  path = tempfile.mktemp(suffix=".pdf")
+  corpus.make_text_pdf(path, args.pages)
+  try:
+    for pdf_path in [path] + args.pdf:
+      label = f"synthetic text PDF ({args.pages} pages)" if pdf_path == path else os.path.basename(pdf_path)
+      print(label)
+      contents = {}
+      for backend in BACKENDS:
+        seconds, contents[backend] = time_parse(pdf_path, backend, args.repeat)
+        render_ms = time_render(pdf_path, backend, args.render_pages) * 1000
+        print(f"  {backend:>10}: parse {seconds:7.3f}s  render {render_ms:6.1f} ms/page  {len(contents[backend])} chars")
+      diff = compare_text(contents["pdfplumber"], contents["pymupdf"])
+      print(
+        f"  text: {diff['similarity']:.1%} word similarity, {diff['only_pdfplumber']} words only from pdfplumber, "
+        f"{diff['only_pymupdf']} only from pymupdf"
+      )
+  finally:
+    os.remove(path)
+
+if __name__ == "__main__":
+  main_cli()
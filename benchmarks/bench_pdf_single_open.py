@@ -0,0 +1,62 @@
+# Compares the old three-open PDF pipeline with the shared PdfContext pipeline.
+# Usage: python benchmarks/bench_pdf_single_open.py [--pages 100 300] [--repeat 3]
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdfplumber
+from fpdf import FPDF
+import main
+
+def make_pdf(path: str, pages: int):
+  pdf = FPDF()
+  pdf.set_font("Arial", size=10)
+  for i in range(pages):
+    pdf.add_page()
+    for line in range(40):
+      pdf.cell(0, 6, txt=f"Page {i + 1} line {line + 1}: quarterly figures and contract terms", ln=True)
+  pdf.output(path)
+
+def three_open_pipeline(path: str):
+  # Page limit guard, parse_pdf and extract_metadata each opening the file
+  with pdfplumber.open(path) as pdf:
+    len(pdf.pages)
+  main.parse_pdf(path)
+  main.get_pdf_page_count(path)
+
+def single_open_pipeline(path: str):
+  main.parse_document(path, "pdf", max_pdf_pages=None)
+
+def best_of(fn, path: str, repeat: int) -> float:
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn(path)
+    timings.append(time.perf_counter() - start)
+  return min(timings)
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--pages", type=int, nargs="+", default=[100, 300])
+  parser.add_argument("--repeat", type=int, default=3)
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+
+  print(f"{'pages':>6} {'three-open (s)':>15} {'single-open (s)':>16} {'saved':>7}")
+  for pages in args.pages:
+    path = tempfile.mktemp(suffix=".pdf")
+    make_pdf(path, pages)
+    try:
+      old = best_of(three_open_pipeline, path, args.repeat)
+      new = best_of(single_open_pipeline, path, args.repeat)
+      print(f"{pages:>6} {old:>15.3f} {new:>16.3f} {(old - new) / old:>7.1%}")
+    finally:
+      os.remove(path)
+
+if __name__ == "__main__":
+  main_cli()
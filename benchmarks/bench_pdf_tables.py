@@ -0,0 +1,72 @@
+# Times the table-aware PDF mode: plain text extraction, table detection on
+# every page, table detection only on pages the pre-scan found ruled, and the
+# same spread over PDF_TABLE_WORKERS processes.
+# Usage: python benchmarks/bench_pdf_tables.py [--pages 60] [--ruled-share 0.25] [--workers 2 4]
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpdf import FPDF
+import main
+
+def make_pdf(path: str, pages: int, ruled_share: float):
+  # Every page has text; a share of them also hold a bordered 12x5 table
+  pdf = FPDF()
+  pdf.set_font("Arial", size=9)
+  ruled_every = max(1, round(1 / ruled_share)) if ruled_share > 0 else 0
+  for i in range(pages):
+    pdf.add_page()
+    for line in range(20):
+      pdf.cell(0, 5, txt=f"Page {i + 1} line {line + 1}: quarterly figures and contract terms", ln=True)
+    if ruled_every and i % ruled_every == 0:
+      for row in range(12):
+        for column in range(5):
+          pdf.cell(36, 7, txt=f"r{row}c{column} {row * column}", border=1)
+        pdf.ln()
+  pdf.output(path)
+
+def run(path: str, tables, workers: int = 0, skip_unruled: bool = True) -> float:
+  main.PDF_TABLE_WORKERS = workers
+  original_plan = main.plan_pdf_tables
+  if not skip_unruled:
+    main.plan_pdf_tables = lambda scan, count, ranges=None: original_plan([None] * count, count, ranges)
+  try:
+    start = time.perf_counter()
+    main.parse_document(path, "pdf", None, tables)
+    return time.perf_counter() - start
+  finally:
+    main.plan_pdf_tables = original_plan
+    main.shutdown_table_pool()
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--pages", type=int, default=60)
+  parser.add_argument("--ruled-share", type=float, default=0.25)
+  parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+
+  path = tempfile.mktemp(suffix=".pdf")
+  make_pdf(path, args.pages, args.ruled_share)
+  tables = {"format": "markdown", "pages": None}
+  try:
+    # Warm up imports and the OS file cache
+    run(path, None)
+    print(f"{args.pages} pages, {args.ruled_share:.0%} with ruled tables, {os.cpu_count()} CPUs")
+    cases = [
+      ("text only", None, 0, True),
+      ("tables, every page", tables, 0, False),
+      ("tables, ruled pages only", tables, 0, True),
+    ] + [(f"tables, ruled, {n} workers", tables, n, True) for n in args.workers]
+    for name, options, workers, skip in cases:
+      print(f"{name:>28}: {run(path, options, workers, skip):.2f}s")
+  finally:
+    os.remove(path)
+
+if __name__ == "__main__":
+  main_cli()
@@ -0,0 +1,72 @@
+# Measures the response path for a large parse result: JSON encoding with the
+# stdlib and with orjson, then /parse-path response time and bytes on the wire
+# uncompressed, gzip and zstd, and a content handle plus a one-page fetch. The
+# synthetic text PDF from corpus.py is parsed once; later requests are served
+# from the result cache, so only serialization and transfer are timed.
+# Usage: python benchmarks/bench_response.py [--pages 200] [--repeat 10]
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient
+import corpus
+import main
+
+def time_calls(fn, repeat: int) -> float:
+  seconds = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    seconds.append(time.perf_counter() - start)
+  return statistics.median(seconds)
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--pages", type=int, default=200)
+  parser.add_argument("--repeat", type=int, default=10)
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+  logging.getLogger("httpx").setLevel(logging.WARNING)
+
+  path = tempfile.mktemp(suffix=".pdf")
+  corpus.make_text_pdf(path, args.pages)
+  client = TestClient(main.app)
+  try:
+    body = {"filepath": path}
+    result = client.post("/parse-path", json=body, headers={"Accept-Encoding": "identity"}).json()
+    print(f"{args.pages}-page PDF, {len(result['content']) / 1e6:.2f}M chars of content, median of {args.repeat}")
+
+    encoders = [("json", lambda: json.dumps(result).encode("utf-8"))]
+    if main.ORJSON_AVAILABLE:
+      encoders.append(("orjson", lambda: main.json_bytes(result)))
+    for name, encode in encoders:
+      print(f"  encode {name:>8}: {time_calls(encode, args.repeat) * 1000:8.2f} ms")
+
+    encodings = ["identity", "gzip"] + (["zstd"] if main.ZSTD_AVAILABLE else [])
+    for encoding in encodings:
+      headers = {"Accept-Encoding": encoding}
+      wire = client.post("/parse-path", json=body, headers=headers).num_bytes_downloaded
+      seconds = time_calls(lambda: client.post("/parse-path", json=body, headers=headers), args.repeat)
+      print(f"  /parse-path {encoding:>8}: {seconds * 1000:8.2f} ms  {wire / 1e6:7.3f} MB on the wire")
+    if not main.ZSTD_AVAILABLE:
+      print("  zstd skipped: zstandard not installed")
+
+    handle_body = dict(body, content_handle=True)
+    seconds = time_calls(lambda: client.post("/parse-path", json=handle_body), args.repeat)
+    handle = client.post("/parse-path", json=handle_body).json()["content_handle"]
+    page = client.get(handle["url"], params={"pages": "1"})
+    page_seconds = time_calls(lambda: client.get(handle["url"], params={"pages": "1"}), args.repeat)
+    print(f"  content handle: {seconds * 1000:8.2f} ms, then page 1 in {page_seconds * 1000:.2f} ms ({len(page.content)} bytes)")
+  finally:
+    os.remove(path)
+
+if __name__ == "__main__":
+  main_cli()
@@ -0,0 +1,77 @@
+# Measures import time and resident memory of a fresh worker: importing main
+# with lazy parser modules, with every format preloaded (the old eager
+# imports), and with only the formats a deployment enables, before and after
+# a first parse. Each setting runs in its own interpreter.
+# Usage: python benchmarks/bench_startup.py [--repeat 5] [--formats text,pdf]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, os, sys, time
+start = time.perf_counter()
+import main
+import_seconds = time.perf_counter() - start
+def rss_mb():
+  with open("/proc/self/status") as f:
+    for line in f:
+      if line.startswith("VmRSS:"):
+        return int(line.split()[1]) / 1024
+  import resource
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+result = {"import_seconds": import_seconds, "rss_after_import_mb": rss_mb()}
+if os.environ.get("BENCH_PRELOAD") == "1":
+  start = time.perf_counter()
+  main.preload_formats()
+  result["preload_seconds"] = time.perf_counter() - start
+result["rss_ready_mb"] = rss_mb()
+path = os.environ["BENCH_FILE"]
+start = time.perf_counter()
+main.parse_document(path, main.detect_file_type(path))
+result["first_parse_seconds"] = time.perf_counter() - start
+result["rss_after_parse_mb"] = rss_mb()
+print(json.dumps(result))
+"""
+
+def run_child(env: dict) -> dict:
+  output = subprocess.run(
+    [sys.executable, "-c", CHILD], capture_output=True, text=True, check=True, cwd=ROOT,
+    env=dict(os.environ, LOG_LEVEL="WARNING", **env)
+  ).stdout
+  return json.loads(output.strip().splitlines()[-1])
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument("--formats", default="text,pdf", help="PARSER_FORMATS for the restricted setting")
+  args = parser.parse_args()
+
+  with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+    f.write("hello\n" * 100)
+    path = f.name
+  settings = [
+    ("lazy, all formats", {}),
+    ("eager, all formats", {"BENCH_PRELOAD": "1"}),
+    (f"eager, {args.formats} only", {"BENCH_PRELOAD": "1", "PARSER_FORMATS": args.formats}),
+  ]
+  try:
+    print(f"median of {args.repeat} runs; first parse is a small .txt file")
+    print(f"{'setting':>26} {'import s':>9} {'preload s':>10} {'RSS ready MB':>13} {'RSS parsed MB':>14}")
+    for name, env in settings:
+      runs = [run_child(dict(env, BENCH_FILE=path)) for _ in range(args.repeat)]
+      median = lambda key: statistics.median(run.get(key, 0.0) for run in runs)
+      print(
+        f"{name:>26} {median('import_seconds'):>9.3f} {median('preload_seconds'):>10.3f} "
+        f"{median('rss_ready_mb'):>13.1f} {median('rss_after_parse_mb'):>14.1f}"
+      )
+  finally:
+    os.remove(path)
+
+if __name__ == "__main__":
+  main_cli()
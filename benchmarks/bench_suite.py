@@ -0,0 +1,257 @@
+# Runs every parser and the HTTP endpoints over the synthetic corpus from
+# corpus.py at several concurrency levels, and reports latency percentiles,
+# throughput and peak RSS as JSON, tagged with the current commit. Pass an
+# earlier report with --compare to print the change per case.
+# Modes: "parser" calls parse_document from a thread pool; "parse" uploads to
+# /parse and "parse-path" posts to /parse-path, in-process through the ASGI app
+# or against a running server with --url (add --server-pid to sample its RSS).
+# Usage: python benchmarks/bench_suite.py [--scale 1] [--concurrency 1 4] [--requests 8]
+#          [--modes parser parse] [--kinds pdf_text csv ...] [--output run.json] [--compare base.json]
+# The in-process result cache is disabled unless --cache is given; with --url,
+# start the server with PARSE_CACHE_MAX_BYTES=0 for the same effect.
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+import corpus
+import main
+
+MODES = ["parser", "parse", "parse-path"]
+
+def read_rss(pid: int) -> int:
+  try:
+    with open(f"/proc/{pid}/status") as f:
+      for line in f:
+        if line.startswith("VmRSS:"):
+          return int(line.split()[1]) * 1024
+  except OSError:
+    pass
+  return 0
+
+def child_pids(pid: int) -> list:
+  children = []
+  try:
+    for tid in os.listdir(f"/proc/{pid}/task"):
+      with open(f"/proc/{pid}/task/{tid}/children") as f:
+        children.extend(int(child) for child in f.read().split())
+  except OSError:
+    pass
+  return children
+
+def tree_rss(pid: int) -> int:
+  # Includes the parse and OCR pool processes
+  return read_rss(pid) + sum(tree_rss(child) for child in child_pids(pid))
+
+# Samples the resident set of a process tree in the background; without /proc
+# it falls back to this process's lifetime peak
+class RssSampler:
+  def __init__(self, pid: int, interval: float = 0.01):
+    self.pid = pid
+    self.interval = interval
+    self.peak = 0
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+
+  def _run(self):
+    while not self._stop.is_set():
+      self.peak = max(self.peak, tree_rss(self.pid))
+      self._stop.wait(self.interval)
+
+  def __enter__(self):
+    self._thread.start()
+    return self
+
+  def __exit__(self, *exc):
+    self._stop.set()
+    self._thread.join()
+    self.peak = max(self.peak, tree_rss(self.pid))
+    if self.peak == 0:
+      maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      self.peak = maxrss if sys.platform == "darwin" else maxrss * 1024
+
+def percentile(values: list, pct: float) -> float:
+  ordered = sorted(values)
+  return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def summarize(latencies: list, errors: int, elapsed: float, size: int, peak_rss: int) -> dict:
+  count = len(latencies)
+  return {
+    "requests": count,
+    "errors": errors,
+    "elapsed_seconds": round(elapsed, 4),
+    "throughput_per_second": round(count / elapsed, 3) if elapsed else None,
+    "mb_per_second": round(count * size / 1e6 / elapsed, 3) if elapsed else None,
+    "latency_seconds": {
+      "p50": round(percentile(latencies, 50), 4),
+      "p90": round(percentile(latencies, 90), 4),
+      "p99": round(percentile(latencies, 99), 4),
+      "mean": round(sum(latencies) / count, 4),
+      "max": round(max(latencies), 4),
+    },
+    "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+  }
+
+def run_parser(path: str, concurrency: int, requests: int) -> tuple:
+  filetype = main.detect_file_type(path)
+
+  def one(_):
+    start = time.perf_counter()
+    content, _ = main.parse_document(path, filetype)
+    return time.perf_counter() - start, not content
+
+  with ThreadPoolExecutor(max_workers=concurrency) as pool:
+    results = list(pool.map(one, range(requests)))
+  return [latency for latency, _ in results], sum(1 for _, failed in results if failed)
+
+async def run_endpoint(mode: str, path: str, concurrency: int, requests: int, url: str) -> tuple:
+  if url:
+    http = httpx.AsyncClient(base_url=url, timeout=None)
+  else:
+    http = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=None)
+  with open(path, "rb") as f:
+    data = f.read()
+  semaphore = asyncio.Semaphore(concurrency)
+
+  async def one():
+    async with semaphore:
+      start = time.perf_counter()
+      if mode == "parse":
+        response = await http.post("/parse", files={"file": (os.path.basename(path), data)})
+      else:
+        response = await http.post("/parse-path", json={"filepath": os.path.abspath(path)})
+      return time.perf_counter() - start, response.status_code != 200
+
+  async with http:
+    results = await asyncio.gather(*(one() for _ in range(requests)))
+  return [latency for latency, _ in results], sum(1 for _, failed in results if failed)
+
+def run_case(mode: str, path: str, concurrency: int, requests: int, args) -> dict:
+  pid = args.server_pid if args.url and mode != "parser" and args.server_pid else os.getpid()
+  with RssSampler(pid) as sampler:
+    start = time.perf_counter()
+    if mode == "parser":
+      latencies, errors = run_parser(path, concurrency, requests)
+    else:
+      latencies, errors = asyncio.run(run_endpoint(mode, path, concurrency, requests, args.url))
+    elapsed = time.perf_counter() - start
+  return summarize(latencies, errors, elapsed, os.path.getsize(path), sampler.peak)
+
+def git_commit() -> str:
+  try:
+    return subprocess.run(
+      ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+      cwd=os.path.dirname(os.path.abspath(__file__))
+    ).stdout.strip()
+  except Exception:
+    return None
+
+def tesseract_available() -> bool:
+  try:
+    main.pytesseract.get_tesseract_version()
+    return True
+  except Exception:
+    return False
+
+def print_comparison(report: dict, baseline: dict):
+  base_cases = {(c["mode"], c["kind"], c["concurrency"]): c for c in baseline["cases"]}
+  print(f"compared with {baseline.get('commit')} ({baseline.get('timestamp')})", file=sys.stderr)
+  print(f"{'mode':>10} {'kind':>12} {'conc':>4} {'p50 s':>9} {'change':>8} {'per s':>9} {'change':>8}", file=sys.stderr)
+  for case in report["cases"]:
+    base = base_cases.get((case["mode"], case["kind"], case["concurrency"]))
+    if base is None:
+      continue
+    p50 = case["latency_seconds"]["p50"]
+    base_p50 = base["latency_seconds"]["p50"]
+    rate = case["throughput_per_second"]
+    base_rate = base["throughput_per_second"]
+    p50_change = f"{(p50 / base_p50 - 1):+.0%}" if base_p50 else "-"
+    rate_change = f"{(rate / base_rate - 1):+.0%}" if base_rate else "-"
+    print(
+      f"{case['mode']:>10} {case['kind']:>12} {case['concurrency']:>4} {p50:>9.4f} {p50_change:>8} {rate:>9.2f} {rate_change:>8}",
+      file=sys.stderr
+    )
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "docparser-bench-corpus"))
+  parser.add_argument("--scale", type=int, default=1)
+  parser.add_argument("--kinds", nargs="+", choices=sorted(corpus.KINDS), default=None)
+  parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+  parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+  parser.add_argument("--requests", type=int, default=8, help="Parses per case")
+  parser.add_argument("--url", default=None, help="Benchmark a running server instead of the in-process app")
+  parser.add_argument("--server-pid", type=int, default=None, help="Sample this process tree's RSS with --url")
+  parser.add_argument("--cache", action="store_true", help="Keep the in-process result cache (off so every request parses)")
+  parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+  parser.add_argument("--compare", default=None, help="Earlier JSON report to compare against")
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+  logging.getLogger("httpx").setLevel(logging.WARNING)
+  if not args.cache:
+    main.result_cache = main.ParseResultCache(max_bytes=0, db_path="")
+
+  kinds = args.kinds or list(corpus.KINDS)
+  skipped = {}
+  if not tesseract_available():
+    for kind in [k for k in kinds if corpus.KINDS[k][2]]:
+      skipped[kind] = "tesseract not installed"
+      kinds.remove(kind)
+  print(f"building corpus in {args.corpus_dir}", file=sys.stderr)
+  files = corpus.build_corpus(args.corpus_dir, args.scale, kinds)
+
+  cases = []
+  for mode in args.modes:
+    for kind, path in files.items():
+      for concurrency in args.concurrency:
+        # One untimed parse so imports and pools are warm
+        run_parser(path, 1, 1) if mode == "parser" else asyncio.run(run_endpoint(mode, path, 1, 1, args.url))
+        result = run_case(mode, path, concurrency, args.requests, args)
+        cases.append({"mode": mode, "kind": kind, "concurrency": concurrency, "bytes": os.path.getsize(path), **result})
+        print(
+          f"{mode:>10} {kind:>12} c={concurrency:<3} p50={result['latency_seconds']['p50']:.4f}s "
+          f"{result['throughput_per_second']:.2f}/s rss={result['peak_rss_mb']}MB errors={result['errors']}",
+          file=sys.stderr
+        )
+
+  report = {
+    "commit": git_commit(),
+    "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "cpu_count": os.cpu_count(),
+    "scale": args.scale,
+    "requests_per_case": args.requests,
+    "target": args.url or "in-process",
+    "result_cache": args.cache,
+    "skipped": skipped,
+    "cases": cases,
+  }
+  output = json.dumps(report, indent=2)
+  if args.output:
+    with open(args.output, "w") as f:
+      f.write(output + "\n")
+  else:
+    print(output)
+  if args.compare:
+    with open(args.compare) as f:
+      print_comparison(report, json.load(f))
+  main.parse_executor.shutdown()
+
+if __name__ == "__main__":
+  main_cli()
@@ -0,0 +1,78 @@
+# Compares peak memory and time of the streaming CSV/XLSX path (parse plus
+# shape in one pass) with the previous full-DataFrame implementation, which
+# loaded the file once to parse and again to count rows and columns.
+# Usage: python benchmarks/bench_tabular_memory.py [--csv-rows 200000] [--xlsx-rows 50000]
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl
+import pandas as pd
+import main
+
+def make_csv(path: str, rows: int):
+  with open(path, "w") as f:
+    f.write("id,name,amount,region,note\n")
+    for i in range(rows):
+      f.write(f"{i},customer {i},{i * 1.25:.2f},region {i % 17},\"free text, row {i}\"\n")
+
+def make_xlsx(path: str, rows: int):
+  wb = openpyxl.Workbook(write_only=True)
+  ws = wb.create_sheet("Data")
+  ws.append(["id", "name", "amount", "region", "note"])
+  for i in range(rows):
+    ws.append([i, f"customer {i}", i * 1.25, f"region {i % 17}", f"free text, row {i}"])
+  wb.save(path)
+
+def dataframe_csv(path: str):
+  content = pd.read_csv(path).to_csv(index=False)
+  df = pd.read_csv(path)
+  return content, {"rows": df.shape[0], "columns": df.shape[1]}
+
+def dataframe_xlsx(path: str):
+  content = pd.read_excel(path, engine="openpyxl").to_csv(index=False)
+  df = pd.read_excel(path, engine="openpyxl")
+  return content, {"rows": df.shape[0], "columns": df.shape[1]}
+
+def measure(fn, *args) -> tuple:
+  tracemalloc.start()
+  start = time.perf_counter()
+  fn(*args)
+  elapsed = time.perf_counter() - start
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return elapsed, peak / (1024 * 1024)
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--csv-rows", type=int, default=200000)
+  parser.add_argument("--xlsx-rows", type=int, default=50000)
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+
+  cases = [
+    ("csv", args.csv_rows, make_csv, dataframe_csv),
+    ("xlsx", args.xlsx_rows, make_xlsx, dataframe_xlsx),
+  ]
+  print(f"{'type':>5} {'rows':>8} {'impl':>10} {'time (s)':>9} {'peak MB':>8}")
+  for filetype, rows, make, dataframe_impl in cases:
+    path = tempfile.mktemp(suffix=f".{filetype}")
+    make(path, rows)
+    try:
+      for name, fn, fn_args in (
+        ("dataframe", dataframe_impl, (path,)),
+        ("streaming", main.parse_document, (path, filetype)),
+      ):
+        elapsed, peak = measure(fn, *fn_args)
+        print(f"{filetype:>5} {rows:>8} {name:>10} {elapsed:>9.2f} {peak:>8.1f}")
+    finally:
+      os.remove(path)
+
+if __name__ == "__main__":
+  main_cli()
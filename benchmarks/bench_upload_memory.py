@@ -0,0 +1,93 @@
+# Reports peak Python memory per /parse upload for the streamed copy-to-disk path
+# against the previous read-everything path. The request body is fed to the ASGI
+# app chunk by chunk so only server-side allocations are measured.
+# Usage: python benchmarks/bench_upload_memory.py [--sizes-mb 10 50 100]
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import File, UploadFile
+import main
+
+BOUNDARY = b"benchboundary"
+
+@main.app.post("/bench-buffered-upload")
+async def buffered_upload(file: UploadFile = File(...)):
+  # The pre-streaming implementation: whole upload read into memory, then written
+  with tempfile.NamedTemporaryFile(delete=False, suffix=".bin") as tmp:
+    content = await file.read()
+    tmp.write(content)
+    tmp_path = tmp.name
+  os.remove(tmp_path)
+  return {"size_bytes": len(content)}
+
+def body_chunks(size: int, chunk_size: int = 64 * 1024):
+  yield (
+    b"--" + BOUNDARY + b"\r\n"
+    b'Content-Disposition: form-data; name="file"; filename="upload.bin"\r\n'
+    b"Content-Type: application/octet-stream\r\n\r\n"
+  )
+  sent = 0
+  while sent < size:
+    n = min(chunk_size, size - sent)
+    yield b"\0" * n
+    sent += n
+  yield b"\r\n--" + BOUNDARY + b"--\r\n"
+
+async def post(path: str, size: int) -> int:
+  chunks = body_chunks(size)
+  pending = next(chunks)
+  status = []
+
+  async def receive():
+    nonlocal pending
+    if pending is None:
+      return {"type": "http.disconnect"}
+    body = pending
+    pending = next(chunks, None)
+    return {"type": "http.request", "body": body, "more_body": pending is not None}
+
+  async def send(message):
+    if message["type"] == "http.response.start":
+      status.append(message["status"])
+
+  scope = {
+    "type": "http", "method": "POST", "path": path, "raw_path": path.encode(), "root_path": "",
+    "query_string": b"", "scheme": "http", "server": ("bench", 80), "client": ("bench", 1),
+    "http_version": "1.1",
+    "headers": [(b"content-type", b"multipart/form-data; boundary=" + BOUNDARY)],
+  }
+  await main.app(scope, receive, send)
+  return status[0]
+
+def peak_mb(path: str, size: int) -> float:
+  tracemalloc.start()
+  status = asyncio.run(post(path, size))
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  assert status == 200, f"{path} returned {status}"
+  return peak / (1024 * 1024)
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--sizes-mb", type=int, nargs="+", default=[10, 50, 100])
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+  main.MAX_UPLOAD_BYTES = 0
+  main.parse_executor = main.ParseExecutor(process_workers=0)
+
+  print(f"{'upload MB':>10} {'buffered peak MB':>17} {'streamed peak MB':>17}")
+  for size_mb in args.sizes_mb:
+    size = size_mb * 1024 * 1024
+    buffered = peak_mb("/bench-buffered-upload", size)
+    streamed = peak_mb("/parse", size)
+    print(f"{size_mb:>10} {buffered:>17.1f} {streamed:>17.1f}")
+
+if __name__ == "__main__":
+  main_cli()
@@ -0,0 +1,202 @@
+# Synthetic document corpus for the benchmarks: multi-page text and scanned
+# PDFs, large CSV/XLSX, many-slide PPTX, long DOCX, multipart EML and nested
+# archives. Sizes scale linearly with --scale; the same scale always produces
+# the same files, so runs on different commits parse identical input.
+# Usage: python benchmarks/corpus.py OUT_DIR [--scale 1] [--kinds pdf_text csv ...]
+import argparse
+import email.message
+import io
+import os
+import tarfile
+import zipfile
+
+import docx
+import openpyxl
+import pptx
+from fpdf import FPDF
+from PIL import Image, ImageDraw, ImageFont
+
+SENTENCES = [
+  "The supplier shall deliver the goods within thirty days of the purchase order.",
+  "Quarterly revenue grew by 4.2 percent compared with the same period last year.",
+  "All invoices are payable in euros to the account listed in schedule B.",
+  "The committee reviewed the audit findings and approved the remediation plan.",
+  "Shipments to the northern region were delayed by weather on two occasions.",
+]
+
+SCAN_LINES = [
+  "Invoice 2041 issued to Northwind Traders on 14 March",
+  "Quantity 12 units at 48.50 each, total 582.00 EUR",
+  "Payment is due within thirty days of the invoice date",
+]
+
+def sentence(i: int) -> str:
+  return SENTENCES[i % len(SENTENCES)]
+
+def make_text_pdf(path: str, pages: int):
+  pdf = FPDF()
+  pdf.set_font("Arial", size=10)
+  for i in range(pages):
+    pdf.add_page()
+    for line in range(40):
+      pdf.cell(0, 6, txt=f"{i + 1}.{line + 1} {sentence(i + line)}", ln=True)
+  pdf.output(path)
+
+def scan_image(page: int) -> Image.Image:
+  img = Image.new("L", (1240, 1754), 255)
+  draw = ImageDraw.Draw(img)
+  font = ImageFont.load_default()
+  for j, line in enumerate([f"Page {page}"] + SCAN_LINES):
+    draw.text((100, 120 + j * 40), line, fill=0, font=font)
+  return img
+
+def make_scanned_pdf(path: str, pages: int):
+  # Each page is one image and the PDF has no text layer, so every page is OCR'd
+  pdf = FPDF()
+  image_paths = []
+  try:
+    for i in range(pages):
+      image_path = f"{path}.page{i}.png"
+      scan_image(i + 1).save(image_path)
+      image_paths.append(image_path)
+      pdf.add_page()
+      pdf.image(image_path, x=0, y=0, w=210, h=297)
+    pdf.output(path)
+  finally:
+    for image_path in image_paths:
+      os.remove(image_path)
+
+def make_png(path: str):
+  scan_image(1).save(path)
+
+def make_csv(path: str, rows: int):
+  with open(path, "w") as f:
+    f.write("id,name,amount,region,note\n")
+    for i in range(rows):
+      f.write(f"{i},customer {i},{i * 1.25:.2f},region {i % 17},\"{sentence(i)}\"\n")
+
+def make_xlsx(path: str, rows: int, sheets: int = 2):
+  wb = openpyxl.Workbook(write_only=True)
+  for sheet in range(sheets):
+    ws = wb.create_sheet(f"Sheet{sheet + 1}")
+    ws.append(["id", "name", "amount", "region", "note"])
+    for i in range(rows // sheets):
+      ws.append([i, f"customer {i}", i * 1.25, f"region {i % 17}", sentence(i)])
+  wb.save(path)
+
+def make_pptx(path: str, slides: int):
+  prs = pptx.Presentation()
+  layout = prs.slide_layouts[1]
+  for i in range(slides):
+    slide = prs.slides.add_slide(layout)
+    slide.shapes.title.text = f"Slide {i + 1}"
+    slide.placeholders[1].text = "\n".join(sentence(i + j) for j in range(4))
+  prs.save(path)
+
+def make_docx(path: str, paragraphs: int):
+  doc = docx.Document()
+  for i in range(paragraphs):
+    doc.add_paragraph(f"{i + 1}. {sentence(i)}")
+  doc.save(path)
+
+def make_txt(path: str, lines: int):
+  with open(path, "w") as f:
+    for i in range(lines):
+      f.write(f"{i + 1} {sentence(i)}\n")
+
+def make_eml(path: str, attachments: int):
+  # Plain and HTML alternatives plus CSV, PDF and DOCX attachments
+  msg = email.message.EmailMessage()
+  msg["Subject"] = "Quarterly report"
+  msg["From"] = "finance@example.com"
+  msg["To"] = "board@example.com"
+  body = "\n".join(sentence(i) for i in range(50))
+  msg.set_content(body)
+  msg.add_alternative(f"<html><body><p>{body}</p></body></html>", subtype="html")
+  tmp_path = f"{path}.part"
+  try:
+    for i in range(attachments):
+      kind = ("csv", "pdf", "docx")[i % 3]
+      if kind == "csv":
+        make_csv(tmp_path, 500)
+        maintype, subtype = "text", "csv"
+      elif kind == "pdf":
+        make_text_pdf(tmp_path, 3)
+        maintype, subtype = "application", "pdf"
+      else:
+        make_docx(tmp_path, 100)
+        maintype, subtype = "application", "vnd.openxmlformats-officedocument.wordprocessingml.document"
+      with open(tmp_path, "rb") as f:
+        msg.add_attachment(f.read(), maintype=maintype, subtype=subtype, filename=f"attachment{i + 1}.{kind}")
+  finally:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+  with open(path, "wb") as f:
+    f.write(msg.as_bytes())
+
+def make_archive(path: str, members: int, depth: int):
+  # A zip holding documents and a .tar.gz, which holds documents and the next
+  # level down, until depth levels of nesting
+  def level_bytes(level: int, fmt: str) -> bytes:
+    files = {f"level{level}/notes{i}.txt": "\n".join(sentence(i + j) for j in range(200)).encode() for i in range(members)}
+    files[f"level{level}/table.csv"] = "id,amount\n".encode() + "".join(f"{i},{i * 2}\n" for i in range(1000)).encode()
+    if level < depth:
+      inner_fmt = "tar" if fmt == "zip" else "zip"
+      files[f"level{level}/inner.{'tar.gz' if inner_fmt == 'tar' else 'zip'}"] = level_bytes(level + 1, inner_fmt)
+    buffer = io.BytesIO()
+    if fmt == "zip":
+      with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+          archive.writestr(name, data)
+    else:
+      with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in files.items():
+          info = tarfile.TarInfo(name)
+          info.size = len(data)
+          archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+  with open(path, "wb") as f:
+    f.write(level_bytes(1, "zip"))
+
+# kind: (file name, builder(path, scale), needs OCR)
+KINDS = {
+  "pdf_text": ("text.pdf", lambda path, scale: make_text_pdf(path, 20 * scale), False),
+  "pdf_scanned": ("scanned.pdf", lambda path, scale: make_scanned_pdf(path, 5 * scale), True),
+  "png": ("scan.png", lambda path, scale: make_png(path), True),
+  "csv": ("large.csv", lambda path, scale: make_csv(path, 100000 * scale), False),
+  "xlsx": ("large.xlsx", lambda path, scale: make_xlsx(path, 20000 * scale), False),
+  "pptx": ("slides.pptx", lambda path, scale: make_pptx(path, 100 * scale), False),
+  "docx": ("long.docx", lambda path, scale: make_docx(path, 2000 * scale), False),
+  "txt": ("notes.txt", lambda path, scale: make_txt(path, 20000 * scale), False),
+  "eml": ("multipart.eml", lambda path, scale: make_eml(path, 3 * scale), False),
+  "zip": ("nested.zip", lambda path, scale: make_archive(path, 5 * scale, 3), False),
+}
+
+# Bump when a builder changes, so corpora built by older versions are not reused
+CORPUS_VERSION = 1
+
+# Builds the requested kinds in out_dir, reusing files from an earlier run at
+# the same scale; returns {kind: path}
+def build_corpus(out_dir: str, scale: int = 1, kinds: list = None) -> dict:
+  os.makedirs(out_dir, exist_ok=True)
+  corpus = {}
+  for kind in kinds or KINDS:
+    filename, builder, _ = KINDS[kind]
+    path = os.path.join(out_dir, f"v{CORPUS_VERSION}-x{scale}-{filename}")
+    if not os.path.exists(path):
+      builder(path, scale)
+    corpus[kind] = path
+  return corpus
+
+def main_cli():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("out_dir")
+  parser.add_argument("--scale", type=int, default=1)
+  parser.add_argument("--kinds", nargs="+", choices=sorted(KINDS), default=None)
+  args = parser.parse_args()
+  for kind, path in build_corpus(args.out_dir, args.scale, args.kinds).items():
+    print(f"{kind:>12} {os.path.getsize(path) / 1e6:8.2f} MB  {path}")
+
+if __name__ == "__main__":
+  main_cli()
@@ -1,25 +1,92 @@
 import logging
+import logging.handlers
 import base64
-import requests
+import asyncio
+import threading
+import collections
+import contextlib
+import contextvars
+import functools
+import hashlib
+import mimetypes
+import json
+import sqlite3
+import time
+import queue
+import shutil
+import socket
+import tarfile
+import zipfile
+import csv
+import io
+import re
+import datetime
+import uuid
+import weakref
+import zlib
+import httpx
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response, FileResponse
+from fastapi.encoders import jsonable_encoder
+from starlette.datastructures import MutableHeaders
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import List, Optional
 import os
+import sys
+import importlib
+import importlib.util
 import tempfile
-import docx
-import pdfplumber
-import pandas as pd
-import openpyxl
-import pptx
-import extract_msg
 import email
 import email.policy
+import html.parser
 import subprocess
-import pytesseract
-from PIL import Image
 from dotenv import load_dotenv
 
+# Module proxy that imports the real module on first attribute access, so a
+# worker only pays import time and memory for the formats it actually parses
+class LazyModule:
+  def __init__(self, name: str):
+    object.__setattr__(self, "_name", name)
+    object.__setattr__(self, "_module", None)
+
+  def _load(self):
+    module = object.__getattribute__(self, "_module")
+    if module is None:
+      module = importlib.import_module(object.__getattribute__(self, "_name"))
+      object.__setattr__(self, "_module", module)
+    return module
+
+  def __getattr__(self, name):
+    return getattr(self._load(), name)
+
+  def __setattr__(self, name, value):
+    setattr(self._load(), name, value)
+
+  def __delattr__(self, name):
+    delattr(self._load(), name)
+
+  def __repr__(self):
+    return f"<lazy module {self._name!r}>"
+
+docx = LazyModule("docx")
+pdfplumber = LazyModule("pdfplumber")
+pymupdf = LazyModule("pymupdf")
+pypdfium2 = LazyModule("pypdfium2")
+pdfium_c = LazyModule("pypdfium2.raw")
+pd = LazyModule("pandas")
+openpyxl = LazyModule("openpyxl")
+pptx = LazyModule("pptx")
+extract_msg = LazyModule("extract_msg")
+pytesseract = LazyModule("pytesseract")
+Image = LazyModule("PIL.Image")
+# Optional: faster JSON and zstd response compression when installed
+orjson = LazyModule("orjson")
+zstandard = LazyModule("zstandard")
+
 # Load environment variables
 load_dotenv()
 
@@ -27,8 +94,228 @@ load_dotenv()
 LLAVA_USE = os.getenv("LLAVA_USE", "false").lower() == "true"
 LLAVA_URL = os.getenv("LLAVA_URL", "http://localhost:1234/v1/chat/completions")
 LLAVA_MODEL_NAME = os.getenv("LLAVA_MODEL_NAME", "llava-1.6-mistral-7b")
+# Model calls go through a pooled async client. LLAVA_TIMEOUT bounds each read
+# and LLAVA_CONNECT_TIMEOUT each connect; failed calls are retried up to
+# LLAVA_MAX_RETRIES times with exponential backoff starting at
+# LLAVA_RETRY_BACKOFF seconds, and at most LLAVA_MAX_CONCURRENCY calls per
+# worker are in flight at once.
+LLAVA_TIMEOUT = float(os.getenv("LLAVA_TIMEOUT", "120"))
+LLAVA_CONNECT_TIMEOUT = float(os.getenv("LLAVA_CONNECT_TIMEOUT", "5"))
+LLAVA_MAX_RETRIES = int(os.getenv("LLAVA_MAX_RETRIES", "2"))
+LLAVA_RETRY_BACKOFF = float(os.getenv("LLAVA_RETRY_BACKOFF", "0.5"))
+LLAVA_MAX_CONCURRENCY = int(os.getenv("LLAVA_MAX_CONCURRENCY", "4"))
+# With LLAVA_USE, /parse sends images to the model directly, and with
+# LLAVA_PDF_PAGES also PDF pages whose OCR failed. Up to LLAVA_BATCH_SIZE images
+# go in one request when the server accepts several. Answers are cached by
+# image hash and prompt. Calls slower than LLAVA_PARSE_TIMEOUT or failing fall
+# back to pytesseract, and the model is then skipped for LLAVA_COOLDOWN seconds.
+LLAVA_PROMPT = os.getenv("LLAVA_PROMPT") or (
+  "Transcribe all text in this image exactly. If it contains no text, describe it in detail."
+)
+LLAVA_PARSE_TIMEOUT = float(os.getenv("LLAVA_PARSE_TIMEOUT", "30"))
+LLAVA_BATCH_SIZE = max(1, int(os.getenv("LLAVA_BATCH_SIZE", "1")))
+LLAVA_PDF_PAGES = os.getenv("LLAVA_PDF_PAGES", "false").lower() == "true"
+LLAVA_CACHE_MAX_BYTES = int(os.getenv("LLAVA_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+LLAVA_COOLDOWN = float(os.getenv("LLAVA_COOLDOWN", "30"))
+
+# Parser registry configuration
+# PARSER_FORMATS lists the filetypes this deployment parses ("all" for every
+# registered one) and PARSER_DISABLED_FORMATS removes some again; other
+# filetypes are rejected with 400. A format's libraries are imported when it
+# is first used, or at startup for every enabled format with PARSER_PRELOAD.
+PARSER_FORMATS = os.getenv("PARSER_FORMATS", "all")
+PARSER_DISABLED_FORMATS = os.getenv("PARSER_DISABLED_FORMATS", "")
+PARSER_PRELOAD = os.getenv("PARSER_PRELOAD", "false").lower() == "true"
+
+# PDF backend configuration
+# "pdfplumber" (layout analysis in Python, needed for table detection) or
+# "pymupdf" (MuPDF, much faster text extraction and rendering). Requests can
+# override it with pdf_backend.
+PDF_BACKEND = os.getenv("PDF_BACKEND", "pdfplumber").strip().lower()
+
+# PDF uploads with more pages than this are rejected by /parse
+PDF_UPLOAD_MAX_PAGES = 210
+
+# Parallel PDF OCR configuration
+# PDF_OCR_WORKERS > 0 sends image-only pages to a pool of tesseract worker
+# processes; PDF_OCR_PAGE_CONCURRENCY caps the pages one document has in flight.
+# PDFs parsed in the parse executor's processes (pdf in PARSE_PROCESS_FILETYPES)
+# instead OCR on PDF_OCR_PAGE_CONCURRENCY threads of each parse worker.
+PDF_OCR_WORKERS = int(os.getenv("PDF_OCR_WORKERS", "0"))
+PDF_OCR_PAGE_CONCURRENCY = int(os.getenv("PDF_OCR_PAGE_CONCURRENCY", "4"))
+
+# PDF table extraction configuration
+# With tables=markdown|csv, pages with ruling lines go through pdfplumber table
+# detection. PDF_TABLE_WORKERS > 0 spreads those pages over a pool of worker
+# processes, PDF_TABLE_PAGES_PER_TASK at a time; 0 runs them in the parse worker.
+# The pool only serves PDFs parsed in the server process: parse worker processes
+# (pdf in PARSE_PROCESS_FILETYPES) detect tables themselves, as pdfplumber holds
+# the GIL and gains nothing from threads there.
+PDF_TABLE_WORKERS = int(os.getenv("PDF_TABLE_WORKERS", "0"))
+PDF_TABLE_PAGES_PER_TASK = int(os.getenv("PDF_TABLE_PAGES_PER_TASK", "4"))
+
+# OCR engine configuration
+# OCR_ENGINE "auto" keeps a warm in-process Tesseract API (tesserocr) per
+# worker thread when the binding is installed and falls back to pytesseract,
+# which starts a tesseract process per image; "tesserocr" or "pytesseract"
+# choose one (tesserocr still falls back when missing). OCR_LANG and OCR_PSM
+# are Tesseract's language(s) and page segmentation mode; OCR_TESSDATA points
+# tesserocr at a tessdata directory (empty uses Tesseract's default).
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_PSM = int(os.getenv("OCR_PSM", "3"))
+OCR_TESSDATA = os.getenv("OCR_TESSDATA", "")
+
+# OCR rasterization configuration
+# Pages are rendered straight at the DPI that makes their longest side
+# OCR_TARGET_PX pixels, capped at OCR_MAX_DPI. OCR_COLOR_MODE is "gray",
+# "binary" (thresholded at OCR_BINARY_THRESHOLD) or "rgb".
+OCR_TARGET_PX = int(os.getenv("OCR_TARGET_PX", "1000"))
+OCR_MAX_DPI = float(os.getenv("OCR_MAX_DPI", "300"))
+OCR_COLOR_MODE = os.getenv("OCR_COLOR_MODE", "gray").lower()
+OCR_BINARY_THRESHOLD = int(os.getenv("OCR_BINARY_THRESHOLD", "160"))
+
+# PDF text-layer pre-scan configuration
+# Before extraction every page is classified from pdfium character counts and
+# page objects as "text", "mixed" (text over images covering at least
+# PDF_MIXED_IMAGE_COVERAGE of the page), "image" (no text layer, needs OCR) or
+# "empty". At most PDF_OCR_PAGE_BUDGET pages per document are OCR'd;
+# OCR_PAGE_COST_SECONDS is the per-page estimate reported in the OCR plan.
+PDF_OCR_PAGE_BUDGET = int(os.getenv("PDF_OCR_PAGE_BUDGET", "150"))
+PDF_MIXED_IMAGE_COVERAGE = float(os.getenv("PDF_MIXED_IMAGE_COVERAGE", "0.5"))
+OCR_PAGE_COST_SECONDS = float(os.getenv("OCR_PAGE_COST_SECONDS", "1.0"))
 
-app = FastAPI()
+# Upload configuration
+# Uploads are copied to disk in UPLOAD_CHUNK_SIZE pieces; request bodies larger
+# than MAX_UPLOAD_BYTES are rejected with 413 (0 disables the limit).
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+
+# Parse result cache configuration
+# Results are cached by content hash, filetype and parser options. The memory
+# tier is an LRU bounded by PARSE_CACHE_MAX_BYTES (0 disables it); setting
+# PARSE_CACHE_DB to a SQLite file path adds a disk tier that survives restarts.
+PARSE_CACHE_MAX_BYTES = int(os.getenv("PARSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PARSE_CACHE_DB = os.getenv("PARSE_CACHE_DB", "")
+# Bump when parser output changes so old cache entries are not served
+PARSE_CACHE_VERSION = 7
+
+# Legacy Office conversion configuration
+# SOFFICE_POOL_SIZE > 0 keeps that many headless LibreOffice listeners running
+# (on consecutive ports from SOFFICE_BASE_PORT) and sends unoconv conversions to
+# them; 0 starts a fresh LibreOffice through unoconv for every file.
+SOFFICE_POOL_SIZE = int(os.getenv("SOFFICE_POOL_SIZE", "0"))
+SOFFICE_BASE_PORT = int(os.getenv("SOFFICE_BASE_PORT", "2002"))
+SOFFICE_BINARY = os.getenv("SOFFICE_BINARY", "soffice")
+LEGACY_CONVERT_TIMEOUT = int(os.getenv("LEGACY_CONVERT_TIMEOUT", "120"))
+
+# Batch parsing configuration
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+# Background job configuration
+# POST /jobs queues a parse in the SQLite database JOBS_DB, worked off by
+# JOBS_WORKERS threads per process, independent of the HTTP workers (0 only
+# queues, for deployments where another process runs the workers). Finished
+# jobs are deleted JOBS_TTL_SECONDS after they end; jobs still marked running
+# with no update for JOBS_STALE_SECONDS are requeued when the workers start.
+JOBS_DB = os.getenv("JOBS_DB") or os.path.join(tempfile.gettempdir(), "docparser-jobs.sqlite3")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_TTL_SECONDS = int(os.getenv("JOBS_TTL_SECONDS", "86400"))
+JOBS_STALE_SECONDS = int(os.getenv("JOBS_STALE_SECONDS", "3600"))
+JOBS_CALLBACK_TIMEOUT = float(os.getenv("JOBS_CALLBACK_TIMEOUT", "10"))
+
+# Archive configuration
+# Guards against archive bombs: total decompressed bytes, member count and
+# nesting depth across the whole archive tree. Members are parsed in parallel
+# on ARCHIVE_WORKERS threads.
+ARCHIVE_MAX_TOTAL_BYTES = int(os.getenv("ARCHIVE_MAX_TOTAL_BYTES", str(500 * 1024 * 1024)))
+ARCHIVE_MAX_MEMBERS = int(os.getenv("ARCHIVE_MAX_MEMBERS", "1000"))
+ARCHIVE_MAX_DEPTH = int(os.getenv("ARCHIVE_MAX_DEPTH", "3"))
+ARCHIVE_WORKERS = int(os.getenv("ARCHIVE_WORKERS", "4"))
+
+# Mail configuration
+# Attachments of .eml, .msg and .mbox messages are parsed like archive members:
+# in parallel on the archive workers, at most ARCHIVE_WORKERS * 2 spooled to
+# disk at once, with attached messages and archives nested at most
+# ARCHIVE_MAX_DEPTH levels. MAIL_ATTACHMENTS=false keeps only
+# the headers and bodies.
+MAIL_ATTACHMENTS = os.getenv("MAIL_ATTACHMENTS", "true").lower() == "true"
+
+# Tabular (CSV/XLSX) configuration
+# CSV is read TABULAR_CHUNK_ROWS rows at a time and XLSX row by row. Output can
+# be limited to TABULAR_MAX_ROWS rows per table (0 for all) and sampled to every
+# TABULAR_SAMPLE_STEP-th row; row/column counts always cover the whole table.
+TABULAR_CHUNK_ROWS = int(os.getenv("TABULAR_CHUNK_ROWS", "50000"))
+TABULAR_MAX_ROWS = int(os.getenv("TABULAR_MAX_ROWS", "0"))
+TABULAR_SAMPLE_STEP = max(1, int(os.getenv("TABULAR_SAMPLE_STEP", "1")))
+
+# Response configuration
+# JSON is encoded with orjson when it is installed. Responses of at least
+# COMPRESS_MIN_BYTES (0 disables compression) are compressed with zstd (needs
+# the zstandard package) or gzip, as the request's Accept-Encoding allows.
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+ORJSON_AVAILABLE = importlib.util.find_spec("orjson") is not None
+ZSTD_AVAILABLE = importlib.util.find_spec("zstandard") is not None
+
+# Content handle configuration
+# With content_handle the parse response carries metadata and a handle instead
+# of the content. The content is kept in RESULTS_DIR for RESULTS_TTL_SECONDS
+# and served from /results/{id}/content whole, by PDF page (?pages=1-3) or by
+# byte range (Range header).
+RESULTS_DIR = os.getenv("RESULTS_DIR") or os.path.join(tempfile.gettempdir(), "docparser-results")
+RESULTS_TTL_SECONDS = int(os.getenv("RESULTS_TTL_SECONDS", "3600"))
+
+# Logging configuration
+# LOG_FORMAT is "text" or "json" (one object per line with the request ID and
+# any structured fields); LOG_QUEUE=true hands records to a background thread
+# so formatting and writing them happen off the request path.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_QUEUE = os.getenv("LOG_QUEUE", "false").lower() == "true"
+
+# Parse executor configuration
+# Parsing is offloaded from the event loop: CPU-bound filetypes go to a process
+# pool, everything else to a thread pool. PARSE_FILETYPE_LIMITS caps concurrent
+# parses per filetype (e.g. "pdf=2,doc=1").
+PARSE_THREAD_WORKERS = int(os.getenv("PARSE_THREAD_WORKERS", "4"))
+PARSE_PROCESS_WORKERS = int(os.getenv("PARSE_PROCESS_WORKERS", "2"))
+PARSE_PROCESS_FILETYPES = os.getenv("PARSE_PROCESS_FILETYPES", "pdf,png,jpg,jpeg")
+PARSE_MAX_QUEUE = int(os.getenv("PARSE_MAX_QUEUE", "32"))
+PARSE_FILETYPE_LIMITS = os.getenv("PARSE_FILETYPE_LIMITS", "pdf=2,doc=1,xls=1,ppt=1")
+PARSE_FILETYPE_MAX_WAITING = int(os.getenv("PARSE_FILETYPE_MAX_WAITING", "8"))
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+  warn_unused_pool_settings()
+  if PARSER_PRELOAD:
+    preload_formats()
+  # Pick up jobs queued before a restart
+  if JOBS_WORKERS > 0 and os.path.exists(JOBS_DB):
+    get_job_runner()
+  yield
+  shutdown_job_runner()
+  parse_executor.shutdown()
+  shutdown_ocr_pool()
+  shutdown_table_pool()
+  shutdown_soffice_pool()
+  await llava_client.aclose()
+  shutdown_logging()
+
+# JSON for responses and stream records; orjson is several times faster than
+# the stdlib encoder on multi-MB content and gives the same compact output
+def json_bytes(value) -> bytes:
+  if ORJSON_AVAILABLE:
+    return orjson.dumps(value, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+  return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=jsonable_encoder).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+  def render(self, content) -> bytes:
+    return json_bytes(content)
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 cors_urls = os.getenv("CORS_URLS", "*")
 if cors_urls.strip() == "*":
@@ -45,19 +332,1044 @@ app.add_middleware(
   allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-  level=logging.INFO,
-  format="%(asctime)s [%(levelname)s] %(message)s"
-)
-logger = logging.getLogger(__name__)
+class UploadTooLargeError(Exception):
+  pass
+
+# Rejects oversized request bodies with 413: up front from Content-Length, or
+# as soon as the streamed body crosses the limit, before it is fully received
+class MaxBodySizeMiddleware:
+  def __init__(self, app, max_bytes: int):
+    self.app = app
+    self.max_bytes = max_bytes
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http" or self.max_bytes <= 0:
+      await self.app(scope, receive, send)
+      return
+    for name, value in scope["headers"]:
+      if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+        await self._reject(send)
+        return
+
+    received = 0
+    exceeded = False
+    response_started = False
+
+    async def limited_receive():
+      nonlocal received, exceeded
+      message = await receive()
+      if message["type"] == "http.request":
+        received += len(message.get("body", b""))
+        if received > self.max_bytes:
+          exceeded = True
+          raise UploadTooLargeError()
+      return message
+
+    async def guarded_send(message):
+      nonlocal response_started
+      # Once the limit is hit the app's own error response is replaced by the 413
+      if exceeded:
+        return
+      if message["type"] == "http.response.start":
+        response_started = True
+      await send(message)
+
+    try:
+      await self.app(scope, limited_receive, guarded_send)
+    except Exception:
+      if not exceeded:
+        raise
+    if exceeded and not response_started:
+      await self._reject(send)
+
+  async def _reject(self, send):
+    response = JSONResponse(
+      status_code=413,
+      content={"detail": f"Request body exceeds the maximum upload size of {self.max_bytes} bytes."}
+    )
+    await response({"type": "http"}, None, send)
+
+app.add_middleware(MaxBodySizeMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+
+# Pick the response encoding from an Accept-Encoding header: the highest
+# q-value among the codings this server has, zstd before gzip on a tie
+def negotiate_encoding(accept_encoding: str):
+  accepted = {}
+  for item in accept_encoding.split(","):
+    coding, _, params = item.partition(";")
+    quality = 1.0
+    for param in params.split(";"):
+      name, _, value = param.strip().partition("=")
+      if name == "q":
+        try:
+          quality = float(value)
+        except ValueError:
+          quality = 0.0
+    accepted[coding.strip().lower()] = quality
+  available = ["zstd", "gzip"] if ZSTD_AVAILABLE else ["gzip"]
+  ranked = [(accepted.get(coding, accepted.get("*", 0.0)), -rank, coding) for rank, coding in enumerate(available)]
+  quality, _, coding = max(ranked)
+  return coding if quality > 0 else None
+
+# One response body's gzip or zstd stream
+class ResponseCompressor:
+  def __init__(self, encoding: str):
+    self.encoding = encoding
+    if encoding == "zstd":
+      self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+      self._sync_flush = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+    else:
+      self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+      self._sync_flush = zlib.Z_SYNC_FLUSH
+
+  # Compress a chunk; unless it is the last one, everything so far is flushed
+  # so the client can decode it straight away
+  def compress(self, data: bytes, final: bool) -> bytes:
+    output = self._compressor.compress(data)
+    return output + (self._compressor.flush() if final else self._compressor.flush(self._sync_flush))
+
+# Compresses responses of at least min_bytes as negotiated from
+# Accept-Encoding. Streamed bodies (NDJSON, files) are compressed chunk by chunk
+# and flushed, so records still arrive as they are produced. Server-sent
+# events, partial content and already encoded responses pass through. Large
+# chunks are compressed off the event loop.
+class CompressionMiddleware:
+  THREAD_MIN_BYTES = 256 * 1024
+
+  def __init__(self, app, min_bytes: int):
+    self.app = app
+    self.min_bytes = min_bytes
 
-# Ensure logs go to stdout in Docker
-if not logger.hasHandlers():
+  async def __call__(self, scope, receive, send):
+    encoding = None
+    if scope["type"] == "http" and self.min_bytes > 0:
+      for name, value in scope["headers"]:
+        if name == b"accept-encoding":
+          encoding = negotiate_encoding(value.decode("latin-1"))
+    if encoding is None:
+      await self.app(scope, receive, send)
+      return
+
+    start_message = None
+    compressor = None
+    passthrough = False
+
+    async def compress(data: bytes, final: bool) -> bytes:
+      if len(data) >= self.THREAD_MIN_BYTES:
+        return await run_in_threadpool(compressor.compress, data, final)
+      return compressor.compress(data, final)
+
+    async def compressing_send(message):
+      nonlocal start_message, compressor, passthrough
+      if passthrough:
+        await send(message)
+        return
+      if message["type"] == "http.response.start":
+        start_message = message
+        return
+      body = message.get("body", b"")
+      more_body = message.get("more_body", False)
+      if compressor is None:
+        headers = MutableHeaders(raw=start_message["headers"])
+        if (
+          start_message["status"] in {204, 206, 304} or "content-encoding" in headers
+          or "content-range" in headers or headers.get("content-type", "").startswith("text/event-stream")
+          or (not more_body and len(body) < self.min_bytes)
+        ):
+          passthrough = True
+          await send(start_message)
+          await send(message)
+          return
+        compressor = ResponseCompressor(encoding)
+        headers["Content-Encoding"] = encoding
+        headers.add_vary_header("Accept-Encoding")
+        if not more_body:
+          body = await compress(body, True)
+          headers["Content-Length"] = str(len(body))
+          await send(start_message)
+          await send({"type": "http.response.body", "body": body})
+          return
+        if "content-length" in headers:
+          del headers["Content-Length"]
+        await send(start_message)
+      await send({"type": "http.response.body", "body": await compress(body, not more_body), "more_body": more_body})
+
+    await self.app(scope, receive, compressing_send)
+
+app.add_middleware(CompressionMiddleware, min_bytes=COMPRESS_MIN_BYTES)
+
+# Request ID of the request being served; attached to every log record and
+# carried into the executor workers that parse for it
+_request_id = contextvars.ContextVar("request_id", default="-")
+
+class RequestIdFilter(logging.Filter):
+  def filter(self, record):
+    record.request_id = _request_id.get()
+    return True
+
+# Attributes every LogRecord has; anything else on a record was passed in extra=
+_LOG_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+# One JSON object per line, including any fields passed in extra=
+class JsonLogFormatter(logging.Formatter):
+  def format(self, record):
+    entry = {
+      "time": self.formatTime(record),
+      "level": record.levelname,
+      "logger": record.name,
+      "request_id": getattr(record, "request_id", "-"),
+      "message": record.getMessage(),
+    }
+    for key, value in vars(record).items():
+      if key not in _LOG_RECORD_FIELDS:
+        entry[key] = value
+    if record.exc_info:
+      entry["exc_info"] = self.formatException(record.exc_info)
+    return json.dumps(entry, default=str)
+
+_log_listener = None
+
+# Configure the root logger unless something (uvicorn --log-config, pytest)
+# already installed handlers. With LOG_QUEUE the handler only enqueues records
+# and a listener thread writes them out.
+def configure_logging():
+  global _log_listener
+  root = logging.getLogger()
+  root.setLevel(LOG_LEVEL)
+  if root.handlers:
+    return
   handler = logging.StreamHandler()
-  handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
-  logger.addHandler(handler)
-logger.setLevel(logging.INFO)
+  if LOG_FORMAT == "json":
+    handler.setFormatter(JsonLogFormatter())
+  else:
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] [%(request_id)s] %(message)s"))
+  if LOG_QUEUE:
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # The filter runs in the thread that logs, where the request ID is set
+    queue_handler.addFilter(RequestIdFilter())
+    _log_listener = logging.handlers.QueueListener(log_queue, handler)
+    _log_listener.start()
+    root.addHandler(queue_handler)
+  else:
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+
+# Process pool initializer: a forked worker has no listener thread draining the
+# log queue, so it writes to the stream handler directly
+def init_worker_logging():
+  global _log_listener
+  if _log_listener is None:
+    return
+  root = logging.getLogger()
+  for handler in list(root.handlers):
+    if isinstance(handler, logging.handlers.QueueHandler):
+      root.removeHandler(handler)
+  for handler in _log_listener.handlers:
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+  _log_listener = None
+
+# Set in the parse executor's worker processes. Process pools nested in every
+# worker would multiply the processes per CPU and outlive the lifespan
+# shutdown, so workers use threads of their own for that work instead.
+_in_parse_worker = False
+
+def init_parse_worker():
+  global _in_parse_worker, _ocr_pool
+  _in_parse_worker = True
+  # A pool forked from the server process belongs to the server
+  _ocr_pool = None
+  init_worker_logging()
+
+def shutdown_logging():
+  global _log_listener
+  if _log_listener is not None:
+    _log_listener.stop()
+    _log_listener = None
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Run fn with the given request ID, for work handed to another thread or process
+def call_with_request_id(request_id: str, fn, *args):
+  token = _request_id.set(request_id)
+  try:
+    return fn(*args)
+  finally:
+    _request_id.reset(token)
+
+# Takes the request ID from X-Request-ID (or generates one) and echoes it back
+class RequestIdMiddleware:
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    request_id = None
+    for name, value in scope["headers"]:
+      if name == b"x-request-id":
+        request_id = value.decode("latin-1")[:128]
+        break
+    if not request_id or not request_id.isprintable():
+      request_id = uuid.uuid4().hex
+
+    async def send_with_request_id(message):
+      if message["type"] == "http.response.start":
+        message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+      await send(message)
+
+    token = _request_id.set(request_id)
+    try:
+      await self.app(scope, receive, send_with_request_id)
+    finally:
+      _request_id.reset(token)
+
+# Minimal Prometheus-style metrics kept in process and rendered in the text
+# exposition format by /metrics
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def format_metric_value(value) -> str:
+  value = float(value)
+  return str(int(value)) if value.is_integer() else repr(value)
+
+def format_metric_labels(labels: tuple) -> str:
+  if not labels:
+    return ""
+  parts = []
+  for name, value in labels:
+    value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    parts.append(f'{name}="{value}"')
+  return "{" + ",".join(parts) + "}"
+
+class Metric:
+  kind = "untyped"
+
+  def __init__(self, name: str, help_text: str):
+    self.name = name
+    self.help_text = help_text
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def _add(self, amount: float, labels: dict):
+    key = tuple(sorted(labels.items()))
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def value(self, **labels):
+    with self._lock:
+      return self._values.get(tuple(sorted(labels.items())), 0)
+
+  def samples(self) -> list:
+    with self._lock:
+      items = sorted(self._values.items())
+    return [f"{self.name}{format_metric_labels(labels)} {format_metric_value(value)}" for labels, value in items]
+
+  def render(self) -> list:
+    return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+class Counter(Metric):
+  kind = "counter"
+
+  def inc(self, amount: float = 1, **labels):
+    self._add(amount, labels)
+
+class Gauge(Metric):
+  kind = "gauge"
+
+  def inc(self, amount: float = 1, **labels):
+    self._add(amount, labels)
+
+  def dec(self, amount: float = 1, **labels):
+    self._add(-amount, labels)
+
+class Histogram(Metric):
+  kind = "histogram"
+
+  def __init__(self, name: str, help_text: str, buckets: tuple = STAGE_BUCKETS):
+    super().__init__(name, help_text)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe(self, value: float, **labels):
+    key = tuple(sorted(labels.items()))
+    with self._lock:
+      entry = self._values.get(key)
+      if entry is None:
+        # Per-bucket counts (cumulated when rendered), then sum and count
+        entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+      for i, bound in enumerate(self.buckets):
+        if value <= bound:
+          entry[0][i] += 1
+          break
+      entry[1] += value
+      entry[2] += 1
+
+  def value(self, **labels):
+    with self._lock:
+      entry = self._values.get(tuple(sorted(labels.items())))
+      return (entry[1], entry[2]) if entry else (0.0, 0)
+
+  def samples(self) -> list:
+    with self._lock:
+      items = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self._values.items())
+    lines = []
+    for labels, (counts, total, count) in items:
+      cumulative = 0
+      for bound, bucket_count in zip(self.buckets, counts):
+        cumulative += bucket_count
+        bucket_labels = labels + (("le", format_metric_value(bound)),)
+        lines.append(f"{self.name}_bucket{format_metric_labels(bucket_labels)} {cumulative}")
+      lines.append(f"{self.name}_bucket{format_metric_labels(labels + (('le', '+Inf'),))} {count}")
+      lines.append(f"{self.name}_sum{format_metric_labels(labels)} {format_metric_value(total)}")
+      lines.append(f"{self.name}_count{format_metric_labels(labels)} {count}")
+    return lines
+
+class MetricsRegistry:
+  def __init__(self):
+    self.metrics = []
+
+  def register(self, metric: Metric) -> Metric:
+    self.metrics.append(metric)
+    return metric
+
+  def render(self) -> str:
+    lines = []
+    for metric in self.metrics:
+      lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+stage_duration = metrics.register(Histogram(
+  "docparser_stage_duration_seconds", "Time spent in each parse stage, by filetype and stage."
+))
+parse_errors = metrics.register(Counter(
+  "docparser_parse_errors_total", "Parses that were rejected or failed, by filetype and kind."
+))
+pdf_pages = metrics.register(Counter(
+  "docparser_pdf_pages_total", "PDF pages processed, by how their text was obtained (text, ocr, vision, ocr_failed, ocr_skipped, empty)."
+))
+requests_in_flight = metrics.register(Gauge(
+  "docparser_http_requests_in_flight", "HTTP requests currently being served."
+))
+parses_in_flight = metrics.register(Gauge(
+  "docparser_parses_in_flight", "Parses admitted to the executor (running or waiting for a slot), by filetype."
+))
+
+# Stage timings for one parse. They are collected where the work runs, which
+# may be a process pool worker, and folded into the metrics by the caller.
+class StageTimings:
+  def __init__(self):
+    self.stages = {}
+    self.counts = {}
+
+  def add(self, stage: str, seconds: float):
+    self.stages.setdefault(stage, []).append(seconds)
+
+  def count(self, name: str, amount: int = 1):
+    self.counts[name] = self.counts.get(name, 0) + amount
+
+  def merge(self, other: "StageTimings"):
+    for stage, durations in other.stages.items():
+      self.stages.setdefault(stage, []).extend(durations)
+    for name, amount in other.counts.items():
+      self.count(name, amount)
+
+  def as_dict(self) -> dict:
+    return {
+      "stages": {
+        stage: {"count": len(durations), "seconds": round(sum(durations), 6)}
+        for stage, durations in self.stages.items()
+      },
+      "counts": dict(self.counts),
+    }
+
+_stage_timings = contextvars.ContextVar("stage_timings", default=None)
+
+def record_stage(stage: str, seconds: float):
+  timings = _stage_timings.get()
+  if timings is not None:
+    timings.add(stage, seconds)
+
+def record_count(name: str, amount: int = 1):
+  timings = _stage_timings.get()
+  if timings is not None:
+    timings.count(name, amount)
+
+@contextlib.contextmanager
+def timed_stage(stage: str):
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    record_stage(stage, time.perf_counter() - start)
+
+def observe_timings(filetype: str, timings: StageTimings):
+  for stage, durations in timings.stages.items():
+    for seconds in durations:
+      stage_duration.observe(seconds, filetype=filetype, stage=stage)
+  for name, amount in timings.counts.items():
+    if name.startswith("pdf_pages_"):
+      pdf_pages.inc(amount, source=name[len("pdf_pages_"):])
+
+# Counts requests in flight, including ones rejected by the body size limit
+class MetricsMiddleware:
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    requests_in_flight.inc()
+    try:
+      await self.app(scope, receive, send)
+    finally:
+      requests_in_flight.dec()
+
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+
+# Concurrency limiter usable from any event loop; waiters beyond max_waiting are rejected
+class ConcurrencyLimitError(Exception):
+  pass
+
+class ConcurrencyLimiter:
+  def __init__(self, limit: int, max_waiting: int):
+    self.limit = limit
+    self.max_waiting = max_waiting
+    self.active = 0
+    self._waiters = collections.deque()
+    self._lock = threading.Lock()
+
+  async def acquire(self):
+    with self._lock:
+      if self.active < self.limit and not self._waiters:
+        self.active += 1
+        return
+      if len(self._waiters) >= self.max_waiting:
+        raise ConcurrencyLimitError()
+      waiter = asyncio.get_running_loop().create_future()
+      self._waiters.append(waiter)
+    try:
+      await waiter
+    except asyncio.CancelledError:
+      with self._lock:
+        granted = waiter not in self._waiters
+        if not granted:
+          self._waiters.remove(waiter)
+      # A slot handed to a cancelled waiter is released by _wake instead
+      if granted and not waiter.cancelled():
+        self.release()
+      raise
+
+  def release(self):
+    with self._lock:
+      if self._waiters:
+        # Hand the slot straight to the next waiter; active stays the same
+        waiter = self._waiters.popleft()
+        waiter.get_loop().call_soon_threadsafe(self._wake, waiter)
+        return
+      self.active -= 1
+
+  def _wake(self, waiter):
+    if waiter.cancelled():
+      self.release()
+    else:
+      waiter.set_result(None)
+
+def parse_filetype_limits(value: str) -> dict:
+  limits = {}
+  for item in value.split(","):
+    if "=" not in item:
+      continue
+    filetype, limit = item.split("=", 1)
+    limits[filetype.strip().lower()] = int(limit)
+  return limits
+
+_STREAM_END = object()
+
+# Executor layer keeping blocking parsers off the event loop
+class ParseExecutor:
+  def __init__(
+    self,
+    thread_workers: int = PARSE_THREAD_WORKERS,
+    process_workers: int = PARSE_PROCESS_WORKERS,
+    process_filetypes: str = PARSE_PROCESS_FILETYPES,
+    max_queue: int = PARSE_MAX_QUEUE,
+    filetype_limits: str = PARSE_FILETYPE_LIMITS,
+    filetype_max_waiting: int = PARSE_FILETYPE_MAX_WAITING,
+  ):
+    self.thread_workers = thread_workers
+    self.process_workers = process_workers
+    self.process_filetypes = {ft.strip().lower() for ft in process_filetypes.split(",") if ft.strip()}
+    self.max_queue = max_queue
+    self.limiters = {
+      filetype: ConcurrencyLimiter(limit, filetype_max_waiting)
+      for filetype, limit in parse_filetype_limits(filetype_limits).items()
+    }
+    self.pending = 0
+    self._lock = threading.Lock()
+    self._thread_pool = None
+    self._process_pool = None
+
+  @property
+  def capacity(self) -> int:
+    return self.thread_workers + self.process_workers + self.max_queue
+
+  def _pool_for(self, filetype: str):
+    if self.process_workers > 0 and filetype in self.process_filetypes:
+      if self._process_pool is None:
+        self._process_pool = ProcessPoolExecutor(max_workers=self.process_workers, initializer=init_parse_worker)
+      return self._process_pool
+    return self._get_thread_pool()
+
+  def _get_thread_pool(self):
+    if self._thread_pool is None:
+      self._thread_pool = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix="parse")
+    return self._thread_pool
+
+  async def _submit(self, filetype: str, fn, *args):
+    pool = self._pool_for(filetype)
+    try:
+      return await asyncio.get_running_loop().run_in_executor(pool, call_with_request_id, _request_id.get(), fn, *args)
+    except BrokenProcessPool:
+      # A crashed worker poisons the pool; start a fresh one on the next request
+      logger.error("Parse process pool is broken, it will be recreated")
+      if pool is self._process_pool:
+        self._process_pool = None
+      raise
+
+  # Admission for one parse: 503 when the global queue is full, 429 when too
+  # many requests for a limited filetype are already waiting
+  @contextlib.asynccontextmanager
+  async def slot(self, filetype: str):
+    with self._lock:
+      if self.pending >= self.capacity:
+        logger.warning("Parse queue full (%s pending), rejecting %s request", self.pending, filetype)
+        raise HTTPException(
+          status_code=503,
+          detail="Server is busy parsing other files. Please retry later.",
+          headers={"Retry-After": "5"}
+        )
+      self.pending += 1
+    parses_in_flight.inc(filetype=filetype)
+    try:
+      limiter = self.limiters.get(filetype)
+      if limiter is not None:
+        try:
+          await limiter.acquire()
+        except ConcurrencyLimitError:
+          logger.warning("Too many concurrent %s parses, rejecting request", filetype)
+          raise HTTPException(
+            status_code=429,
+            detail=f"Too many concurrent .{filetype} files being parsed. Please retry later.",
+            headers={"Retry-After": "5"}
+          )
+      try:
+        yield
+      finally:
+        if limiter is not None:
+          limiter.release()
+    finally:
+      parses_in_flight.dec(filetype=filetype)
+      with self._lock:
+        self.pending -= 1
+
+  async def run(self, filetype: str, fn, *args):
+    async with self.slot(filetype):
+      return await self._submit(filetype, fn, *args)
+
+  # Drive a synchronous generator in the thread pool, yielding its items as
+  # they are produced; the slot is held until the stream is exhausted or closed.
+  # Every step runs in a copy of the caller's context, so context variables
+  # such as the stage timings follow the generator from thread to thread.
+  async def stream(self, filetype: str, gen_fn, *args):
+    async with self.slot(filetype):
+      loop = asyncio.get_running_loop()
+      # Generators cannot cross process boundaries, so streams always use threads
+      pool = self._get_thread_pool()
+      context = contextvars.copy_context()
+      iterator = gen_fn(*args)
+      try:
+        while True:
+          item = await loop.run_in_executor(pool, context.run, next, iterator, _STREAM_END)
+          if item is _STREAM_END:
+            return
+          yield item
+      finally:
+        # Fails only if a cancelled next() is still running; the generator is then closed on collection
+        with contextlib.suppress(ValueError):
+          iterator.close()
+
+  def shutdown(self):
+    for pool in (self._thread_pool, self._process_pool):
+      if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    self._thread_pool = None
+    self._process_pool = None
+
+parse_executor = ParseExecutor()
+
+# In-memory LRU cache evicting least recently used entries beyond max_bytes
+class LRUCache:
+  def __init__(self, max_bytes: int):
+    self.max_bytes = max_bytes
+    self.current_bytes = 0
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      self._entries.move_to_end(key)
+      return entry[0]
+
+  def set(self, key, value, size: int):
+    if size > self.max_bytes:
+      return
+    with self._lock:
+      old = self._entries.pop(key, None)
+      if old is not None:
+        self.current_bytes -= old[1]
+      self._entries[key] = (value, size)
+      self.current_bytes += size
+      while self.current_bytes > self.max_bytes:
+        _, (_, evicted_size) = self._entries.popitem(last=False)
+        self.current_bytes -= evicted_size
+
+# SQLite-backed disk tier for the parse result cache
+class SqliteCacheStore:
+  def __init__(self, path: str):
+    self.path = path
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    with self._lock, self._conn:
+      self._conn.execute(
+        "CREATE TABLE IF NOT EXISTS parse_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+      )
+
+  def get(self, key: str):
+    with self._lock:
+      row = self._conn.execute("SELECT value FROM parse_cache WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+  def set(self, key: str, value: dict):
+    with self._lock, self._conn:
+      self._conn.execute(
+        "INSERT OR REPLACE INTO parse_cache (key, value, created_at) VALUES (?, ?, ?)",
+        (key, json.dumps(value), time.time())
+      )
+
+# Content-addressed cache of {filetype, metadata, content} parse results
+class ParseResultCache:
+  def __init__(self, max_bytes: int = PARSE_CACHE_MAX_BYTES, db_path: str = PARSE_CACHE_DB):
+    self.memory = LRUCache(max_bytes) if max_bytes > 0 else None
+    self.disk = SqliteCacheStore(db_path) if db_path else None
+    self.hits = 0
+    self.misses = 0
+    self.disk_hits = 0
+    # (path, mtime, size) -> content hash, so unchanged files are not re-hashed
+    self._path_hashes = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  @property
+  def enabled(self) -> bool:
+    return self.memory is not None or self.disk is not None
+
+  def key(self, content_hash: str, filetype: str, options: dict) -> str:
+    raw = json.dumps([PARSE_CACHE_VERSION, content_hash, filetype, options], sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+  def get(self, key: str):
+    value = self.memory.get(key) if self.memory is not None else None
+    if value is None and self.disk is not None:
+      value = self.disk.get(key)
+      if value is not None:
+        with self._lock:
+          self.disk_hits += 1
+        if self.memory is not None:
+          self.memory.set(key, value, result_size(value))
+    with self._lock:
+      if value is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+    return value
+
+  def set(self, key: str, value: dict):
+    if self.memory is not None:
+      self.memory.set(key, value, result_size(value))
+    if self.disk is not None:
+      self.disk.set(key, value)
+
+  def hash_path(self, file_path: str) -> str:
+    st = os.stat(file_path)
+    index_key = (os.path.realpath(file_path), st.st_mtime_ns, st.st_size)
+    with self._lock:
+      content_hash = self._path_hashes.get(index_key)
+      if content_hash is not None:
+        self._path_hashes.move_to_end(index_key)
+        return content_hash
+    content_hash = hash_file(file_path)
+    with self._lock:
+      self._path_hashes[index_key] = content_hash
+      if len(self._path_hashes) > 10000:
+        self._path_hashes.popitem(last=False)
+    return content_hash
+
+  def stats(self) -> dict:
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "disk_hits": self.disk_hits,
+      "memory_entries": len(self.memory) if self.memory is not None else 0,
+      "memory_bytes": self.memory.current_bytes if self.memory is not None else 0,
+      "memory_max_bytes": self.memory.max_bytes if self.memory is not None else 0,
+      "disk_enabled": self.disk is not None,
+    }
+
+def result_size(value: dict) -> int:
+  return len(value.get("content", "")) + len(json.dumps(value.get("metadata", {})))
+
+def hash_file(file_path: str) -> str:
+  digest = hashlib.sha256()
+  with open(file_path, "rb") as f:
+    for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+# Settings that change parser output for a filetype and so belong in the cache key
+def parser_options(filetype: str) -> dict:
+  options = {}
+  if filetype in {"png", "jpg", "jpeg"}:
+    options["llava"] = LLAVA_USE
+    options["ocr_lang"] = OCR_LANG
+    options["ocr_psm"] = OCR_PSM
+  elif filetype == "pdf":
+    options["pdf_backend"] = PDF_BACKEND
+    options["ocr_lang"] = OCR_LANG
+    options["ocr_psm"] = OCR_PSM
+    options["ocr_page_budget"] = PDF_OCR_PAGE_BUDGET
+    options["ocr_target_px"] = OCR_TARGET_PX
+    options["ocr_max_dpi"] = OCR_MAX_DPI
+    options["ocr_color_mode"] = OCR_COLOR_MODE
+    options["llava"] = LLAVA_USE and LLAVA_PDF_PAGES
+  elif filetype in {"csv", "xlsx", "xls"}:
+    options["max_rows"] = TABULAR_MAX_ROWS
+    options["sample_step"] = TABULAR_SAMPLE_STEP
+  elif filetype in ARCHIVE_FILETYPES | MAIL_FILETYPES:
+    options = container_options()
+  if options.get("llava"):
+    options["llava_model"] = LLAVA_MODEL_NAME
+    options["llava_prompt"] = LLAVA_PROMPT
+  return options
+
+# Archive members and mail attachments go through every enabled parser, so a
+# container's output depends on all of their options, on which formats are
+# enabled and on the walk limits
+def container_options() -> dict:
+  containers = ARCHIVE_FILETYPES | MAIL_FILETYPES
+  return {
+    "formats": {
+      filetype: {} if filetype in containers else parser_options(filetype)
+      for filetype in sorted(enabled_filetypes())
+    },
+    "attachments": MAIL_ATTACHMENTS,
+    "archive_limits": [ARCHIVE_MAX_TOTAL_BYTES, ARCHIVE_MAX_MEMBERS, ARCHIVE_MAX_DEPTH],
+  }
+
+result_cache = ParseResultCache()
+
+# Parse results kept on disk behind a handle, so large content can be fetched
+# whole, by PDF page or by byte range instead of inside the parse response.
+# Each handle is a UTF-8 content file plus a JSON index with the byte offset of
+# every page; both are removed once older than the TTL.
+class ResultStore:
+  def __init__(self, directory: str = RESULTS_DIR, ttl: int = RESULTS_TTL_SECONDS):
+    self.directory = directory
+    self.ttl = ttl
+    self._last_sweep = 0.0
+    self._lock = threading.Lock()
+
+  def _path(self, handle: str, suffix: str) -> str:
+    if not re.fullmatch(r"[0-9a-f]{32}", handle):
+      raise KeyError(handle)
+    return os.path.join(self.directory, handle + suffix)
+
+  # page_offsets are the character offsets where each page starts
+  def put(self, content: str, page_offsets: list = None) -> dict:
+    os.makedirs(self.directory, exist_ok=True)
+    self.sweep()
+    handle = uuid.uuid4().hex
+    data = content.encode("utf-8")
+    index = {"bytes": len(data), "chars": len(content), "created_at": time.time()}
+    if page_offsets is not None:
+      byte_offsets = []
+      position = previous = 0
+      for offset in page_offsets:
+        position += len(content[previous:offset].encode("utf-8"))
+        previous = offset
+        byte_offsets.append(position)
+      index["page_offsets"] = byte_offsets
+    for suffix, payload in [(".txt", data), (".json", json_bytes(index))]:
+      tmp_path = self._path(handle, suffix) + ".tmp"
+      with open(tmp_path, "wb") as f:
+        f.write(payload)
+      os.replace(tmp_path, self._path(handle, suffix))
+    return self.describe(handle, index)
+
+  def describe(self, handle: str, index: dict) -> dict:
+    offsets = index.get("page_offsets")
+    return {
+      "id": handle,
+      "url": f"/results/{handle}/content",
+      "bytes": index["bytes"],
+      "chars": index["chars"],
+      "pages": len(offsets) if offsets is not None else None,
+      "expires_at": index["created_at"] + self.ttl,
+    }
+
+  # The index of a live handle; raises KeyError when unknown or expired
+  def index(self, handle: str) -> dict:
+    try:
+      with open(self._path(handle, ".json"), "rb") as f:
+        index = json.loads(f.read())
+    except FileNotFoundError:
+      raise KeyError(handle)
+    if index["created_at"] + self.ttl < time.time():
+      self.delete(handle)
+      raise KeyError(handle)
+    return index
+
+  def content_path(self, handle: str) -> str:
+    return self._path(handle, ".txt")
+
+  # Bytes of the pages in ranges, as (first, last) page numbers
+  def read_pages(self, handle: str, index: dict, ranges: list) -> bytes:
+    offsets = index.get("page_offsets")
+    if offsets is None:
+      raise ValueError("This result has no pages.")
+    bounds = offsets + [index["bytes"]]
+    chunks = []
+    with open(self.content_path(handle), "rb") as f:
+      for first, last in ranges:
+        if last > len(offsets):
+          raise ValueError(f"Page range {first}-{last} is past the last page ({len(offsets)}).")
+        f.seek(bounds[first - 1])
+        chunks.append(f.read(bounds[last] - bounds[first - 1]))
+    return b"".join(chunks)
+
+  def delete(self, handle: str) -> bool:
+    removed = False
+    for suffix in (".txt", ".json"):
+      try:
+        os.remove(self._path(handle, suffix))
+        removed = True
+      except FileNotFoundError:
+        pass
+    return removed
+
+  # Remove expired results, at most once a minute
+  def sweep(self):
+    now = time.time()
+    with self._lock:
+      if now - self._last_sweep < 60:
+        return
+      self._last_sweep = now
+    for entry in os.scandir(self.directory):
+      try:
+        if entry.stat().st_mtime + self.ttl < now:
+          os.remove(entry.path)
+      except OSError:
+        pass
+
+result_store = ResultStore()
+
+# Body of a parse response: the content inline, or with content_handle only a
+# handle to fetch it from /results/{id}/content
+async def parse_response_body(
+  filename: str, filetype: str, metadata: dict, parsed_content: str, content_handle: bool = False
+) -> dict:
+  response = {"filename": filename, "filetype": filetype, "metadata": metadata}
+  if not content_handle:
+    response["content"] = parsed_content
+    return response
+  page_stats = metadata.get("page_stats") or []
+  page_offsets = [stats["offset"] for stats in page_stats] if all("offset" in stats for stats in page_stats) else None
+  response["content_handle"] = await run_in_threadpool(result_store.put, parsed_content, page_offsets or None)
+  return response
+
+# Worker entry point: parse_document plus the stage timings recorded while it ran
+def timed_parse_document(file_path: str, filetype: str, *args) -> tuple:
+  timings = StageTimings()
+  token = _stage_timings.set(timings)
+  try:
+    parsed_content, metadata = parse_document(file_path, filetype, *args)
+  finally:
+    _stage_timings.reset(token)
+  return parsed_content, metadata, timings
+
+# Run parse_document in the executor, feed its timings into the metrics and
+# into the caller's timings, if it collects any. worker is the executor entry
+# point, called as worker(file_path, filetype, *args).
+async def run_parse(file_path: str, filetype: str, *args, worker=timed_parse_document) -> tuple:
+  try:
+    parsed_content, metadata, timings = await parse_executor.run(filetype, worker, file_path, filetype, *args)
+  except HTTPException:
+    raise
+  except DocumentRejectedError:
+    parse_errors.inc(filetype=filetype, kind="rejected")
+    raise
+  except Exception:
+    parse_errors.inc(filetype=filetype, kind="failed")
+    raise
+  observe_timings(filetype, timings)
+  current = _stage_timings.get()
+  if current is not None:
+    current.merge(timings)
+  return parsed_content, metadata
+
+# Serve a parse result from the cache or run parse_document and store the result
+async def cached_parse(
+  file_path: str, filetype: str, content_hash: str, max_pdf_pages: int = None,
+  tables: dict = None, pdf_backend: str = None, worker=timed_parse_document
+) -> tuple:
+  args = (max_pdf_pages, tables, pdf_backend) if tables or pdf_backend else (max_pdf_pages,)
+  if not result_cache.enabled:
+    return await run_parse(file_path, filetype, *args, worker=worker)
+  options = parser_options(filetype)
+  if tables:
+    options["tables"] = tables
+  if pdf_backend:
+    options["pdf_backend"] = pdf_backend
+  key = result_cache.key(content_hash, filetype, options)
+  cached = await run_in_threadpool(result_cache.get, key)
+  # The page limit differs between endpoints and is not part of the key, so it
+  # is checked against the cached page count; without one the file is parsed
+  if cached is not None and filetype == "pdf" and max_pdf_pages is not None:
+    page_count = cached["metadata"].get("page_count")
+    if page_count is None:
+      cached = None
+    else:
+      check_pdf_page_limit(page_count, max_pdf_pages)
+  if cached is not None:
+    logger.debug("Parse cache hit for %s", file_path)
+    record_count("cache_hits")
+    return cached["content"], cached["metadata"]
+  parsed_content, metadata = await run_parse(file_path, filetype, *args, worker=worker)
+  # Parsers return "" on failure, which is not worth caching
+  if parsed_content:
+    await run_in_threadpool(
+      result_cache.set, key, {"filetype": filetype, "metadata": metadata, "content": parsed_content}
+    )
+  return parsed_content, metadata
 
 @app.get("/")
 def read_root():
@@ -65,7 +1377,7 @@ def read_root():
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
-  logger.error(f"Unhandled error: {exc}", exc_info=True)
+  logger.error("Unhandled error: %s", exc, exc_info=True)
   return JSONResponse(
     status_code=500,
     content={"detail": "Internal server error."}
@@ -77,8 +1389,11 @@ def get_file_size(file_path: str) -> int:
   except Exception:
     return 0
 
-def get_pdf_page_count(file_path: str) -> int:
+def get_pdf_page_count(file_path: str, backend: str = None) -> int:
   try:
+    if (backend or PDF_BACKEND) == "pymupdf":
+      with _mupdf_lock, pymupdf.open(file_path, filetype="pdf") as document:
+        return document.page_count
     with pdfplumber.open(file_path) as pdf:
       return len(pdf.pages)
   except Exception:
@@ -91,22 +1406,43 @@ def get_pptx_slide_count(file_path: str) -> int:
   except Exception:
     return 0
 
+def get_archive_member_count(file_path: str, filetype: str) -> int:
+  try:
+    if filetype == "zip":
+      with zipfile.ZipFile(file_path) as zf:
+        return sum(1 for info in zf.infolist() if not info.is_dir())
+    with tarfile.open(file_path, mode="r|*") as tf:
+      return sum(1 for member in tf if member.isfile())
+  except Exception:
+    return 0
+
 def get_csv_shape(file_path: str) -> dict:
   try:
-    df = pd.read_csv(file_path)
-    return {"rows": df.shape[0], "columns": df.shape[1]}
+    shape = {"rows": 0, "columns": 0}
+    for chunk in read_csv_chunks(file_path):
+      shape["rows"] += len(chunk)
+      shape["columns"] = chunk.shape[1]
+    return shape
   except Exception:
     return {"rows": 0, "columns": 0}
 
 def get_xlsx_shape(file_path: str) -> dict:
   try:
-    df = pd.read_excel(file_path, engine="openpyxl")
-    return {"rows": df.shape[0], "columns": df.shape[1]}
+    stats = {}
+    for _ in iter_xlsx_sheets(file_path, stats, emit=False):
+      pass
+    return stats
   except Exception:
     return {"rows": 0, "columns": 0}
 
+ARCHIVE_FILETYPES = {"zip", "tar", "tgz"}
+MAIL_FILETYPES = {"eml", "msg", "mbox"}
+
 # File type detection utility
 def detect_file_type(filename: str) -> str:
+  # Compressed tarballs are reported as "tar" rather than by their last extension
+  if filename.lower().endswith((".tar.gz", ".tar.bz2", ".tar.xz")):
+    return "tar"
   ext = os.path.splitext(filename)[1].lower()
   if ext.startswith("."):
     ext = ext[1:]
@@ -119,24 +1455,149 @@ def parse_docx(file_path: str) -> str:
     text = "\n".join([para.text for para in doc.paragraphs])
     return text
   except Exception as e:
-    logger.error(f"Error parsing .docx: {e}", exc_info=True)
+    logger.error("Error parsing .docx: %s", e, exc_info=True)
     return ""
 
+# Long-lived headless LibreOffice process accepting UNO connections on a local port
+class SofficeListener:
+  def __init__(self, port: int):
+    self.port = port
+    self.process = None
+    self.profile_dir = None
+
+  @property
+  def connection(self) -> str:
+    return f"socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"
+
+  def start(self, startup_timeout: float = 30):
+    # A private profile per listener avoids lock contention between instances
+    self.profile_dir = tempfile.mkdtemp(prefix=f"soffice-{self.port}-")
+    self.process = subprocess.Popen(
+      [
+        SOFFICE_BINARY, "--headless", "--invisible", "--nologo", "--norestore", "--nodefault",
+        f"-env:UserInstallation=file://{self.profile_dir}",
+        f"--accept={self.connection}",
+      ],
+      stdout=subprocess.DEVNULL,
+      stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + startup_timeout
+    while not self.is_healthy():
+      if self.process.poll() is not None or time.monotonic() > deadline:
+        self.stop()
+        raise RuntimeError(f"LibreOffice listener on port {self.port} failed to start")
+      time.sleep(0.2)
+    logger.info("Started LibreOffice listener on port %s", self.port)
+
+  def is_healthy(self) -> bool:
+    if self.process is None or self.process.poll() is not None:
+      return False
+    try:
+      with socket.create_connection(("127.0.0.1", self.port), timeout=1):
+        return True
+    except OSError:
+      return False
+
+  def stop(self):
+    if self.process is not None and self.process.poll() is None:
+      self.process.terminate()
+      try:
+        self.process.wait(timeout=5)
+      except subprocess.TimeoutExpired:
+        self.process.kill()
+        self.process.wait()
+    self.process = None
+    if self.profile_dir is not None:
+      shutil.rmtree(self.profile_dir, ignore_errors=True)
+      self.profile_dir = None
+
+  def restart(self):
+    logger.warning("Restarting LibreOffice listener on port %s", self.port)
+    self.stop()
+    self.start()
+
+# Pool of LibreOffice listeners; each conversion checks one out exclusively
+class SofficePool:
+  def __init__(self, size: int, base_port: int = SOFFICE_BASE_PORT):
+    self.listeners = [SofficeListener(base_port + i) for i in range(size)]
+    self._idle = queue.Queue()
+    for listener in self.listeners:
+      listener.start()
+      self._idle.put(listener)
+
+  def convert(self, file_path: str, target_ext: str, out_path: str, timeout: float = LEGACY_CONVERT_TIMEOUT):
+    try:
+      listener = self._idle.get(timeout=timeout)
+    except queue.Empty:
+      raise TimeoutError("No LibreOffice listener became available")
+    try:
+      if not listener.is_healthy():
+        listener.restart()
+      subprocess.run(
+        ["unoconv", "--connection", listener.connection, "-f", target_ext.lstrip("."), "-o", out_path, file_path],
+        check=True,
+        timeout=timeout,
+      )
+    except Exception:
+      # A failed or hung conversion may leave the listener wedged; start it fresh
+      with contextlib.suppress(Exception):
+        listener.restart()
+      raise
+    finally:
+      self._idle.put(listener)
+
+  def shutdown(self):
+    for listener in self.listeners:
+      listener.stop()
+
+_soffice_pool = None
+_soffice_pool_lock = threading.Lock()
+
+def get_soffice_pool():
+  global _soffice_pool
+  if SOFFICE_POOL_SIZE <= 0:
+    return None
+  with _soffice_pool_lock:
+    if _soffice_pool is None:
+      _soffice_pool = SofficePool(SOFFICE_POOL_SIZE)
+    return _soffice_pool
+
+def shutdown_soffice_pool():
+  global _soffice_pool
+  with _soffice_pool_lock:
+    if _soffice_pool is not None:
+      _soffice_pool.shutdown()
+      _soffice_pool = None
+
+def convert_legacy_office(file_path: str, target_ext: str, out_path: str):
+  pool = get_soffice_pool()
+  with timed_stage("conversion"):
+    if pool is not None:
+      pool.convert(file_path, target_ext, out_path)
+    else:
+      subprocess.run(
+        ["unoconv", "-f", target_ext.lstrip("."), "-o", out_path, file_path],
+        check=True,
+        timeout=LEGACY_CONVERT_TIMEOUT,
+      )
+
 # Parser for legacy .doc, .xls, .ppt files using unoconv + libreoffice
 def parse_legacy_office(file_path: str, target_ext: str) -> str:
   try:
-    out_path = file_path + ".converted" + target_ext
-    subprocess.run(["unoconv", "-f", target_ext.lstrip("."), "-o", out_path, file_path], check=True)
-    if target_ext == ".docx":
-      return parse_docx(out_path)
-    elif target_ext == ".xlsx":
-      return parse_xlsx(out_path)
-    elif target_ext == ".pptx":
-      return parse_pptx(out_path)
-    else:
-      return ""
+    # The converted file lives in its own temp dir, removed even if parsing fails
+    with tempfile.TemporaryDirectory(prefix="converted-") as out_dir:
+      out_path = os.path.join(out_dir, "converted" + target_ext)
+      convert_legacy_office(file_path, target_ext, out_path)
+      if target_ext == ".docx":
+        return parse_docx(out_path)
+      elif target_ext == ".xlsx":
+        return parse_xlsx(out_path)
+      elif target_ext == ".pptx":
+        return parse_pptx(out_path)
+      else:
+        return ""
   except Exception as e:
-    logger.error(f"Error parsing legacy office file: {e}", exc_info=True)
+    logger.error("Error parsing legacy office file: %s", e, exc_info=True)
     return "Legacy format parsing requires unoconv/libreoffice installed."
 
 # Parser for text files (.txt, .md, .log)
@@ -145,7 +1606,7 @@ def parse_text(file_path: str) -> str:
     with open(file_path, "r", encoding="utf-8") as f:
       return f.read()
   except Exception as e:
-    logger.error(f"Error parsing text file: {e}", exc_info=True)
+    logger.error("Error parsing text file: %s", e, exc_info=True)
     return ""
 
 # Parser for .feature files (Gherkin)
@@ -154,346 +1615,2490 @@ def parse_feature(file_path: str) -> str:
     with open(file_path, "r", encoding="utf-8") as f:
       return f.read()
   except Exception as e:
-    logger.error(f"Error parsing .feature file: {e}", exc_info=True)
-    return ""
-
-# Parser for .pdf files with OCR fallback
-def parse_pdf(file_path: str) -> str:
-  logger.info(f"parse_pdf: starting for {file_path}")
-  try:
-    text = ""
-    with pdfplumber.open(file_path) as pdf:
-      total_pages = len(pdf.pages)
-      logger.info(f"parse_pdf: opened PDF, {total_pages} pages")
-      do_ocr = total_pages <= 150
-      for i, page in enumerate(pdf.pages):
-        logger.info(f"parse_pdf: processing page {i+1}/{total_pages}")
-        page_text = page.extract_text()
-        if page_text and page_text.strip():
-          text += page_text
-        else:
-          if not do_ocr:
-            logger.info(f"parse_pdf: page {i+1} has no text, skipping OCR due to page count > 150")
-            text += f"\n[No extractable text on page {i+1} and OCR skipped due to document size]\n"
-            continue
-          logger.info(f"parse_pdf: page {i+1} has no text, running OCR")
-          try:
-            img = page.to_image(resolution=300).original
-            logger.info(f"parse_pdf: page {i+1} image size: {img.size if hasattr(img, 'size') else 'unknown'}")
-            # Downscale if too large
-            max_dim = 1000
-            if hasattr(img, "size"):
-              w, h = img.size
-              if w > max_dim or h > max_dim:
-                scale = min(max_dim / w, max_dim / h)
-                new_size = (int(w * scale), int(h * scale))
-                logger.info(f"parse_pdf: page {i+1} downscaling image from {img.size} to {new_size}")
-                img = img.resize(new_size)
-            if hasattr(img, "size") and (img.size[0] > 2000 or img.size[1] > 2000):
-              logger.warning(f"parse_pdf: page {i+1} image still too large after downscaling, skipping OCR")
-              text += f"\n[OCR skipped on page {i+1} due to image size]\n"
-            else:
-              logger.info(f"parse_pdf: page {i+1} running pytesseract OCR")
-              ocr_text = pytesseract.image_to_string(img)
-              logger.info(f"parse_pdf: page {i+1} finished pytesseract OCR")
-              text += ocr_text
-          except Exception as ocr_exc:
-            logger.error(f"parse_pdf: OCR failed on page {i+1}: {ocr_exc}", exc_info=True)
-            text += f"\n[OCR failed on page {i+1}]\n"
-        text += "\n"
-    logger.info(f"parse_pdf: finished, total length {len(text)}")
-    return text.strip()
-  except Exception as e:
-    logger.error(f"Error parsing .pdf: {e}", exc_info=True)
+    logger.error("Error parsing .feature file: %s", e, exc_info=True)
     return ""
 
-# Parser for .csv files
-def parse_csv(file_path: str) -> str:
-  try:
-    df = pd.read_csv(file_path)
-    return df.to_csv(index=False)
-  except Exception as e:
-    logger.error(f"Error parsing .csv: {e}", exc_info=True)
-    return ""
+# Shared PDF handle: opened once per request and used by the page limit check,
+# text/OCR extraction and metadata, which also reads the per-page stats
+class PdfContext:
+  def __init__(self, file_path: str, backend: str = None):
+    self.file_path = file_path
+    self.backend = backend or PDF_BACKEND
+    self.page_stats = []
+    self.table_stats = None
+    self._pdf = None
+    self._mupdf = None
+    self._pdfium = None
+    self._page_scan = None
+    self._ocr_plan = None
+    # Open the backend's handle now so unreadable files fail before parsing starts
+    if self.backend == "pymupdf":
+      self.mupdf
+    else:
+      self.pdf
 
-# Parser for .xlsx files
-def parse_xlsx(file_path: str) -> str:
-  try:
-    df = pd.read_excel(file_path, engine="openpyxl")
-    return df.to_csv(index=False)
-  except Exception as e:
-    logger.error(f"Error parsing .xlsx: {e}", exc_info=True)
-    return ""
+  # pdfplumber handle; with the pymupdf backend only opened for table detection
+  @property
+  def pdf(self):
+    if self._pdf is None:
+      self._pdf = pdfplumber.open(self.file_path)
+    return self._pdf
 
-# Parser for .pptx files
-def parse_pptx(file_path: str) -> str:
-  try:
-    prs = pptx.Presentation(file_path)
-    text_runs = []
-    for slide in prs.slides:
-      for shape in slide.shapes:
-        if hasattr(shape, "text"):
-          text_runs.append(shape.text)
-    return "\n".join(text_runs)
-  except Exception as e:
-    logger.error(f"Error parsing .pptx: {e}", exc_info=True)
-    return ""
+  @property
+  def mupdf(self):
+    if self._mupdf is None:
+      with _mupdf_lock:
+        self._mupdf = pymupdf.open(self.file_path, filetype="pdf")
+    return self._mupdf
 
-# Parser for .eml files
-def parse_eml(file_path: str) -> str:
-  try:
-    with open(file_path, "rb") as f:
-      msg = email.message_from_binary_file(f, policy=email.policy.default)
-    subject = msg.get("subject", "")
-    from_ = msg.get("from", "")
-    to = msg.get("to", "")
-    body = ""
-    if msg.is_multipart():
-      for part in msg.walk():
-        if part.get_content_type() == "text/plain":
-          body += part.get_content()
-    else:
-      body = msg.get_content()
-    return f"Subject: {subject}\nFrom: {from_}\nTo: {to}\n\n{body}"
-  except Exception as e:
-    logger.error(f"Error parsing .eml: {e}", exc_info=True)
-    return ""
+  @property
+  def page_count(self) -> int:
+    if self.backend == "pymupdf":
+      return self.mupdf.page_count
+    return len(self.pdf.pages)
 
-# Parser for .msg files (Outlook)
-def parse_msg(file_path: str) -> str:
-  try:
-    msg = extract_msg.Message(file_path)
-    subject = msg.subject or ""
-    sender = msg.sender or ""
-    to = msg.to or ""
-    body = msg.body or ""
-    return f"Subject: {subject}\nFrom: {sender}\nTo: {to}\n\n{body}"
-  except Exception as e:
-    logger.error(f"Error parsing .msg: {e}", exc_info=True)
-    return ""
+  # Page object of the backend, as passed to page_text and render_page_for_ocr
+  def page(self, index: int):
+    if self.backend == "pymupdf":
+      with _mupdf_lock:
+        return self.mupdf[index]
+    return self.pdf.pages[index]
 
-# Parser for image files (.png, .jpg, .jpeg) using pytesseract or LLaVA
-def parse_image(file_path: str) -> str:
-  try:
-    # If LLaVA is not enabled, use pytesseract
-    if not LLAVA_USE:
-      img = Image.open(file_path)
-      text = pytesseract.image_to_string(img)
-      return text
-    else:
-      # For LLaVA, we'll return a placeholder as the actual processing
-      # happens in the /caption endpoint
-      return "[Image processed by LLaVA. Use /caption endpoint for detailed description.]"
-  except Exception as e:
-    logger.error(f"Error parsing image file: {e}", exc_info=True)
-    return ""
+  def page_text(self, page) -> str:
+    if self.backend == "pymupdf":
+      with _mupdf_lock:
+        return page.get_text("text")
+    return page.extract_text()
 
-# Router for dispatching to parsers
-def parse_file_router(file_path: str, filetype: str) -> str:
-  logger.info(f"parse_file_router: dispatching for {file_path} type {filetype}")
-  if filetype == "docx":
-    return parse_docx(file_path)
-  elif filetype == "doc":
-    return parse_legacy_office(file_path, ".docx")
-  elif filetype == "xls":
-    return parse_legacy_office(file_path, ".xlsx")
-  elif filetype == "ppt":
-    return parse_legacy_office(file_path, ".pptx")
-  elif filetype in {"txt", "md", "log", "ts"}:
-    return parse_text(file_path)
-  elif filetype == "feature":
-    return parse_feature(file_path)
-  elif filetype == "pdf":
-    return parse_pdf(file_path)
-  elif filetype == "csv":
-    return parse_csv(file_path)
-  elif filetype == "xlsx":
-    return parse_xlsx(file_path)
-  elif filetype == "pptx":
-    return parse_pptx(file_path)
-  elif filetype == "eml":
-    return parse_eml(file_path)
-  elif filetype == "msg":
-    return parse_msg(file_path)
-  elif filetype in {"png", "jpg", "jpeg"}:
-    return parse_image(file_path)
-  else:
-    logger.warning(f"Unsupported file type: {filetype}")
-    return ""
+  # pdfium handle for rendering, opened on first use; pdfplumber's to_image
+  # would reopen the document for every page
+  @property
+  def pdfium(self):
+    if self._pdfium is None:
+      with _pdfium_lock:
+        self._pdfium = pypdfium2.PdfDocument(self.file_path)
+    return self._pdfium
 
-def extract_metadata(file_path: str, filetype: str) -> dict:
-  logger.info(f"extract_metadata: for {file_path} type {filetype}")
+  # Per-page text-layer classification, or None if pdfium cannot read the file
+  @property
+  def page_scan(self):
+    if self._page_scan is None:
+      try:
+        self._page_scan = scan_pdf_pages(self)
+      except Exception as e:
+        logger.warning("Text-layer pre-scan failed for %s: %s", self.file_path, e)
+        self._page_scan = []
+    return self._page_scan or None
+
+  @property
+  def ocr_plan(self):
+    if self._ocr_plan is None and self.page_scan is not None:
+      self._ocr_plan = plan_pdf_ocr(self.page_scan)
+    return self._ocr_plan
+
+  def close(self):
+    if self._pdf is not None:
+      self._pdf.close()
+      self._pdf = None
+    if self._mupdf is not None:
+      with _mupdf_lock:
+        self._mupdf.close()
+      self._mupdf = None
+    if self._pdfium is not None:
+      with _pdfium_lock:
+        self._pdfium.close()
+      self._pdfium = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.close()
+
+# Pool for parallel OCR, created on first use: worker processes shared by all
+# documents in the server process. A parse worker process parses one document
+# at a time and OCRs its pages on PDF_OCR_PAGE_CONCURRENCY threads; tesseract
+# runs outside the GIL (a subprocess with pytesseract, released by tesserocr)
+# and every thread keeps its own warm engine.
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+def get_ocr_pool():
+  global _ocr_pool
+  if PDF_OCR_WORKERS <= 0:
+    return None
+  with _ocr_pool_lock:
+    if _ocr_pool is None:
+      if _in_parse_worker:
+        _ocr_pool = ThreadPoolExecutor(max_workers=max(PDF_OCR_PAGE_CONCURRENCY, 1), thread_name_prefix="ocr")
+      else:
+        _ocr_pool = ProcessPoolExecutor(max_workers=PDF_OCR_WORKERS, initializer=init_ocr_worker)
+    return _ocr_pool
+
+def shutdown_ocr_pool():
+  global _ocr_pool
+  with _ocr_pool_lock:
+    if _ocr_pool is not None:
+      _ocr_pool.shutdown(wait=False, cancel_futures=True)
+      _ocr_pool = None
+
+# pytesseract engine: runs the tesseract binary on a temp file for every image
+class PytesseractEngine:
+  name = "pytesseract"
+
+  def __init__(self, lang: str, psm: int):
+    self.lang = lang
+    self.config = f"--psm {psm}"
+
+  def image_to_string(self, img) -> str:
+    return pytesseract.image_to_string(img, lang=self.lang, config=self.config)
+
+  def close(self):
+    pass
+
+# tesserocr engine: one Tesseract API kept open, so the language models are
+# loaded once instead of per page. The API object is not thread-safe.
+class TesserocrEngine:
+  name = "tesserocr"
+
+  def __init__(self, lang: str, psm: int, tessdata: str = ""):
+    tesserocr = importlib.import_module("tesserocr")
+    kwargs = {"lang": lang, "psm": psm}
+    if tessdata:
+      kwargs["path"] = tessdata
+    self.api = tesserocr.PyTessBaseAPI(**kwargs)
+
+  def image_to_string(self, img) -> str:
+    self.api.SetImage(img)
+    try:
+      return self.api.GetUTF8Text()
+    finally:
+      self.api.Clear()
+
+  def close(self):
+    self.api.End()
+
+def create_ocr_engine(name: str = None):
+  name = OCR_ENGINE if name is None else name
+  if name in {"auto", "tesserocr"}:
+    if importlib.util.find_spec("tesserocr") is not None:
+      try:
+        return TesserocrEngine(OCR_LANG, OCR_PSM, OCR_TESSDATA)
+      except Exception as e:
+        logger.warning("Could not start tesserocr, using pytesseract: %s", e)
+    elif name == "tesserocr":
+      logger.warning("OCR_ENGINE is tesserocr but it is not installed, using pytesseract")
+  return PytesseractEngine(OCR_LANG, OCR_PSM)
+
+# One warm engine per thread; a forked pool worker starts its own rather than
+# reusing the parent's
+_ocr_engines = threading.local()
+
+def get_ocr_engine():
+  engine = getattr(_ocr_engines, "engine", None)
+  if engine is None or _ocr_engines.pid != os.getpid():
+    engine = create_ocr_engine()
+    _ocr_engines.engine = engine
+    _ocr_engines.pid = os.getpid()
+    logger.debug("Started %s OCR engine (lang %s, psm %s)", engine.name, OCR_LANG, OCR_PSM)
+  return engine
+
+# OCR pool initializer: the engine is warm before the first page arrives
+def init_ocr_worker():
+  init_worker_logging()
+  get_ocr_engine()
+
+# OCR worker entry point; runs in the OCR pool or inline
+def ocr_image(img) -> str:
+  return get_ocr_engine().image_to_string(img)
+
+# OCR pool entry point returning the text and the time OCR took in the worker
+def timed_ocr_image(img) -> tuple:
+  start = time.perf_counter()
+  text = ocr_image(img)
+  return text, time.perf_counter() - start
+
+# pdfium is not thread-safe, even across documents
+_pdfium_lock = threading.Lock()
+# Neither is MuPDF
+_mupdf_lock = threading.Lock()
+
+# Render scale (pixels per point) giving the page's longest side target_px
+# pixels, never above max_dpi
+def ocr_render_scale(width: float, height: float, target_px: int = None, max_dpi: float = None) -> float:
+  target_px = OCR_TARGET_PX if target_px is None else target_px
+  max_dpi = OCR_MAX_DPI if max_dpi is None else max_dpi
+  # pdfium rounds pixel sizes up, so aim a hair under the target
+  return min((target_px - 0.01) / max(width, height, 1), max_dpi / 72)
+
+def apply_ocr_color_mode(img, mode: str = None):
+  mode = OCR_COLOR_MODE if mode is None else mode
+  if mode == "rgb":
+    return img.convert("RGB")
+  img = img.convert("L")
+  if mode == "binary":
+    return img.point(lambda value: 255 if value > OCR_BINARY_THRESHOLD else 0, mode="1")
+  return img
+
+# Rasterize a PDF page for OCR directly at the target size. With a PdfContext
+# the page is rendered from its shared pdfium handle, or by MuPDF with the
+# pymupdf backend. pdfium's own grayscale mode is slower than converting the
+# RGB render, so color is reduced after.
+def render_page_for_ocr(page, page_number: int, ctx: PdfContext = None):
+  if ctx is not None and ctx.backend == "pymupdf":
+    scale = ocr_render_scale(page.rect.width, page.rect.height)
+    with _mupdf_lock:
+      pixmap = page.get_pixmap(matrix=pymupdf.Matrix(scale, scale), colorspace=pymupdf.csRGB, alpha=False)
+    img = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    logger.debug("parse_pdf: page %s rendered at %.0f DPI, image size %s", page_number, scale * 72, img.size)
+    return apply_ocr_color_mode(img)
+  scale = ocr_render_scale(page.width, page.height)
+  if ctx is None:
+    img = page.to_image(resolution=scale * 72).original
+  else:
+    document = ctx.pdfium
+    with _pdfium_lock:
+      pdfium_page = document[page_number - 1]
+      try:
+        img = pdfium_page.render(scale=scale).to_pil()
+      finally:
+        pdfium_page.close()
+  logger.debug("parse_pdf: page %s rendered at %.0f DPI, image size %s", page_number, scale * 72, img.size)
+  return apply_ocr_color_mode(img)
+
+# Classify a page from its character count and page objects, without layout
+# extraction. Text-less pages with only vector paths may hold outlined text,
+# so they count as image pages.
+def classify_pdf_page(pdfium_page) -> dict:
+  textpage = pdfium_page.get_textpage()
+  try:
+    chars = textpage.count_chars()
+  finally:
+    textpage.close()
+  width, height = pdfium_page.get_size()
+  images = 0
+  image_area = 0.0
+  for obj in pdfium_page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE]):
+    left, bottom, right, top = obj.get_bounds()
+    images += 1
+    image_area += max(right - left, 0) * max(top - bottom, 0)
+  coverage = min(image_area / max(width * height, 1), 1.0)
+  # Vector paths are what pdfplumber builds table ruling lines from
+  ruled = next(pdfium_page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_PATH]), None) is not None
+  if chars > 0:
+    kind = "mixed" if images and coverage >= PDF_MIXED_IMAGE_COVERAGE else "text"
+  elif images or ruled:
+    kind = "image"
+  else:
+    kind = "empty"
+  return {"kind": kind, "chars": chars, "images": images, "image_coverage": round(coverage, 3), "ruled": ruled}
+
+def scan_pdf_pages(ctx: PdfContext) -> list:
+  document = ctx.pdfium
+  scan = []
+  for index in range(len(document)):
+    with _pdfium_lock:
+      pdfium_page = document[index]
+      try:
+        scan.append(classify_pdf_page(pdfium_page))
+      finally:
+        pdfium_page.close()
+  return scan
+
+# Which image pages get OCR within the budget, and roughly what that costs
+def plan_pdf_ocr(page_scan: list, budget: int = None) -> dict:
+  budget = PDF_OCR_PAGE_BUDGET if budget is None else budget
+  kinds = collections.Counter(page["kind"] for page in page_scan)
+  image_pages = [i + 1 for i, page in enumerate(page_scan) if page["kind"] == "image"]
+  return {
+    "text_pages": kinds["text"],
+    "mixed_pages": kinds["mixed"],
+    "image_pages": kinds["image"],
+    "empty_pages": kinds["empty"],
+    "budget": budget,
+    "ocr_pages": image_pages[:budget],
+    "skipped_pages": image_pages[budget:],
+    "estimated_ocr_seconds": round(min(len(image_pages), budget) * OCR_PAGE_COST_SECONDS, 1),
+  }
+
+PDF_BACKENDS = {"pdfplumber", "pymupdf"}
+
+# Reject unknown backends, and pymupdf where it is not installed
+def check_pdf_backend(backend: Optional[str]):
+  if backend is None:
+    return
+  if backend not in PDF_BACKENDS:
+    raise HTTPException(status_code=400, detail=f"Unsupported pdf_backend: {backend}. Use pdfplumber or pymupdf.")
+  if importlib.util.find_spec(backend) is None:
+    raise HTTPException(status_code=400, detail=f"The {backend} PDF backend is not installed on this server.")
+
+# The configured PDF_BACKEND, or pdfplumber with a warning when it is unknown
+# or not installed, so the cache key records the backend that actually runs
+def resolve_pdf_backend(backend: str) -> str:
+  try:
+    check_pdf_backend(backend)
+  except HTTPException as e:
+    logger.warning("Ignoring PDF_BACKEND: %s Using pdfplumber.", e.detail)
+    return "pdfplumber"
+  return backend
+
+PDF_BACKEND = resolve_pdf_backend(PDF_BACKEND)
+
+# Parse a page selection like "1-3,7" into (first, last) ranges
+def parse_page_ranges(spec: str) -> list:
+  ranges = []
+  for part in spec.split(","):
+    first, dash, last = part.strip().partition("-")
+    if not first.isdigit() or (dash and not last.isdigit()):
+      raise ValueError(f"Invalid page range: {part.strip()!r}")
+    first, last = int(first), int(last or first)
+    if first < 1 or last < first:
+      raise ValueError(f"Invalid page range: {part.strip()!r}")
+    ranges.append((first, last))
+  return ranges
+
+# Validate the table options of a request; None when tables are not requested
+def pdf_table_options(tables: Optional[str], table_pages: Optional[str]):
+  if tables is None:
+    if table_pages is not None:
+      raise HTTPException(status_code=400, detail="table_pages requires tables=markdown or tables=csv.")
+    return None
+  if tables not in {"markdown", "csv"}:
+    raise HTTPException(status_code=400, detail=f"Unsupported tables format: {tables}. Use markdown or csv.")
+  try:
+    ranges = parse_page_ranges(table_pages) if table_pages else None
+  except ValueError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  return {"format": tables, "pages": ranges}
+
+def format_pdf_table(rows: list, table_format: str) -> str:
+  rows = [["" if cell is None else str(cell) for cell in row] for row in rows if row]
+  if not rows:
+    return ""
+  if table_format == "csv":
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return f"```csv\n{buffer.getvalue()}```"
+  width = max(map(len, rows))
+  header, *body = [[markdown_cells_text(cell) for cell in row + [""] * (width - len(row))] for row in rows]
+  lines = ["| " + " | ".join(header) + " |", "| " + " | ".join(["---"] * width) + " |"]
+  lines.extend("| " + " | ".join(row) + " |" for row in body)
+  return "\n".join(lines)
+
+# Text of a page with its tables cut out, followed by each table as a block
+def extract_page_with_tables(page, table_format: str) -> tuple:
+  tables = page.find_tables()
+  if not tables:
+    return page.extract_text() or "", 0
+  boxes = [table.bbox for table in tables]
+
+  def outside_tables(obj):
+    if obj.get("object_type") != "char":
+      return True
+    x = (obj["x0"] + obj["x1"]) / 2
+    y = (obj["top"] + obj["bottom"]) / 2
+    return not any(x0 <= x <= x1 and top <= y <= bottom for x0, top, x1, bottom in boxes)
+
+  text = page.filter(outside_tables).extract_text() or ""
+  blocks = [block for block in (format_pdf_table(table.extract(), table_format) for table in tables) if block]
+  return "\n\n".join([text] + blocks if text.strip() else blocks), len(blocks)
+
+# Table pool worker entry point: opens the PDF once for a run of pages
+def extract_pdf_tables(file_path: str, page_numbers: list, table_format: str) -> tuple:
+  start = time.perf_counter()
+  with pdfplumber.open(file_path) as pdf:
+    results = {number: extract_page_with_tables(pdf.pages[number - 1], table_format) for number in page_numbers}
+  return results, time.perf_counter() - start
+
+# Process pool for table detection, created on first use in the server
+# process; parse worker processes extract tables inline
+_table_pool = None
+_table_pool_lock = threading.Lock()
+
+def get_table_pool():
+  global _table_pool
+  if PDF_TABLE_WORKERS <= 0 or _in_parse_worker:
+    return None
+  with _table_pool_lock:
+    if _table_pool is None:
+      _table_pool = ProcessPoolExecutor(max_workers=PDF_TABLE_WORKERS, initializer=init_worker_logging)
+    return _table_pool
+
+# PDF_TABLE_WORKERS has no effect while PDFs go to the parse worker processes
+def warn_unused_pool_settings():
+  if PDF_TABLE_WORKERS > 0 and parse_executor.process_workers > 0 and "pdf" in parse_executor.process_filetypes:
+    logger.warning(
+      "PDF_TABLE_WORKERS=%s is unused: PDFs are parsed in the parse worker processes (PARSE_PROCESS_FILETYPES), "
+      "which detect tables themselves", PDF_TABLE_WORKERS
+    )
+
+def shutdown_table_pool():
+  global _table_pool
+  with _table_pool_lock:
+    if _table_pool is not None:
+      _table_pool.shutdown(wait=False, cancel_futures=True)
+      _table_pool = None
+
+# Pages that go through table detection: those in the requested range whose
+# pre-scan found a text layer and vector paths. Without a pre-scan every page
+# in range qualifies.
+def plan_pdf_tables(page_scan: list, page_count: int, ranges: list = None) -> tuple:
+  requested = [
+    number for number in range(1, page_count + 1)
+    if ranges is None or any(first <= number <= last for first, last in ranges)
+  ]
+  selected = []
+  for number in requested:
+    scan = page_scan[number - 1]
+    if scan is None or (scan["kind"] in {"text", "mixed"} and scan.get("ruled", True)):
+      selected.append(number)
+  return requested, selected
+
+def ocr_failed_marker(page_number: int) -> str:
+  return f"\n[OCR failed on page {page_number}]\n"
+
+# Yields the text of each PDF page in order, falling back to OCR for pages
+# without a text layer; parse_pdf joins the pages and streaming emits them.
+# Pages the pre-scan found without a text layer skip extract_text, and OCR
+# stops once PDF_OCR_PAGE_BUDGET pages of the document have been sent to it.
+# With tables, selected pages have their tables emitted as Markdown or CSV
+# blocks after the rest of their text.
+def iter_pdf_pages(file_path: str, ctx: PdfContext = None, tables: dict = None):
+  logger.debug("parse_pdf: starting for %s", file_path)
+  start = time.perf_counter()
+  with contextlib.ExitStack() as stack:
+    if ctx is None:
+      ctx = stack.enter_context(PdfContext(file_path))
+    ctx.page_stats = []
+    total_pages = ctx.page_count
+    logger.debug("parse_pdf: opened PDF, %s pages", total_pages)
+    page_scan = ctx.page_scan or [None] * total_pages
+    plan = ctx.ocr_plan
+    if plan is not None:
+      logger.debug("parse_pdf: OCR plan %s", plan)
+    table_pages = {}  # page number -> future, or None to extract inline
+    if tables:
+      requested, selected = plan_pdf_tables(page_scan, total_pages, tables["pages"])
+      table_pool = get_table_pool()
+      step = max(PDF_TABLE_PAGES_PER_TASK, 1)
+      for start_index in range(0, len(selected), step):
+        chunk = selected[start_index:start_index + step]
+        future = table_pool.submit(extract_pdf_tables, file_path, chunk, tables["format"]) if table_pool else None
+        table_pages.update((number, future) for number in chunk)
+      # Pages a closed stream never reached are not worth finishing
+      stack.callback(lambda: [future.cancel() for future in table_pages.values() if future is not None])
+      ctx.table_stats = {
+        "format": tables["format"], "requested_pages": len(requested),
+        "scanned_pages": len(selected), "skipped_pages": len(requested) - len(selected), "tables": 0,
+      }
+      logger.debug("parse_pdf: table detection on %s of %s requested pages", len(selected), len(requested))
+    ocr_budget = PDF_OCR_PAGE_BUDGET
+    ocr_used = 0
+    ocr_pool = get_ocr_pool() if ocr_budget > 0 else None
+    # Page outputs are kept by index so parallel OCR results are emitted in order
+    parts = {}
+    in_flight = {}  # future -> page index
+    # Pages still queued when a stream is closed early are not OCR'd
+    stack.callback(lambda: [future.cancel() for future in in_flight])
+    next_page = 0
+    # Page images kept until OCR succeeds, so failed pages can go to the vision model
+    use_vision = LLAVA_USE and LLAVA_PDF_PAGES
+    page_images = {}
+    vision_pending = {}
+
+    def flush_vision():
+      indexes = sorted(vision_pending)
+      texts = vision_model.extract([(image_to_png_bytes(vision_pending.pop(i)), "image/png") for i in indexes])
+      for i, text in zip(indexes, texts):
+        if text is None:
+          parts[i] = ocr_failed_marker(i + 1) + "\n"
+        else:
+          ctx.page_stats[i]["source"] = "vision"
+          parts[i] = text + "\n"
+
+    def ocr_failed(i):
+      ctx.page_stats[i]["source"] = "ocr_failed"
+      img = page_images.pop(i, None)
+      if img is None:
+        parts[i] = ocr_failed_marker(i + 1) + "\n"
+        return
+      vision_pending[i] = img
+      if len(vision_pending) >= LLAVA_BATCH_SIZE:
+        flush_vision()
+
+    def collect(future):
+      i = in_flight.pop(future)
+      stats = ctx.page_stats[i]
+      try:
+        ocr_text, seconds = future.result()
+        record_stage("ocr_page", seconds)
+        logger.debug("parse_pdf: page %s finished OCR", i+1)
+        page_images.pop(i, None)
+        stats["source"] = "ocr"
+        stats["ocr_chars"] = len(ocr_text)
+        parts[i] = ocr_text + "\n"
+      except Exception as ocr_exc:
+        logger.error("parse_pdf: OCR failed on page %s: %s", i+1, ocr_exc, exc_info=True)
+        ocr_failed(i)
+
+    for i in range(total_pages):
+      page = ctx.page(i)
+      logger.debug("parse_pdf: processing page %s/%s", i+1, total_pages)
+      kind = page_scan[i]["kind"] if page_scan[i] else None
+      table_count = None
+      if i + 1 in table_pages:
+        future = table_pages.pop(i + 1)
+        try:
+          if future is None:
+            with timed_stage("tables"):
+              page_text, table_count = extract_page_with_tables(ctx.pdf.pages[i], tables["format"])
+          else:
+            results, seconds = future.result()
+            # A task covers several pages; count its time once, with its first page
+            if min(results) == i + 1:
+              record_stage("tables", seconds)
+            page_text, table_count = results[i + 1]
+        except Exception as table_exc:
+          logger.error("parse_pdf: table detection failed on page %s: %s", i+1, table_exc, exc_info=True)
+          page_text, table_count = ctx.page_text(page), 0
+        ctx.table_stats["tables"] += table_count
+      # No characters at all means extract_text would come back empty
+      elif kind in {"image", "empty"}:
+        page_text = ""
+      else:
+        page_text = ctx.page_text(page)
+      stats = {"page": i + 1, "text_chars": len(page_text or ""), "source": "text"}
+      if kind is not None:
+        stats["kind"] = kind
+      if table_count is not None:
+        stats["tables"] = table_count
+      ctx.page_stats.append(stats)
+      if page_text and page_text.strip():
+        parts[i] = page_text + "\n"
+      elif kind == "empty":
+        stats["source"] = "empty"
+        parts[i] = "\n"
+      elif ocr_used >= ocr_budget:
+        logger.debug("parse_pdf: page %s has no text, OCR budget of %s pages used up", i+1, ocr_budget)
+        stats["source"] = "ocr_skipped"
+        parts[i] = f"\n[No extractable text on page {i+1} and OCR skipped: the OCR budget of {ocr_budget} pages is used up]\n"
+      else:
+        logger.debug("parse_pdf: page %s has no text, running OCR", i+1)
+        ocr_used += 1
+        try:
+          with timed_stage("render"):
+            img = render_page_for_ocr(page, i + 1, ctx)
+          if use_vision:
+            page_images[i] = img
+          if ocr_pool is None:
+            logger.debug("parse_pdf: page %s running OCR", i+1)
+            with timed_stage("ocr_page"):
+              ocr_text = ocr_image(img)
+            logger.debug("parse_pdf: page %s finished OCR", i+1)
+            page_images.pop(i, None)
+            stats["source"] = "ocr"
+            stats["ocr_chars"] = len(ocr_text)
+            parts[i] = ocr_text + "\n"
+          else:
+            # Bound the pages this document has queued so one request cannot flood the pool
+            while len(in_flight) >= PDF_OCR_PAGE_CONCURRENCY:
+              done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+              for future in done:
+                collect(future)
+            logger.debug("parse_pdf: page %s queued for parallel OCR", i+1)
+            in_flight[ocr_pool.submit(timed_ocr_image, img)] = i
+        except Exception as ocr_exc:
+          logger.error("parse_pdf: OCR failed on page %s: %s", i+1, ocr_exc, exc_info=True)
+          ocr_failed(i)
+      for future in [f for f in in_flight if f.done()]:
+        collect(future)
+      while next_page in parts:
+        yield parts.pop(next_page)
+        next_page += 1
+        report_progress(next_page, total_pages)
+    for future in list(in_flight):
+      collect(future)
+    if vision_pending:
+      flush_vision()
+    while next_page in parts:
+      yield parts.pop(next_page)
+      next_page += 1
+      report_progress(next_page, total_pages)
+    # Per-page events are DEBUG only; this is the one INFO record per document
+    sources = collections.Counter(stats["source"] for stats in ctx.page_stats)
+    for source, count in sources.items():
+      record_count("pdf_pages_" + source, count)
+    duration = time.perf_counter() - start
+    logger.info(
+      "parse_pdf: %s pages from %s (%s text, %s ocr, %s vision, %s ocr_failed, %s ocr_skipped, %s empty) in %.2fs",
+      total_pages, file_path, sources["text"], sources["ocr"], sources["vision"], sources["ocr_failed"],
+      sources["ocr_skipped"], sources["empty"], duration,
+      extra={"event": "pdf_parsed", "pages": total_pages, "page_sources": dict(sources), "duration_seconds": round(duration, 3)}
+    )
+
+# Parser for .pdf files with OCR fallback
+def parse_pdf(file_path: str, ctx: PdfContext = None, tables: dict = None) -> str:
+  try:
+    pages = list(iter_pdf_pages(file_path, ctx, tables))
+    text = "".join(pages)
+    logger.debug("parse_pdf: finished, total length %s", len(text))
+    content = text.strip()
+    if ctx is not None:
+      # Character offset where each page starts in the stripped content
+      position = len(text.lstrip()) - len(text)
+      for stats, page in zip(ctx.page_stats, pages):
+        stats["offset"] = min(max(position, 0), len(content))
+        position += len(page)
+    return content
+  except Exception as e:
+    logger.error("Error parsing .pdf: %s", e, exc_info=True)
+    return ""
+
+# Row limit and sampling for one table; counts every row it is offered
+class RowSampler:
+  def __init__(self, max_rows: int = None, step: int = None):
+    self.max_rows = TABULAR_MAX_ROWS if max_rows is None else max_rows
+    self.step = TABULAR_SAMPLE_STEP if step is None else step
+    self.seen = 0
+    self.kept = 0
+
+  @property
+  def truncated(self) -> bool:
+    return self.kept < self.seen
+
+  def keep(self) -> bool:
+    index = self.seen
+    self.seen += 1
+    if index % self.step or (self.max_rows and self.kept >= self.max_rows):
+      return False
+    self.kept += 1
+    return True
+
+  # Positions to keep within the next `count` rows
+  def positions(self, count: int) -> range:
+    first = -self.seen % self.step
+    positions = range(first, count, self.step)
+    if self.max_rows:
+      positions = positions[:max(0, self.max_rows - self.kept)]
+    self.seen += count
+    self.kept += len(positions)
+    return positions
+
+# CSV read TABULAR_CHUNK_ROWS rows at a time with every value kept as text:
+# dtypes inferred per chunk would write the same column differently on each
+# side of a chunk boundary (10 in one chunk, 10.0 in the next)
+def read_csv_chunks(file_path: str):
+  return pd.read_csv(file_path, chunksize=TABULAR_CHUNK_ROWS, dtype=str, keep_default_na=False)
+
+# Yields CSV text chunk by chunk, filling stats with the row/column counts of
+# the same pass so metadata does not need to read the file again
+def iter_csv_chunks(file_path: str, stats: dict = None):
+  sampler = RowSampler()
+  columns = 0
+  header = True
+  for chunk in read_csv_chunks(file_path):
+    columns = chunk.shape[1]
+    if sampler.step == 1 and not sampler.max_rows:
+      sampler.positions(len(chunk))
+      selected = chunk
+    else:
+      selected = chunk.iloc[list(sampler.positions(len(chunk)))]
+    if header or len(selected):
+      yield selected.to_csv(index=False, header=header)
+      header = False
+  if stats is not None:
+    stats.update(rows=sampler.seen, columns=columns)
+    if sampler.truncated:
+      stats["rows_emitted"] = sampler.kept
+
+# Parser for .csv files
+def parse_csv(file_path: str, stats: dict = None) -> str:
+  try:
+    return "".join(iter_csv_chunks(file_path, stats))
+  except Exception as e:
+    logger.error("Error parsing .csv: %s", e, exc_info=True)
+    return ""
+
+def format_cell(value) -> str:
+  if value is None:
+    return ""
+  # Midnight timestamps are dates in practice; print them the way pandas does
+  if isinstance(value, datetime.datetime) and value.time() == datetime.time():
+    return value.date().isoformat()
+  return str(value)
+
+# Yields each worksheet as CSV, reading rows in openpyxl read-only mode instead
+# of building a DataFrame; the first non-empty row is the header. Sheets are
+# labelled when there is more than one. stats receives total rows, widest
+# column count and per-sheet counts.
+def iter_xlsx_sheets(file_path: str, stats: dict = None, emit: bool = True):
+  wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+  try:
+    labelled = len(wb.sheetnames) > 1
+    sheets = []
+    for ws in wb.worksheets:
+      sampler = RowSampler()
+      buffer = io.StringIO()
+      writer = csv.writer(buffer, lineterminator="\n")
+      width = None
+      columns = 0
+      for row in ws.iter_rows(values_only=True):
+        values = list(row)
+        while values and values[-1] is None:
+          values.pop()
+        if not values:
+          continue
+        columns = max(columns, len(values))
+        if width is None:
+          width = len(values)
+          if emit:
+            writer.writerow(format_cell(v) for v in values)
+          continue
+        if sampler.keep() and emit:
+          values += [None] * (width - len(values))
+          writer.writerow(format_cell(v) for v in values)
+      sheet_stats = {"name": ws.title, "rows": sampler.seen, "columns": columns}
+      if sampler.truncated:
+        sheet_stats["rows_emitted"] = sampler.kept
+      sheets.append(sheet_stats)
+      if emit:
+        csv_text = buffer.getvalue()
+        yield f"[Sheet: {ws.title}]\n{csv_text}" if labelled else csv_text
+    if stats is not None:
+      stats.update(
+        rows=sum(sheet["rows"] for sheet in sheets),
+        columns=max((sheet["columns"] for sheet in sheets), default=0),
+        sheets=sheets,
+      )
+  finally:
+    wb.close()
+
+# Parser for .xlsx files
+def parse_xlsx(file_path: str, stats: dict = None) -> str:
+  try:
+    return "\n".join(iter_xlsx_sheets(file_path, stats))
+  except Exception as e:
+    logger.error("Error parsing .xlsx: %s", e, exc_info=True)
+    return ""
+
+# Yields the text of each slide, one line per text-bearing shape
+def iter_pptx_slides(file_path: str):
+  prs = pptx.Presentation(file_path)
+  total = len(prs.slides)
+  for index, slide in enumerate(prs.slides, start=1):
+    yield "\n".join(shape.text for shape in slide.shapes if hasattr(shape, "text"))
+    report_progress(index, total)
+
+# Parser for .pptx files
+def parse_pptx(file_path: str) -> str:
+  try:
+    return "\n".join(text for text in iter_pptx_slides(file_path) if text)
+  except Exception as e:
+    logger.error("Error parsing .pptx: %s", e, exc_info=True)
+    return ""
+
+# Collects the text of an HTML document: script and style are dropped and
+# block elements start new lines
+class HtmlTextExtractor(html.parser.HTMLParser):
+  BLOCK_TAGS = {
+    "address", "blockquote", "br", "div", "h1", "h2", "h3", "h4", "h5", "h6", "hr",
+    "li", "ol", "p", "pre", "table", "title", "tr", "ul",
+  }
+
+  def __init__(self):
+    super().__init__(convert_charrefs=True)
+    self.parts = []
+    self._skip = 0
+
+  def handle_starttag(self, tag, attrs):
+    if tag in {"script", "style"}:
+      self._skip += 1
+    elif tag in self.BLOCK_TAGS:
+      self.parts.append("\n")
+
+  def handle_endtag(self, tag):
+    if tag in {"script", "style"}:
+      self._skip = max(0, self._skip - 1)
+    elif tag in self.BLOCK_TAGS:
+      self.parts.append("\n")
+
+  def handle_data(self, data):
+    if not self._skip:
+      self.parts.append(data)
+
+def html_to_text(markup: str) -> str:
+  extractor = HtmlTextExtractor()
+  extractor.feed(markup)
+  extractor.close()
+  lines = (" ".join(line.split()) for line in "".join(extractor.parts).splitlines())
+  return "\n".join(line for line in lines if line)
+
+# Attachment name, falling back to one built from the content type; repeated
+# names get a numbered suffix so results stay keyed by name
+def attachment_name(name: str, content_type: str, index: int, seen: set) -> str:
+  if not name:
+    name = f"attachment{index}{mimetypes.guess_extension(content_type or '') or ''}"
+  name = name.replace("\\", "/").rsplit("/", 1)[-1]
+  unique = name
+  stem, ext = os.path.splitext(name)
+  count = 1
+  while unique in seen:
+    count += 1
+    unique = f"{stem} ({count}){ext}"
+  seen.add(unique)
+  return unique
+
+# Splits an email into its header block, body text and (name, bytes)
+# attachments. Bodies are the text/plain parts, or the text/html parts as text
+# when there is no plain one; attached messages are not descended into.
+def split_eml_message(msg) -> tuple:
+  header = f"Subject: {msg.get('subject', '')}\nFrom: {msg.get('from', '')}\nTo: {msg.get('to', '')}"
+  bodies = {"text/plain": [], "text/html": []}
+  attachments = []
+  seen = set()
+
+  def visit(part):
+    content_type = part.get_content_type()
+    disposition = part.get_content_disposition()
+    if content_type == "message/rfc822" or disposition == "attachment" or (
+      part.get_filename() and disposition != "inline" and not part.is_multipart()
+    ):
+      if content_type == "message/rfc822":
+        attached = part.get_payload()[0]
+        name = part.get_filename() or f"{attached.get('subject') or 'message'}.eml"
+        data = attached.as_bytes(policy=email.policy.default)
+      else:
+        name = part.get_filename()
+        data = part.get_payload(decode=True) or b""
+      attachments.append((attachment_name(name, content_type, len(attachments) + 1, seen), data))
+    elif part.is_multipart():
+      for subpart in part.iter_parts():
+        visit(subpart)
+    elif content_type in bodies:
+      bodies[content_type].append(part.get_content())
+
+  visit(msg)
+  body = "".join(bodies["text/plain"]) or "\n".join(html_to_text(markup) for markup in bodies["text/html"])
+  return header, body, attachments
+
+# Same split for an Outlook message; embedded messages become .msg attachments
+def split_msg_message(msg) -> tuple:
+  header = f"Subject: {msg.subject or ''}\nFrom: {msg.sender or ''}\nTo: {msg.to or ''}"
+  body = msg.body or ""
+  if not body.strip():
+    try:
+      markup = msg.htmlBody
+    except Exception:
+      markup = None
+    if markup:
+      body = html_to_text(markup.decode("utf-8", "replace") if isinstance(markup, bytes) else markup)
+  attachments = []
+  seen = set()
+  for attachment in msg.attachments:
+    data = attachment.data
+    name = getattr(attachment, "longFilename", None) or getattr(attachment, "shortFilename", None)
+    if hasattr(data, "exportBytes"):
+      data = data.exportBytes()
+      name = name or f"{attachment.data.subject or 'message'}.msg"
+    if not isinstance(data, bytes):
+      continue
+    attachments.append((attachment_name(name, getattr(attachment, "mimetype", None), len(attachments) + 1, seen), data))
+  return header, body, attachments
+
+# Parses attachments in parallel and yields (name, result) in attachment order
+# as each one finishes. Attached messages and archives past ARCHIVE_MAX_DEPTH
+# are reported instead of parsed.
+def iter_attachment_results(attachments: list):
+  depth = _member_depth.get() + 1
+  pool = get_member_pool()
+  pending = collections.deque()  # (name, future or result) in attachment order
+  in_flight = 0
+  for name, data in attachments:
+    filetype = detect_file_type(name)
+    if not format_enabled(filetype):
+      pending.append((name, {"filetype": filetype, "error": "Unsupported file type"}))
+      continue
+    if filetype in ARCHIVE_FILETYPES | MAIL_FILETYPES and depth > ARCHIVE_MAX_DEPTH:
+      pending.append((name, {"filetype": filetype, "error": f"Nested deeper than {ARCHIVE_MAX_DEPTH} levels"}))
+      continue
+    # Bound spooled attachments like archive members, handing back the oldest first
+    while in_flight >= max_members_in_flight():
+      done_name, result = pending.popleft()
+      if isinstance(result, Future):
+        in_flight -= 1
+        result = result.result()
+      yield done_name, result
+    fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(name)[1])
+    with os.fdopen(fd, "wb") as f:
+      f.write(data)
+    pending.append((name, pool.submit(
+      call_with_request_id, _request_id.get(), parse_archive_member, tmp_path, filetype, depth
+    )))
+    in_flight += 1
+  # Submitted attachments finish (and remove their temp files) even if the caller stops early
+  for name, result in pending:
+    yield name, result.result() if isinstance(result, Future) else result
+
+# Yields the header block, the body, then the text of each attachment;
+# results receives every attachment's result by name
+def iter_mail_parts(header: str, body: str, attachments: list, results: dict = None):
+  yield header
+  yield body
+  if not MAIL_ATTACHMENTS:
+    return
+  for name, result in iter_attachment_results(attachments):
+    if results is not None:
+      results[name] = result
+    if result.get("content"):
+      yield f"--- {name} ---\n{result['content']}"
+
+def format_mail(parts) -> str:
+  header, body, *attachments = parts
+  return "\n\n".join([f"{header}\n\n{body}"] + attachments)
+
+# Yields the parts of an .eml file (see iter_mail_parts)
+def iter_eml_parts(file_path: str, results: dict = None):
+  with open(file_path, "rb") as f:
+    msg = email.message_from_binary_file(f, policy=email.policy.default)
+  yield from iter_mail_parts(*split_eml_message(msg), results)
+
+# Yields the parts of an Outlook .msg file (see iter_mail_parts)
+def iter_msg_parts(file_path: str, results: dict = None):
+  msg = extract_msg.Message(file_path)
+  try:
+    parts = split_msg_message(msg)
+  finally:
+    msg.close()
+  yield from iter_mail_parts(*parts, results)
+
+# Parser for .eml files
+def parse_eml(file_path: str, stats: dict = None) -> str:
+  try:
+    results = {}
+    content = format_mail(iter_eml_parts(file_path, results))
+    if stats is not None:
+      stats["attachments"] = results
+    return content
+  except Exception as e:
+    logger.error("Error parsing .eml: %s", e, exc_info=True)
+    return ""
+
+# Parser for .msg files (Outlook)
+def parse_msg(file_path: str, stats: dict = None) -> str:
+  try:
+    results = {}
+    content = format_mail(iter_msg_parts(file_path, results))
+    if stats is not None:
+      stats["attachments"] = results
+    return content
+  except Exception as e:
+    logger.error("Error parsing .msg: %s", e, exc_info=True)
+    return ""
+
+# Yields the raw bytes of each message in an mbox file. The file is read line
+# by line, so only one message is in memory however large the mailbox is.
+def iter_mbox_messages(file_path: str):
+  lines = None
+  with open(file_path, "rb") as f:
+    for line in f:
+      if line.startswith(b"From "):
+        if lines is not None:
+          yield b"".join(lines)
+        lines = []
+      elif lines is not None:
+        lines.append(line)
+  if lines is not None:
+    yield b"".join(lines)
+
+# Yields the text of each message in an mbox file, attachments included;
+# stats receives the message and attachment counts
+def iter_mbox_message_texts(file_path: str, stats: dict = None):
+  messages = 0
+  attachments = 0
+  for raw in iter_mbox_messages(file_path):
+    results = {}
+    msg = email.message_from_bytes(raw, policy=email.policy.default)
+    text = format_mail(iter_mail_parts(*split_eml_message(msg), results))
+    messages += 1
+    attachments += len(results)
+    if stats is not None:
+      stats.update(message_count=messages, attachment_count=attachments)
+    yield text
+
+# Parser for .mbox files; one section per message
+def parse_mbox(file_path: str, stats: dict = None) -> str:
+  try:
+    return "\n\n".join(
+      f"--- message {index} ---\n{text}"
+      for index, text in enumerate(iter_mbox_message_texts(file_path, stats), start=1)
+    )
+  except Exception as e:
+    logger.error("Error parsing .mbox: %s", e, exc_info=True)
+    return ""
+
+# Blocking client for calling the vision model from parse workers, which may be
+# threads or pool processes; answers are cached per process by image and prompt
+class VisionModel:
+  def __init__(self):
+    self.cache = LRUCache(LLAVA_CACHE_MAX_BYTES)
+    self._client = None
+    self._client_pid = None
+    self._lock = threading.Lock()
+    self._semaphore = threading.BoundedSemaphore(LLAVA_MAX_CONCURRENCY)
+    self._skip_until = 0.0
+
+  def _get_client(self):
+    with self._lock:
+      # A forked pool worker must not share the parent's connections
+      if self._client is None or self._client_pid != os.getpid():
+        self._client = httpx.Client(timeout=httpx.Timeout(LLAVA_PARSE_TIMEOUT, connect=LLAVA_CONNECT_TIMEOUT))
+        self._client_pid = os.getpid()
+      return self._client
+
+  def cache_key(self, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    return hashlib.sha256(f"{LLAVA_MODEL_NAME}\0{LLAVA_PROMPT}\0{digest}".encode("utf-8")).hexdigest()
+
+  # Text for each (bytes, mime type) image, or None where the model gave no answer
+  def extract(self, images: list) -> list:
+    results = [None] * len(images)
+    pending = {}  # cache key -> (indexes, data, mime); identical images are sent once
+    for i, (data, mime) in enumerate(images):
+      key = self.cache_key(data)
+      cached = self.cache.get(key)
+      if cached is not None:
+        results[i] = cached
+      elif key in pending:
+        pending[key][0].append(i)
+      else:
+        pending[key] = ([i], data, mime)
+    pending = [(indexes, key, data, mime) for key, (indexes, data, mime) in pending.items()]
+    for start in range(0, len(pending), LLAVA_BATCH_SIZE):
+      batch = pending[start:start + LLAVA_BATCH_SIZE]
+      for (indexes, key, _, _), text in zip(batch, self._request(batch)):
+        if text is not None:
+          for i in indexes:
+            results[i] = text
+          self.cache.set(key, text, len(text))
+    return results
+
+  def _request(self, batch: list) -> list:
+    if time.monotonic() < self._skip_until:
+      return [None] * len(batch)
+    prompt = LLAVA_PROMPT
+    if len(batch) > 1:
+      prompt += (
+        f"\n\nThere are {len(batch)} images. Answer for each one in order, starting each answer "
+        "with a line containing only [Image N], where N is the image number."
+      )
+    content = [{"type": "text", "text": prompt}]
+    for _, _, data, mime in batch:
+      image_b64 = base64.b64encode(data).decode("utf-8")
+      content.append({"type": "image_url", "image_url": {"url": f"data:{mime};base64,{image_b64}"}})
+    payload = {
+      "model": LLAVA_MODEL_NAME,
+      "messages": [{"role": "user", "content": content}],
+      "max_tokens": 1024 * len(batch)
+    }
+    try:
+      with self._semaphore, timed_stage("vision_model"):
+        response = self._get_client().post(LLAVA_URL, json=payload)
+      response.raise_for_status()
+      answer = response.json()["choices"][0]["message"]["content"]
+    except Exception as e:
+      logger.warning("Vision model call failed, falling back to OCR for %s seconds: %s", LLAVA_COOLDOWN, e)
+      self._skip_until = time.monotonic() + LLAVA_COOLDOWN
+      return [None] * len(batch)
+    if len(batch) == 1:
+      return [answer]
+    answers = split_batched_answer(answer, len(batch))
+    if answers is None:
+      # The model did not keep to one section per image; ask for them one at a time
+      logger.info("Vision model ignored the batch format, retrying %s images singly", len(batch))
+      return [self._request([item])[0] for item in batch]
+    return answers
+
+vision_model = VisionModel()
+
+# Split the "[Image N]" sections of a batched answer; None unless every image has one
+def split_batched_answer(answer: str, count: int):
+  sections = re.split(r"^\s*\[Image (\d+)\]\s*$", answer, flags=re.MULTILINE)
+  answers = {}
+  for number, text in zip(sections[1::2], sections[2::2]):
+    answers[int(number)] = text.strip()
+  if sorted(answers) != list(range(1, count + 1)):
+    return None
+  return [answers[n] for n in range(1, count + 1)]
+
+def image_to_png_bytes(img) -> bytes:
+  buffer = io.BytesIO()
+  img.save(buffer, format="PNG")
+  return buffer.getvalue()
+
+# Parser for image files (.png, .jpg, .jpeg): the vision model when LLaVA is
+# enabled, OCR otherwise or when the model gives no answer
+def parse_image(file_path: str) -> str:
+  try:
+    if LLAVA_USE:
+      with open(file_path, "rb") as f:
+        data = f.read()
+      mime = mimetypes.guess_type(file_path)[0] or "image/png"
+      text = vision_model.extract([(data, mime)])[0]
+      if text is not None:
+        return text
+      logger.info("parse_image: no answer from the vision model, using OCR")
+    img = Image.open(file_path)
+    return ocr_image(img)
+  except Exception as e:
+    logger.error("Error parsing image file: %s", e, exc_info=True)
+    return ""
+
+# A document format in the parser registry: parse(file_path, filetype, options)
+# returns (content, metadata), options holding the request's max_pdf_pages,
+# tables and pdf_backend; metadata(file_path, filetype, ctx, stats) returns the
+# format's metadata fields, also on their own for streaming; modules are the
+# libraries it imports on first use
+class DocumentFormat:
+  def __init__(self, name: str, filetypes: list, parse, metadata=None, modules: tuple = ()):
+    self.name = name
+    self.filetypes = list(filetypes)
+    self.parse = parse
+    self.metadata = metadata
+    self.modules = tuple(modules)
+
+  @property
+  def loaded(self) -> bool:
+    return all(module in sys.modules for module in self.modules)
+
+# filetype -> DocumentFormat, for every registered format whether enabled or not
+DOCUMENT_FORMATS = {}
+
+def register_format(document_format: DocumentFormat):
+  for filetype in document_format.filetypes:
+    DOCUMENT_FORMATS[filetype] = document_format
+
+def parse_format_list(value: str) -> set:
+  return {item.strip().lower().lstrip(".") for item in value.split(",") if item.strip()}
+
+# A filetype is enabled when its format is registered, selected by
+# PARSER_FORMATS (by filetype or format name) and not disabled
+def format_enabled(filetype: str) -> bool:
+  document_format = DOCUMENT_FORMATS.get(filetype)
+  if document_format is None:
+    return False
+  names = {filetype, document_format.name}
+  selected = parse_format_list(PARSER_FORMATS)
+  if "all" not in selected and not names & selected:
+    return False
+  return not names & parse_format_list(PARSER_DISABLED_FORMATS)
+
+def enabled_filetypes() -> set:
+  return {filetype for filetype in DOCUMENT_FORMATS if format_enabled(filetype)}
+
+# Import the libraries of every enabled format up front, e.g. before pool
+# workers fork so they share the pages
+def preload_formats():
+  start = time.perf_counter()
+  modules = {module for filetype in enabled_filetypes() for module in DOCUMENT_FORMATS[filetype].modules}
+  for module in sorted(modules):
+    importlib.import_module(module)
+  logger.info("Preloaded %s parser modules in %.2fs", len(modules), time.perf_counter() - start)
+
+def pdf_metadata(file_path: str, filetype: str, ctx: PdfContext = None, stats: dict = None) -> dict:
+  if ctx is None:
+    return {"page_count": get_pdf_page_count(file_path)}
+  meta = {"page_count": ctx.page_count, "pdf_backend": ctx.backend}
+  if ctx.ocr_plan is not None:
+    meta["ocr_plan"] = ctx.ocr_plan
+  if ctx.table_stats is not None:
+    meta["tables"] = ctx.table_stats
+  if ctx.page_stats:
+    meta["page_stats"] = ctx.page_stats
+  return meta
+
+# Registry parse for parsers returning only the text: parse(file_path, filetype)
+def text_format_parser(parse):
+  def parse_format(file_path: str, filetype: str, options: dict) -> tuple:
+    with timed_stage("parse"):
+      parsed_content = parse(file_path, filetype)
+    with timed_stage("metadata"):
+      metadata = extract_metadata(file_path, filetype)
+    return parsed_content, metadata
+  return parse_format
+
+# Registry parse for parsers that gather their metadata (row counts,
+# attachments) while parsing: parse(file_path, filetype, stats)
+def stats_format_parser(parse):
+  def parse_format(file_path: str, filetype: str, options: dict) -> tuple:
+    stats = {}
+    with timed_stage("parse"):
+      parsed_content = parse(file_path, filetype, stats)
+    with timed_stage("metadata"):
+      metadata = extract_metadata(file_path, filetype, stats=stats)
+    return parsed_content, metadata
+  return parse_format
+
+# PDFs share one handle between the page limit, the pages and the metadata. A
+# PDF that cannot be opened (allowed without a page limit) parses as empty.
+def parse_pdf_document(file_path: str, filetype: str, options: dict) -> tuple:
+  ctx = open_pdf_context(file_path, options.get("max_pdf_pages"), options.get("pdf_backend"))
+  with ctx or contextlib.nullcontext():
+    with timed_stage("parse"):
+      parsed_content = parse_pdf(file_path, ctx, options.get("tables"))
+    with timed_stage("metadata"):
+      metadata = extract_metadata(file_path, filetype, ctx)
+  return parsed_content, metadata
+
+# Archives add every member's result to the metadata
+def parse_archive_document(file_path: str, filetype: str, options: dict) -> tuple:
+  with timed_stage("parse"):
+    parsed_content, members = parse_archive(file_path, filetype)
+  with timed_stage("metadata"):
+    metadata = extract_metadata(file_path, filetype)
+  metadata["members"] = members
+  return parsed_content, metadata
+
+LEGACY_OFFICE_TARGETS = {"doc": ".docx", "xls": ".xlsx", "ppt": ".pptx"}
+
+register_format(DocumentFormat(
+  "text", ["txt", "md", "log", "ts"], text_format_parser(lambda path, filetype: parse_text(path))
+))
+register_format(DocumentFormat("feature", ["feature"], text_format_parser(lambda path, filetype: parse_feature(path))))
+register_format(DocumentFormat(
+  "pdf", ["pdf"], parse_pdf_document, pdf_metadata,
+  ("pdfplumber", "pypdfium2", "PIL.Image", "pytesseract") + (("pymupdf",) if PDF_BACKEND == "pymupdf" else ())
+))
+register_format(DocumentFormat(
+  "docx", ["docx"], text_format_parser(lambda path, filetype: parse_docx(path)), modules=("docx",)
+))
+register_format(DocumentFormat(
+  "csv", ["csv"], stats_format_parser(lambda path, filetype, stats: parse_csv(path, stats)),
+  lambda path, filetype, ctx, stats: stats or get_csv_shape(path), ("pandas",)
+))
+register_format(DocumentFormat(
+  "xlsx", ["xlsx"], stats_format_parser(lambda path, filetype, stats: parse_xlsx(path, stats)),
+  lambda path, filetype, ctx, stats: stats or get_xlsx_shape(path), ("openpyxl",)
+))
+register_format(DocumentFormat(
+  "pptx", ["pptx"], text_format_parser(lambda path, filetype: parse_pptx(path)),
+  lambda path, filetype, ctx, stats: {"slide_count": get_pptx_slide_count(path)}, ("pptx",)
+))
+# Converted by LibreOffice, then parsed as their modern counterparts
+register_format(DocumentFormat(
+  "legacy_office", sorted(LEGACY_OFFICE_TARGETS),
+  text_format_parser(lambda path, filetype: parse_legacy_office(path, LEGACY_OFFICE_TARGETS[filetype])),
+  modules=("docx", "openpyxl", "pandas", "pptx")
+))
+register_format(DocumentFormat(
+  "eml", ["eml"], stats_format_parser(lambda path, filetype, stats: parse_eml(path, stats)),
+  lambda path, filetype, ctx, stats: stats or {}
+))
+register_format(DocumentFormat(
+  "msg", ["msg"], stats_format_parser(lambda path, filetype, stats: parse_msg(path, stats)),
+  lambda path, filetype, ctx, stats: stats or {}, ("extract_msg",)
+))
+register_format(DocumentFormat(
+  "mbox", ["mbox"], stats_format_parser(lambda path, filetype, stats: parse_mbox(path, stats)),
+  lambda path, filetype, ctx, stats: stats or {}
+))
+register_format(DocumentFormat(
+  "image", ["png", "jpg", "jpeg"], text_format_parser(lambda path, filetype: parse_image(path)),
+  modules=("PIL.Image", "pytesseract")
+))
+register_format(DocumentFormat(
+  "archive", sorted(ARCHIVE_FILETYPES), parse_archive_document,
+  lambda path, filetype, ctx, stats: {"member_count": get_archive_member_count(path, filetype)}
+))
+
+# stats carries row/column counts already gathered while parsing csv/xlsx
+def extract_metadata(file_path: str, filetype: str, ctx: PdfContext = None, stats: dict = None) -> dict:
+  logger.debug("extract_metadata: for %s type %s", file_path, filetype)
   meta = {"size_bytes": get_file_size(file_path)}
-  if filetype == "pdf":
-    meta["page_count"] = get_pdf_page_count(file_path)
-  elif filetype == "pptx":
-    meta["slide_count"] = get_pptx_slide_count(file_path)
-  elif filetype == "csv":
-    meta.update(get_csv_shape(file_path))
-  elif filetype == "xlsx":
-    meta.update(get_xlsx_shape(file_path))
-  logger.info(f"extract_metadata: result {meta}")
+  document_format = DOCUMENT_FORMATS.get(filetype)
+  if document_format is not None and document_format.metadata is not None:
+    meta.update(document_format.metadata(file_path, filetype, ctx, stats))
+  logger.debug("extract_metadata: result %s", meta)
   return meta
 
-# /parse endpoint for file uploads
-@app.post("/parse")
-async def parse_upload(file: UploadFile = File(...)):
+# Raised by parse_document when a file is refused before parsing (mapped to 400)
+class DocumentRejectedError(Exception):
+  pass
+
+# Open the shared PDF handle, enforcing the page limit when one is given.
+# Returns None if the PDF cannot be opened and no limit applies.
+def open_pdf_context(file_path: str, max_pdf_pages: int = None, backend: str = None):
+  try:
+    ctx = PdfContext(file_path, backend)
+  except Exception as e:
+    logger.error("Error opening PDF: %s", e, exc_info=True)
+    if max_pdf_pages is not None:
+      raise DocumentRejectedError("Failed to check PDF page count.")
+    return None
+  logger.debug("PDF page count: %s", ctx.page_count)
   try:
-    logger.info(f"Received file upload: {file.filename}")
-    suffix = os.path.splitext(file.filename)[1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-      content = await file.read()
-      tmp.write(content)
-      tmp_path = tmp.name
+    check_pdf_page_limit(ctx.page_count, max_pdf_pages)
+  except DocumentRejectedError:
+    ctx.close()
+    raise
+  return ctx
 
-    filetype = detect_file_type(file.filename)
-    logger.info(f"Detected file type: {filetype}")
-    logger.info(f"Temporary file path: {tmp_path}")
+def check_pdf_page_limit(page_count: int, max_pdf_pages: int = None):
+  if max_pdf_pages is not None and page_count > max_pdf_pages:
+    logger.warning("Rejected PDF with %s pages (limit is %s)", page_count, max_pdf_pages)
+    raise DocumentRejectedError(
+      f"PDF files with more than 200 pages are not accepted. Your file has {page_count} pages."
+    )
 
-    # Special check for PDF page count limit
-    if filetype == "pdf":
-      try:
-        with pdfplumber.open(tmp_path) as pdf:
-          page_count = len(pdf.pages)
-        logger.info(f"PDF page count: {page_count}")
-        if page_count > 210:
+# Parse and extract metadata in one call so both run inside the same worker,
+# through the filetype's registered format. max_pdf_pages, tables (see
+# pdf_table_options) and pdf_backend only apply to PDFs.
+def parse_document(
+  file_path: str, filetype: str, max_pdf_pages: int = None, tables: dict = None, pdf_backend: str = None
+) -> tuple:
+  document_format = DOCUMENT_FORMATS.get(filetype)
+  if document_format is None:
+    logger.warning("Unsupported file type: %s", filetype)
+    return "", extract_metadata(file_path, filetype)
+  if not format_enabled(filetype):
+    raise DocumentRejectedError(f"Parsing .{filetype} files is disabled on this server.")
+  options = {"max_pdf_pages": max_pdf_pages, "tables": tables, "pdf_backend": pdf_backend}
+  return document_format.parse(file_path, filetype, options)
+
+class ArchiveLimitError(DocumentRejectedError):
+  pass
+
+# Running totals shared by an archive and every archive nested inside it
+class ArchiveBudget:
+  def __init__(self):
+    self.members = 0
+    self.total_bytes = 0
+
+  def add_member(self):
+    self.members += 1
+    if self.members > ARCHIVE_MAX_MEMBERS:
+      raise ArchiveLimitError(f"Archive has more than {ARCHIVE_MAX_MEMBERS} members.")
+
+  def add_bytes(self, count: int):
+    self.total_bytes += count
+    if self.total_bytes > ARCHIVE_MAX_TOTAL_BYTES:
+      raise ArchiveLimitError(f"Archive expands to more than {ARCHIVE_MAX_TOTAL_BYTES} bytes.")
+
+# Yields (name, file object) for each regular member without extracting the archive
+def iter_archive_members(file_path: str, filetype: str):
+  if filetype == "zip":
+    with zipfile.ZipFile(file_path) as zf:
+      # Declared sizes can lie, so actual bytes are counted too; this just fails fast
+      declared = sum(info.file_size for info in zf.infolist())
+      if declared > ARCHIVE_MAX_TOTAL_BYTES:
+        raise ArchiveLimitError(f"Archive expands to more than {ARCHIVE_MAX_TOTAL_BYTES} bytes.")
+      for info in zf.infolist():
+        if not info.is_dir():
+          with zf.open(info) as src:
+            yield info.filename, src
+  else:
+    # Stream mode reads the tarball sequentially, compressed or not
+    with tarfile.open(file_path, mode="r|*") as tf:
+      for member in tf:
+        if member.isfile():
+          yield member.name, tf.extractfile(member)
+
+# Copy one member to its own temp file, counting decompressed bytes as they arrive
+def spool_archive_member(src, name: str, budget: ArchiveBudget) -> str:
+  fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(name)[1])
+  try:
+    with os.fdopen(fd, "wb") as dst:
+      while True:
+        chunk = src.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+          break
+        budget.add_bytes(len(chunk))
+        dst.write(chunk)
+  except BaseException:
+    os.remove(tmp_path)
+    raise
+  return tmp_path
+
+_archive_pool = None
+_archive_pool_lock = threading.Lock()
+
+def get_archive_pool():
+  global _archive_pool
+  with _archive_pool_lock:
+    if _archive_pool is None:
+      _archive_pool = ThreadPoolExecutor(max_workers=ARCHIVE_WORKERS, thread_name_prefix="archive")
+    return _archive_pool
+
+# How many archive members or mail attachments deep the current parse is
+_member_depth = contextvars.ContextVar("member_depth", default=0)
+
+# Runs each call as it is submitted
+class InlineExecutor:
+  def submit(self, fn, *args) -> Future:
+    future = Future()
+    try:
+      future.set_result(fn(*args))
+    except BaseException as e:
+      future.set_exception(e)
+    return future
+
+# Members of a document that is itself a member (an email inside an archive,
+# an archive attached to an email) are parsed inline, so a worker never waits
+# on the pool it runs in
+def get_member_pool():
+  return InlineExecutor() if _member_depth.get() else get_archive_pool()
+
+# Members spooled to disk at once, bounded to what the workers can take on
+def max_members_in_flight() -> int:
+  return max(ARCHIVE_WORKERS, 1) * 2
+
+def parse_archive_member(tmp_path: str, filetype: str, depth: int = 1) -> dict:
+  token = _member_depth.set(depth)
+  try:
+    parsed_content, metadata = parse_document(tmp_path, filetype)
+    return {"filetype": filetype, "metadata": metadata, "content": parsed_content}
+  except Exception as e:
+    logger.error("Error parsing archive member: %s", e, exc_info=True)
+    return {"filetype": filetype, "error": str(e)}
+  finally:
+    _member_depth.reset(token)
+    os.remove(tmp_path)
+
+# Parse every member of a .zip or tar archive, recursing into nested archives.
+# Returns the concatenated text and per-member results keyed by archive path.
+def parse_archive(file_path: str, filetype: str) -> tuple:
+  budget = ArchiveBudget()
+  pool = get_member_pool()
+  members = {}
+  in_flight = {}  # future -> member path
+  max_in_flight = max_members_in_flight()
+
+  def collect(future):
+    members[in_flight.pop(future)] = future.result()
+
+  def walk(path: str, archive_type: str, prefix: str, depth: int):
+    for name, src in iter_archive_members(path, archive_type):
+      budget.add_member()
+      member_path = prefix + name
+      member_type = detect_file_type(name)
+      if not format_enabled(member_type):
+        members[member_path] = {"filetype": member_type, "error": "Unsupported file type"}
+        continue
+      if member_type in ARCHIVE_FILETYPES and depth + 1 > ARCHIVE_MAX_DEPTH:
+        raise ArchiveLimitError(f"Archive nesting is deeper than {ARCHIVE_MAX_DEPTH} levels.")
+      # Reserve the slot now so results keep archive order
+      members[member_path] = None
+      tmp_path = spool_archive_member(src, name, budget)
+      if member_type in ARCHIVE_FILETYPES:
+        del members[member_path]
+        try:
+          walk(tmp_path, member_type, member_path + "/", depth + 1)
+        finally:
           os.remove(tmp_path)
-          logger.warning(f"Rejected PDF with {page_count} pages (limit is 210)")
-          return JSONResponse(
-            status_code=400,
-            content={"detail": f"PDF files with more than 200 pages are not accepted. Your file has {page_count} pages."}
+        continue
+      while len(in_flight) >= max_in_flight:
+        done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+        for future in done:
+          collect(future)
+      in_flight[pool.submit(
+        call_with_request_id, _request_id.get(), parse_archive_member, tmp_path, member_type, depth + 1
+      )] = member_path
+
+  try:
+    # Depth counts from the outermost archive or email this one is nested in
+    walk(file_path, filetype, "", _member_depth.get())
+  finally:
+    # Members already submitted finish (and remove their temp files) either way
+    for future in list(in_flight):
+      collect(future)
+  content = "\n\n".join(
+    f"--- {path} ---\n{result['content']}" for path, result in members.items() if result.get("content")
+  )
+  return content, members
+
+# Split a document into its natural units (pages, slides, sheets, email parts)
+# for streaming; other filetypes are a single "document" unit
+def iter_document_units(file_path: str, filetype: str, ctx: PdfContext = None, tables: dict = None) -> tuple:
+  if filetype == "pdf":
+    return "page", (page.strip() for page in iter_pdf_pages(file_path, ctx, tables))
+  if filetype == "pptx":
+    return "slide", iter_pptx_slides(file_path)
+  if filetype == "xlsx":
+    return "sheet", iter_xlsx_sheets(file_path)
+  if filetype == "csv":
+    return "rows", iter_csv_chunks(file_path)
+  if filetype == "eml":
+    return "part", iter_eml_parts(file_path)
+  if filetype == "msg":
+    return "part", iter_msg_parts(file_path)
+  if filetype == "mbox":
+    return "message", iter_mbox_message_texts(file_path)
+  return "document", iter_whole_document(file_path, filetype)
+
+# Formats without natural units stream their whole text as one unit.
+# stream_document times the unit as the parse stage and has already sent the
+# metadata, so only the stages inside the parser are kept.
+def iter_whole_document(file_path: str, filetype: str):
+  timings = StageTimings()
+  token = _stage_timings.set(timings)
+  try:
+    parsed_content, _ = parse_document(file_path, filetype)
+  finally:
+    _stage_timings.reset(token)
+  for stage in ("parse", "metadata"):
+    timings.stages.pop(stage, None)
+  current = _stage_timings.get()
+  if current is not None:
+    current.merge(timings)
+  yield parsed_content
+
+# Streaming counterpart of parse_document: yields a metadata record, one record
+# per extracted unit as soon as it is ready, then a summary record
+def stream_document(
+  file_path: str, filetype: str, max_pdf_pages: int = None, tables: dict = None, pdf_backend: str = None
+):
+  with contextlib.ExitStack() as stack:
+    ctx = None
+    if filetype == "pdf":
+      ctx = open_pdf_context(file_path, max_pdf_pages, pdf_backend)
+      if ctx is not None:
+        stack.enter_context(ctx)
+    with timed_stage("metadata"):
+      metadata = extract_metadata(file_path, filetype, ctx)
+    yield {"type": "metadata", "filetype": filetype, "metadata": metadata}
+    unit, units = iter_document_units(file_path, filetype, ctx, tables)
+    count = 0
+    content_length = 0
+    # Only time spent producing units counts as parsing, not time waiting on the client
+    parse_seconds = 0.0
+    start = time.perf_counter()
+    for index, content in enumerate(units, start=1):
+      parse_seconds += time.perf_counter() - start
+      count += 1
+      content_length += len(content)
+      yield {"type": unit, "index": index, "content": content}
+      start = time.perf_counter()
+    parse_seconds += time.perf_counter() - start
+    record_stage("parse", parse_seconds)
+    summary = {"type": "summary", "unit": unit, "count": count, "content_length": content_length}
+    if ctx is not None:
+      summary["page_stats"] = ctx.page_stats
+      if ctx.table_stats is not None:
+        summary["tables"] = ctx.table_stats
+    timings = _stage_timings.get()
+    if timings is not None:
+      summary["timings"] = timings.as_dict()
+    yield summary
+
+# Copy an upload to a named temp file chunk by chunk instead of reading it whole;
+# returns the temp path and the SHA-256 of the content
+async def save_upload_to_tempfile(file: UploadFile) -> tuple:
+  suffix = os.path.splitext(file.filename)[1]
+  written = 0
+  digest = hashlib.sha256()
+  start = time.perf_counter()
+  with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+    try:
+      while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+          break
+        written += len(chunk)
+        if MAX_UPLOAD_BYTES > 0 and written > MAX_UPLOAD_BYTES:
+          raise HTTPException(
+            status_code=413,
+            detail=f"Uploaded file exceeds the maximum upload size of {MAX_UPLOAD_BYTES} bytes."
           )
-      except Exception as e:
-        logger.error(f"Error checking PDF page count: {e}", exc_info=True)
-        os.remove(tmp_path)
-        raise HTTPException(status_code=400, detail="Failed to check PDF page count.")
+        digest.update(chunk)
+        tmp.write(chunk)
+    except BaseException:
+      tmp.close()
+      os.remove(tmp.name)
+      raise
+  seconds = time.perf_counter() - start
+  stage_duration.observe(seconds, filetype=detect_file_type(file.filename), stage="upload_write")
+  record_stage("upload_write", seconds)
+  return tmp.name, digest.hexdigest()
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
 
+def encode_stream_record(record: dict, stream_format: str) -> str:
+  data = json_bytes(record).decode("utf-8")
+  if stream_format == "sse":
+    return f"event: {record['type']}\ndata: {data}\n\n"
+  return data + "\n"
+
+# Build a streaming response of parse records. The first record is produced
+# before responding so rejections still surface as normal HTTP errors; after
+# that, failures are reported as an "error" record. With remove_file the
+# stream takes ownership of file_path and deletes it when done.
+async def streaming_parse_response(
+  file_path: str, filename: str, filetype: str, stream_format: str,
+  max_pdf_pages: int = None, remove_file: bool = False, tables: dict = None, pdf_backend: str = None
+):
+  # The stream runs in a copy of this context, so the timings set here collect its stages
+  timings = StageTimings()
+  token = _stage_timings.set(timings)
+  try:
+    records = parse_executor.stream(
+      filetype, stream_document, file_path, filetype, max_pdf_pages, tables, pdf_backend
+    )
     try:
-      logger.info("Calling parse_file_router")
-      parsed_content = parse_file_router(tmp_path, filetype)
-      logger.info("Returned from parse_file_router")
-    except Exception as e:
-      logger.error(f"Exception in parse_file_router: {e}", exc_info=True)
+      first = await records.__anext__()
+    except BaseException as e:
+      await records.aclose()
+      if isinstance(e, DocumentRejectedError):
+        parse_errors.inc(filetype=filetype, kind="rejected")
+      elif isinstance(e, Exception) and not isinstance(e, HTTPException):
+        parse_errors.inc(filetype=filetype, kind="failed")
       raise
+  finally:
+    _stage_timings.reset(token)
+  first["filename"] = filename
 
+  async def body():
     try:
-      logger.info("Calling extract_metadata")
-      metadata = extract_metadata(tmp_path, filetype)
-      logger.info("Returned from extract_metadata")
+      yield encode_stream_record(first, stream_format)
+      async for record in records:
+        yield encode_stream_record(record, stream_format)
     except Exception as e:
-      logger.error(f"Exception in extract_metadata: {e}", exc_info=True)
-      raise
+      logger.error("Error while streaming %s: %s", filename, e, exc_info=True)
+      parse_errors.inc(filetype=filetype, kind="failed")
+      yield encode_stream_record({"type": "error", "detail": str(e)}, stream_format)
+    finally:
+      await records.aclose()
+      observe_timings(filetype, timings)
+      if remove_file:
+        try:
+          os.remove(file_path)
+          logger.debug("Temporary file removed: %s", file_path)
+        except Exception as e:
+          logger.error("Exception removing temp file: %s", e, exc_info=True)
 
-    logger.info(f"Parsed content length: {len(parsed_content)}")
-    logger.info(f"Extracted metadata: {metadata}")
+  return StreamingResponse(body(), media_type=STREAM_MEDIA_TYPES[stream_format])
+
+# /parse endpoint for file uploads. tables=markdown|csv adds the tables of PDF
+# pages (optionally only those in table_pages, e.g. "1-3,7") as separate blocks;
+# pdf_backend overrides PDF_BACKEND for this request. content_handle=true
+# returns a handle to the content instead of the content itself.
+@app.post("/parse")
+async def parse_upload(
+  file: UploadFile = File(...), stream: Optional[str] = None, timings: bool = False,
+  tables: Optional[str] = None, table_pages: Optional[str] = None, pdf_backend: Optional[str] = None,
+  content_handle: bool = False
+):
+  tmp_path = None
+  start = time.perf_counter()
+  request_timings = StageTimings()
+  token = _stage_timings.set(request_timings)
+  try:
+    logger.info("Received file upload: %s", file.filename)
+    if stream is not None and stream not in STREAM_MEDIA_TYPES:
+      raise HTTPException(status_code=400, detail=f"Unsupported stream format: {stream}. Use ndjson or sse.")
+    table_options = pdf_table_options(tables, table_pages)
+    check_pdf_backend(pdf_backend)
+    tmp_path, content_hash = await save_upload_to_tempfile(file)
+
+    filetype = detect_file_type(file.filename)
+    if filetype != "pdf":
+      table_options = pdf_backend = None
+    logger.debug("Detected file type: %s", filetype)
+    logger.debug("Temporary file path: %s", tmp_path)
+
+    if stream is not None:
+      try:
+        response = await streaming_parse_response(
+          tmp_path, file.filename, filetype, stream, PDF_UPLOAD_MAX_PAGES, remove_file=True,
+          tables=table_options, pdf_backend=pdf_backend
+        )
+      except DocumentRejectedError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+      # The stream now owns the temp file
+      tmp_path = None
+      return response
 
     try:
-      os.remove(tmp_path)
-      logger.info(f"Temporary file removed: {tmp_path}")
+      # PDFs above the page limit are rejected from the same handle used for parsing
+      parsed_content, metadata = await cached_parse(
+        tmp_path, filetype, content_hash, PDF_UPLOAD_MAX_PAGES, table_options, pdf_backend
+      )
+    except DocumentRejectedError as e:
+      return JSONResponse(status_code=400, content={"detail": str(e)})
     except Exception as e:
-      logger.error(f"Exception removing temp file: {e}", exc_info=True)
+      logger.error("Exception in parse_document: %s", e, exc_info=True)
+      raise
 
-    return {
-      "filename": file.filename,
-      "filetype": filetype,
-      "metadata": metadata,
-      "content": parsed_content
-    }
+    logger.info("Parsed %s as %s: %s chars", file.filename, filetype, len(parsed_content))
+    logger.debug("Extracted metadata: %s", metadata)
+
+    response = await parse_response_body(file.filename, filetype, metadata, parsed_content, content_handle)
+    if timings:
+      response["timings"] = dict(request_timings.as_dict(), total_seconds=round(time.perf_counter() - start, 6))
+    # Returned as a response so the multi-MB content skips FastAPI's encoder pass
+    return FastJSONResponse(response)
+  except HTTPException:
+    raise
   except Exception as e:
-    logger.error(f"Error in /parse: {e}", exc_info=True)
+    logger.error("Error in /parse: %s", e, exc_info=True)
     raise HTTPException(status_code=500, detail=f"Failed to parse file: {str(e)}")
+  finally:
+    _stage_timings.reset(token)
+    if tmp_path is not None:
+      try:
+        os.remove(tmp_path)
+        logger.debug("Temporary file removed: %s", tmp_path)
+      except Exception as e:
+        logger.error("Exception removing temp file: %s", e, exc_info=True)
 
 # Pydantic model for /parse-path
 class ParsePathRequest(BaseModel):
   filepath: str
+  timings: bool = False
+  tables: Optional[str] = None
+  table_pages: Optional[str] = None
+  pdf_backend: Optional[str] = None
+  content_handle: bool = False
 
 @app.post("/parse-path")
 async def parse_path(req: ParsePathRequest):
+  start = time.perf_counter()
+  request_timings = StageTimings()
+  token = _stage_timings.set(request_timings)
   try:
-    logger.info(f"Received parse-path request: {req.filepath}")
+    logger.info("Received parse-path request: %s", req.filepath)
+    table_options = pdf_table_options(req.tables, req.table_pages)
+    check_pdf_backend(req.pdf_backend)
     if not os.path.isfile(req.filepath):
-      logger.warning(f"File not found: {req.filepath}")
+      logger.warning("File not found: %s", req.filepath)
       raise HTTPException(status_code=404, detail="File not found.")
 
     try:
-      logger.info("Calling parse_file_router")
       filetype = detect_file_type(req.filepath)
-      parsed_content = parse_file_router(req.filepath, filetype)
-      logger.info("Returned from parse_file_router")
+      content_hash = await run_in_threadpool(result_cache.hash_path, req.filepath) if result_cache.enabled else None
+      pdf_backend = req.pdf_backend if filetype == "pdf" else None
+      if filetype != "pdf":
+        table_options = None
+      parsed_content, metadata = await cached_parse(
+        req.filepath, filetype, content_hash, None, table_options, pdf_backend
+      )
+    except DocumentRejectedError as e:
+      return JSONResponse(status_code=400, content={"detail": str(e)})
     except Exception as e:
-      logger.error(f"Exception in parse_file_router: {e}", exc_info=True)
+      logger.error("Exception in parse_document: %s", e, exc_info=True)
       raise
 
+    logger.info("Parsed %s as %s: %s chars", req.filepath, filetype, len(parsed_content))
+    logger.debug("Extracted metadata: %s", metadata)
+
+    response = await parse_response_body(
+      os.path.basename(req.filepath), filetype, metadata, parsed_content, req.content_handle
+    )
+    if req.timings:
+      response["timings"] = dict(request_timings.as_dict(), total_seconds=round(time.perf_counter() - start, 6))
+    return FastJSONResponse(response)
+  except HTTPException:
+    raise
+  except Exception as e:
+    logger.error("Error in /parse-path: %s", e, exc_info=True)
+    raise HTTPException(status_code=500, detail=f"Failed to parse file path: {str(e)}")
+  finally:
+    _stage_timings.reset(token)
+
+# Content behind a handle: whole, or only the PDF pages in pages (e.g. "1-3,7").
+# Byte ranges use the Range header and are answered with 206 Partial Content.
+@app.get("/results/{handle}/content")
+async def get_result_content(handle: str, pages: Optional[str] = None):
+  try:
+    index = await run_in_threadpool(result_store.index, handle)
+  except KeyError:
+    raise HTTPException(status_code=404, detail="Result not found or expired.")
+  media_type = "text/plain; charset=utf-8"
+  if pages is None:
+    return FileResponse(result_store.content_path(handle), media_type=media_type)
+  try:
+    data = await run_in_threadpool(result_store.read_pages, handle, index, parse_page_ranges(pages))
+  except ValueError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  return Response(data, media_type=media_type)
+
+@app.delete("/results/{handle}")
+async def delete_result(handle: str):
+  try:
+    removed = await run_in_threadpool(result_store.delete, handle)
+  except KeyError:
+    removed = False
+  if not removed:
+    raise HTTPException(status_code=404, detail="Result not found or expired.")
+  return {"id": handle, "deleted": True}
+
+# Parse one batch entry; failures become a per-file error instead of aborting the batch
+async def parse_batch_item(
+  index: int, file_path: str, filename: str, semaphore: asyncio.Semaphore,
+  content_hash: str = None, max_pdf_pages: int = None
+) -> dict:
+  filetype = detect_file_type(filename)
+  result = {"index": index, "filename": filename, "filetype": filetype}
+  try:
+    async with semaphore:
+      if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="File not found.")
+      if content_hash is None and result_cache.enabled:
+        content_hash = await run_in_threadpool(result_cache.hash_path, file_path)
+      parsed_content, metadata = await cached_parse(file_path, filetype, content_hash, max_pdf_pages)
+    result["metadata"] = metadata
+    result["content"] = parsed_content
+  except DocumentRejectedError as e:
+    result["error"] = {"status_code": 400, "detail": str(e)}
+  except HTTPException as e:
+    result["error"] = {"status_code": e.status_code, "detail": e.detail}
+  except Exception as e:
+    logger.error("Error parsing batch item %s: %s", filename, e, exc_info=True)
+    result["error"] = {"status_code": 500, "detail": f"Failed to parse file: {str(e)}"}
+  return result
+
+# Run batch items concurrently and return them in input order, or stream them
+# as NDJSON in completion order; cleanup runs once every item has finished
+async def batch_response(items: list, order: str, cleanup=None):
+  tasks = [asyncio.ensure_future(item) for item in items]
+
+  def finish():
+    for task in tasks:
+      task.cancel()
+    if cleanup is not None:
+      cleanup()
+
+  if order == "completed":
+    async def body():
+      try:
+        for next_done in asyncio.as_completed(tasks):
+          yield json_bytes(await next_done) + b"\n"
+      finally:
+        finish()
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+  try:
+    results = await asyncio.gather(*tasks)
+  finally:
+    finish()
+  failed = sum(1 for result in results if "error" in result)
+  return {"results": results, "succeeded": len(results) - failed, "failed": failed}
+
+def check_batch_request(count: int, order: str):
+  if order not in {"input", "completed"}:
+    raise HTTPException(status_code=400, detail=f"Unsupported order: {order}. Use input or completed.")
+  if count == 0:
+    raise HTTPException(status_code=400, detail="No files provided.")
+  if count > BATCH_MAX_FILES:
+    raise HTTPException(status_code=400, detail=f"Batches are limited to {BATCH_MAX_FILES} files.")
+
+def remove_temp_files(paths: list):
+  for path in paths:
     try:
-      logger.info("Calling extract_metadata")
-      metadata = extract_metadata(req.filepath, filetype)
-      logger.info("Returned from extract_metadata")
+      os.remove(path)
     except Exception as e:
-      logger.error(f"Exception in extract_metadata: {e}", exc_info=True)
-      raise
+      logger.error("Exception removing temp file: %s", e, exc_info=True)
+
+# /parse-batch endpoint for many uploads in one request
+@app.post("/parse-batch")
+async def parse_batch(files: List[UploadFile] = File(...), order: str = "input"):
+  tmp_paths = []
+  try:
+    logger.info("Received batch upload of %s files", len(files))
+    check_batch_request(len(files), order)
+    saved = []
+    for file in files:
+      tmp_path, content_hash = await save_upload_to_tempfile(file)
+      tmp_paths.append(tmp_path)
+      saved.append((tmp_path, file.filename, content_hash))
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    items = [
+      parse_batch_item(i, tmp_path, filename, semaphore, content_hash, PDF_UPLOAD_MAX_PAGES)
+      for i, (tmp_path, filename, content_hash) in enumerate(saved)
+    ]
+    # The batch response owns the temp files from here on
+    owned_paths, tmp_paths = tmp_paths, []
+    return await batch_response(items, order, cleanup=lambda: remove_temp_files(owned_paths))
+  except HTTPException:
+    raise
+  except Exception as e:
+    logger.error("Error in /parse-batch: %s", e, exc_info=True)
+    raise HTTPException(status_code=500, detail=f"Failed to parse batch: {str(e)}")
+  finally:
+    remove_temp_files(tmp_paths)
 
-    logger.info(f"Parsed content length: {len(parsed_content)}")
-    logger.info(f"Extracted metadata: {metadata}")
+# Pydantic model for /parse-path-batch
+class ParsePathBatchRequest(BaseModel):
+  filepaths: List[str]
+  order: str = "input"
 
-    return {
-      "filename": os.path.basename(req.filepath),
-      "filetype": filetype,
-      "metadata": metadata,
-      "content": parsed_content
-    }
+@app.post("/parse-path-batch")
+async def parse_path_batch(req: ParsePathBatchRequest):
+  try:
+    logger.info("Received parse-path batch of %s files", len(req.filepaths))
+    check_batch_request(len(req.filepaths), req.order)
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    items = [
+      parse_batch_item(i, path, os.path.basename(path), semaphore)
+      for i, path in enumerate(req.filepaths)
+    ]
+    return await batch_response(items, req.order)
+  except HTTPException:
+    raise
   except Exception as e:
-    logger.error(f"Error in /parse-path: {e}", exc_info=True)
-    raise HTTPException(status_code=500, detail=f"Failed to parse file path: {str(e)}")
+    logger.error("Error in /parse-path-batch: %s", e, exc_info=True)
+    raise HTTPException(status_code=500, detail=f"Failed to parse path batch: {str(e)}")
+
+# Raised inside a job's parse when the job is cancelled. Like asyncio's
+# CancelledError it is a BaseException, so the parsers' "except Exception"
+# fallbacks do not swallow it.
+class JobCancelledError(BaseException):
+  pass
+
+_job_progress = contextvars.ContextVar("job_progress", default=None)
+
+# Called by the page and slide iterators as units are finished; a running job
+# records its progress here and is interrupted here once cancelled
+def report_progress(done: int, total: int):
+  callback = _job_progress.get()
+  if callback is not None:
+    callback(done, total)
+
+jobs_finished = metrics.register(Counter(
+  "docparser_jobs_finished_total", "Background jobs that reached a final status, by status."
+))
+
+# SQLite persistence for background parse jobs
+class JobStore:
+  def __init__(self, path: str):
+    self.path = path
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    self._conn.row_factory = sqlite3.Row
+    with self._lock, self._conn:
+      self._conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id TEXT PRIMARY KEY, status TEXT NOT NULL, filename TEXT NOT NULL, filetype TEXT NOT NULL, "
+        "file_path TEXT NOT NULL, owns_file INTEGER NOT NULL, content_hash TEXT, max_pdf_pages INTEGER, "
+        "callback_url TEXT, progress_done INTEGER NOT NULL DEFAULT 0, progress_total INTEGER, "
+        "cancel_requested INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, "
+        "created_at REAL NOT NULL, updated_at REAL NOT NULL, finished_at REAL)"
+      )
+      self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+  def create(self, **fields) -> dict:
+    now = time.time()
+    fields.update(status="queued", created_at=now, updated_at=now)
+    columns = ", ".join(fields)
+    placeholders = ", ".join("?" for _ in fields)
+    with self._lock, self._conn:
+      self._conn.execute(f"INSERT INTO jobs ({columns}) VALUES ({placeholders})", list(fields.values()))
+    return self.get(fields["id"])
+
+  def get(self, job_id: str):
+    with self._lock:
+      row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+  def update(self, job_id: str, **fields):
+    fields["updated_at"] = time.time()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with self._lock, self._conn:
+      self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+
+  # Record progress and report whether the job has been asked to stop
+  def update_progress(self, job_id: str, done: int, total: int) -> bool:
+    with self._lock, self._conn:
+      row = self._conn.execute(
+        "UPDATE jobs SET progress_done = ?, progress_total = ?, updated_at = ? WHERE id = ? RETURNING cancel_requested",
+        (done, total, time.time(), job_id)
+      ).fetchone()
+    return bool(row and row["cancel_requested"])
+
+  # Move the oldest queued job to running in one statement, so processes
+  # sharing the database never claim the same job
+  def claim_next(self):
+    with self._lock, self._conn:
+      row = self._conn.execute(
+        "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = "
+        "(SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1) RETURNING *",
+        (time.time(),)
+      ).fetchone()
+    return dict(row) if row else None
+
+  # Queued jobs are cancelled at once; running ones stop at their next progress report
+  def request_cancel(self, job_id: str):
+    now = time.time()
+    with self._lock, self._conn:
+      self._conn.execute(
+        "UPDATE jobs SET status = 'cancelled', finished_at = ?, updated_at = ? WHERE id = ? AND status = 'queued'",
+        (now, now, job_id)
+      )
+      self._conn.execute(
+        "UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'running'",
+        (now, job_id)
+      )
+    return self.get(job_id)
+
+  def requeue_stale(self, stale_before: float) -> int:
+    with self._lock, self._conn:
+      return self._conn.execute(
+        "UPDATE jobs SET status = 'queued', progress_done = 0 WHERE status = 'running' AND updated_at < ?",
+        (stale_before,)
+      ).rowcount
+
+  # Delete jobs that finished before the cutoff; returns the files they still own
+  def expire(self, finished_before: float) -> list:
+    with self._lock, self._conn:
+      rows = self._conn.execute(
+        "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ? RETURNING file_path, owns_file",
+        (finished_before,)
+      ).fetchall()
+    return [row["file_path"] for row in rows if row["owns_file"]]
+
+def job_timestamp(value):
+  if value is None:
+    return None
+  return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc).isoformat()
+
+# Public view of a job, as returned by the API and posted to callbacks
+def job_response(job: dict) -> dict:
+  response = {
+    "id": job["id"],
+    "status": job["status"],
+    "filename": job["filename"],
+    "filetype": job["filetype"],
+    "progress": {"done": job["progress_done"], "total": job["progress_total"]},
+    "created_at": job_timestamp(job["created_at"]),
+    "finished_at": job_timestamp(job["finished_at"]),
+  }
+  if job["status"] == "running" and job["cancel_requested"]:
+    response["cancel_requested"] = True
+  if job["result"] is not None:
+    response.update(json.loads(job["result"]))
+  if job["error"] is not None:
+    response["error"] = job["error"]
+  return response
+
+def send_job_callback(job: dict):
+  try:
+    with httpx.Client(timeout=JOBS_CALLBACK_TIMEOUT) as client:
+      response = client.post(job["callback_url"], json=job_response(job))
+    if response.status_code >= 400:
+      logger.warning("Callback for job %s returned %s", job["id"], response.status_code)
+  except Exception as e:
+    logger.warning("Callback for job %s failed: %s", job["id"], e)
+
+# Records a running job's progress in the job database, at most every
+# interval seconds, and interrupts the parse once the job is cancelled
+class JobProgress:
+  def __init__(self, store: JobStore, job_id: str, interval: float):
+    self.store = store
+    self.job_id = job_id
+    self.interval = interval
+    self._last_report = 0.0
+
+  def __call__(self, done: int, total: int):
+    now = time.monotonic()
+    if done < total and now - self._last_report < self.interval:
+      return
+    self._last_report = now
+    if self.store.update_progress(self.job_id, done, total):
+      raise JobCancelledError()
+
+# One connection per job database and process; a forked worker opens its own
+_worker_job_stores = {}
+_worker_job_stores_lock = threading.Lock()
+
+def worker_job_store(path: str) -> JobStore:
+  with _worker_job_stores_lock:
+    store = _worker_job_stores.get((path, os.getpid()))
+    if store is None:
+      store = _worker_job_stores[(path, os.getpid())] = JobStore(path)
+    return store
+
+# Executor entry point for job parses. Progress goes through the job database,
+# so it is reported, and cancellation seen, in the thread and process pools alike.
+def timed_job_parse_document(job_id: str, jobs_db: str, interval: float, file_path: str, filetype: str, *args) -> tuple:
+  token = _job_progress.set(JobProgress(worker_job_store(jobs_db), job_id, interval))
+  try:
+    return timed_parse_document(file_path, filetype, *args)
+  finally:
+    _job_progress.reset(token)
+
+# Worker threads for background jobs, separate from the HTTP workers and the
+# parse executor. Idle workers poll the store, so jobs queued by other
+# processes sharing the database are picked up too.
+class JobRunner:
+  poll_seconds = 1.0
+  progress_seconds = 0.5
+  cleanup_seconds = 60.0
+
+  def __init__(self, store: JobStore, workers: int = JOBS_WORKERS):
+    self.store = store
+    self.workers = workers
+    self._wake = threading.Event()
+    self._stop = threading.Event()
+    self._cleanup_lock = threading.Lock()
+    self._next_cleanup = 0.0
+    self._threads = []
+
+  def start(self):
+    if self.workers <= 0:
+      return
+    requeued = self.store.requeue_stale(time.time() - JOBS_STALE_SECONDS)
+    if requeued:
+      logger.warning("Requeued %s jobs left running by a previous process", requeued)
+    for i in range(self.workers):
+      thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+      thread.start()
+      self._threads.append(thread)
+
+  def stop(self):
+    self._stop.set()
+    self._wake.set()
+
+  def submit(self, **fields) -> dict:
+    job = self.store.create(id=uuid.uuid4().hex, **fields)
+    self._wake.set()
+    return job
+
+  def _work(self):
+    while not self._stop.is_set():
+      self.cleanup()
+      job = self.store.claim_next()
+      if job is None:
+        self._wake.wait(self.poll_seconds)
+        self._wake.clear()
+        continue
+      self.run_job(job)
+
+  def cleanup(self, force: bool = False):
+    with self._cleanup_lock:
+      if not force and time.monotonic() < self._next_cleanup:
+        return
+      self._next_cleanup = time.monotonic() + self.cleanup_seconds
+    remove_temp_files(self.store.expire(time.time() - JOBS_TTL_SECONDS))
+
+  # Parse a job's file like the synchronous endpoints: through the result
+  # cache and the parse executor, with the job's page limit. While the
+  # executor is full (429/503) the job waits instead of failing.
+  def parse(self, job: dict) -> tuple:
+    filetype = job["filetype"]
+    content_hash = None
+    if result_cache.enabled:
+      content_hash = job["content_hash"] or result_cache.hash_path(job["file_path"])
+    worker = functools.partial(timed_job_parse_document, job["id"], self.store.path, self.progress_seconds)
+    while True:
+      try:
+        return asyncio.run(cached_parse(
+          job["file_path"], filetype, content_hash, job["max_pdf_pages"], worker=worker
+        ))
+      except HTTPException as e:
+        if e.status_code not in {429, 503}:
+          raise
+      current = self.store.get(job["id"])
+      if current is None or current["cancel_requested"]:
+        raise JobCancelledError()
+      if self._stop.wait(self.poll_seconds):
+        raise RuntimeError("Job workers are shutting down.")
+
+  def run_job(self, job: dict):
+    job_id = job["id"]
+    request_token = _request_id.set(job_id)
+    try:
+      logger.info("Job %s started for %s", job_id, job["filename"])
+      parsed_content, metadata = self.parse(job)
+    except JobCancelledError:
+      fields = {"status": "cancelled"}
+    except DocumentRejectedError as e:
+      fields = {"status": "failed", "error": str(e)}
+    except Exception as e:
+      logger.error("Job %s failed: %s", job_id, e, exc_info=True)
+      fields = {"status": "failed", "error": f"Failed to parse file: {str(e)}"}
+    else:
+      fields = {"status": "succeeded", "result": json.dumps({"metadata": metadata, "content": parsed_content})}
+    try:
+      self.store.update(job_id, finished_at=time.time(), **fields)
+      jobs_finished.inc(status=fields["status"])
+      logger.info("Job %s %s", job_id, fields["status"])
+      if job["owns_file"]:
+        remove_temp_files([job["file_path"]])
+      if job["callback_url"]:
+        send_job_callback(self.store.get(job_id))
+    finally:
+      _request_id.reset(request_token)
+
+_job_runner = None
+_job_runner_lock = threading.Lock()
+
+def get_job_runner() -> JobRunner:
+  global _job_runner
+  with _job_runner_lock:
+    if _job_runner is None:
+      _job_runner = JobRunner(JobStore(JOBS_DB))
+      _job_runner.start()
+    return _job_runner
+
+_job_store = None
+
+# The job store for reading and cancelling jobs: the runner's when it is
+# running, otherwise one opened on JOBS_DB without starting any workers
+def get_job_store() -> JobStore:
+  global _job_store
+  with _job_runner_lock:
+    if _job_runner is not None:
+      return _job_runner.store
+    if _job_store is None or _job_store.path != JOBS_DB:
+      _job_store = JobStore(JOBS_DB)
+    return _job_store
+
+def shutdown_job_runner():
+  global _job_runner
+  with _job_runner_lock:
+    if _job_runner is not None:
+      _job_runner.stop()
+      _job_runner = None
+
+def check_callback_url(callback_url: Optional[str]):
+  if callback_url and not callback_url.startswith(("http://", "https://")):
+    raise HTTPException(status_code=400, detail="callback_url must be an http(s) URL.")
+
+def job_accepted_response(job: dict) -> JSONResponse:
+  return JSONResponse(status_code=202, content=job_response(job), headers={"Location": f"/jobs/{job['id']}"})
+
+# Queue an uploaded file for background parsing; returns 202 with the job
+@app.post("/jobs")
+async def create_job(file: UploadFile = File(...), callback_url: Optional[str] = Form(None)):
+  check_callback_url(callback_url)
+  tmp_path, content_hash = await save_upload_to_tempfile(file)
+  try:
+    runner = await run_in_threadpool(get_job_runner)
+    job = await run_in_threadpool(
+      runner.submit, filename=file.filename, filetype=detect_file_type(file.filename), file_path=tmp_path,
+      owns_file=True, content_hash=content_hash, max_pdf_pages=PDF_UPLOAD_MAX_PAGES, callback_url=callback_url
+    )
+  except BaseException:
+    remove_temp_files([tmp_path])
+    raise
+  logger.info("Queued job %s for %s", job["id"], file.filename)
+  return job_accepted_response(job)
+
+# Pydantic model for /jobs/path
+class JobPathRequest(BaseModel):
+  filepath: str
+  callback_url: Optional[str] = None
+
+@app.post("/jobs/path")
+async def create_path_job(req: JobPathRequest):
+  check_callback_url(req.callback_url)
+  if not os.path.isfile(req.filepath):
+    raise HTTPException(status_code=404, detail="File not found.")
+  runner = await run_in_threadpool(get_job_runner)
+  job = await run_in_threadpool(
+    runner.submit, filename=os.path.basename(req.filepath), filetype=detect_file_type(req.filepath),
+    file_path=req.filepath, owns_file=False, content_hash=None, max_pdf_pages=None, callback_url=req.callback_url
+  )
+  logger.info("Queued job %s for %s", job["id"], req.filepath)
+  return job_accepted_response(job)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+  store = await run_in_threadpool(get_job_store)
+  job = await run_in_threadpool(store.get, job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail="Job not found.")
+  return job_response(job)
+
+# Cancel a job: queued jobs end at once, running ones at their next page
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+  store = await run_in_threadpool(get_job_store)
+  job = await run_in_threadpool(store.request_cancel, job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail="Job not found.")
+  if job["status"] == "cancelled" and job["owns_file"]:
+    await run_in_threadpool(remove_temp_files, [job["file_path"]])
+  return job_response(job)
+
+@app.get("/cache-stats")
+def cache_stats():
+  return result_cache.stats()
+
+# Formats this deployment parses, and whether their libraries are loaded yet
+@app.get("/formats")
+def list_formats():
+  formats = {}
+  for filetype, document_format in sorted(DOCUMENT_FORMATS.items()):
+    entry = formats.setdefault(document_format.name, {
+      "filetypes": [], "enabled": False, "modules": list(document_format.modules), "loaded": document_format.loaded,
+    })
+    entry["filetypes"].append(filetype)
+    entry["enabled"] = entry["enabled"] or format_enabled(filetype)
+  return {"formats": formats}
+
+# Prometheus text exposition of the in-process metrics
+@app.get("/metrics")
+def get_metrics():
+  return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Utility: format one column of Markdown table cells. Values are stringified
+# column by column with str() as before, and escaping runs once over the whole
+# column joined into a single string: pipes are escaped and newlines become <br>.
+def markdown_cells(series) -> list:
+  cells = list(map(str, series.tolist()))
+  joined = "\0".join(cells)
+  if "|" not in joined and "\n" not in joined:
+    return cells
+  if joined.count("\0") != len(cells) - 1:
+    # A cell contains the separator itself; fall back to escaping cell by cell
+    return [markdown_cells_text(cell) for cell in cells]
+  return markdown_cells_text(joined).split("\0")
+
+def markdown_cells_text(text: str) -> str:
+  return text.replace("|", "\\|").replace("\r\n", "<br>").replace("\n", "<br>")
 
 # Utility: DataFrame to Markdown
-def dataframe_to_markdown(df):
+def dataframe_to_markdown(df, align: bool = False):
   if df.empty:
     return ""
-  header = "| " + " | ".join(map(str, df.columns)) + " |"
-  separator = "| " + " | ".join(["---"] * len(df.columns)) + " |"
-  rows = ["| " + " | ".join(map(str, row)) + " |" for row in df.values]
-  return "\n".join([header, separator] + rows)
+  header_cells = [markdown_cells_text(str(c)) for c in df.columns]
+  columns = [markdown_cells(df.iloc[:, i]) for i in range(df.shape[1])]
+  if align:
+    widths = [
+      max(3, len(header), max(map(len, column), default=0))
+      for header, column in zip(header_cells, columns)
+    ]
+    header_cells = [header.ljust(width) for header, width in zip(header_cells, widths)]
+    columns = [[cell.ljust(width) for cell in column] for column, width in zip(columns, widths)]
+    separator_cells = ["-" * width for width in widths]
+  else:
+    separator_cells = ["---"] * len(columns)
+  header = "| " + " | ".join(header_cells) + " |"
+  separator = "| " + " | ".join(separator_cells) + " |"
+  # Rows are assembled by zip/join rather than per-row string formatting
+  body = " |\n| ".join(map(" | ".join, zip(*columns)))
+  return f"{header}\n{separator}\n| {body} |"
+
+# Yields the Markdown for each non-empty sheet as soon as it is converted
+def iter_markdown_sheets(file_path: str, align: bool = False):
+  emitted = False
+  with pd.ExcelFile(file_path, engine="openpyxl") as xls:
+    for sheet_name in xls.sheet_names:
+      md = dataframe_to_markdown(xls.parse(sheet_name), align)
+      if md.strip():
+        yield ("\n" if emitted else "") + f"## {sheet_name}\n\n{md}\n"
+        emitted = True
+  if not emitted:
+    logger.info("No data found in the XLSX file.")
+    yield "No data found in the XLSX file."
 
 # /xlsx-to-md endpoint
 from fastapi.responses import PlainTextResponse
 
 @app.post("/xlsx-to-md", response_class=PlainTextResponse)
-async def xlsx_to_markdown(file: UploadFile = File(...)):
-  try:
-    logger.info(f"Received XLSX upload: {file.filename}")
-    suffix = os.path.splitext(file.filename)[1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-      content = await file.read()
-      tmp.write(content)
-      tmp_path = tmp.name
-
-    # Read all sheets
-    xls = pd.ExcelFile(tmp_path, engine="openpyxl")
-    md_parts = []
-    for sheet_name in xls.sheet_names:
-      df = xls.parse(sheet_name)
-      md = dataframe_to_markdown(df)
-      if md.strip():
-        md_parts.append(f"## {sheet_name}\n\n{md}\n")
-    os.remove(tmp_path)
-    logger.info(f"Temporary file removed: {tmp_path}")
+async def xlsx_to_markdown(file: UploadFile = File(...), align: bool = False):
+  tmp_path = None
+  try:
+    logger.info("Received XLSX upload: %s", file.filename)
+    tmp_path, _ = await save_upload_to_tempfile(file)
+    sheets = parse_executor.stream("xlsx", iter_markdown_sheets, tmp_path, align)
+    # The first sheet is converted before responding so unreadable files still get a 500
+    try:
+      first = await sheets.__anext__()
+    except BaseException:
+      await sheets.aclose()
+      raise
+    stream_path, tmp_path = tmp_path, None
 
-    if not md_parts:
-      logger.info("No data found in the XLSX file.")
-      return "No data found in the XLSX file."
-    return "\n".join(md_parts)
+    async def body():
+      try:
+        yield first
+        async for part in sheets:
+          yield part
+      finally:
+        await sheets.aclose()
+        os.remove(stream_path)
+        logger.debug("Temporary file removed: %s", stream_path)
+
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
+  except HTTPException:
+    raise
   except Exception as e:
-    logger.error(f"Error in /xlsx-to-md: {e}", exc_info=True)
+    logger.error("Error in /xlsx-to-md: %s", e, exc_info=True)
     raise HTTPException(status_code=500, detail=f"Failed to convert XLSX to Markdown: {str(e)}")
+  finally:
+    if tmp_path is not None:
+      os.remove(tmp_path)
+      logger.debug("Temporary file removed: %s", tmp_path)
 
 # /caption endpoint for LLaVA image processing
+# Upstream statuses worth retrying; anything else is returned to the caller
+LLAVA_RETRY_STATUSES = {429, 502, 503, 504}
+
+# Async client for the LLaVA server. httpx clients and asyncio semaphores
+# belong to the event loop that created them, so each loop gets its own pair.
+class LlavaClient:
+  def __init__(
+    self,
+    url: str = LLAVA_URL,
+    timeout: float = LLAVA_TIMEOUT,
+    connect_timeout: float = LLAVA_CONNECT_TIMEOUT,
+    max_retries: int = LLAVA_MAX_RETRIES,
+    retry_backoff: float = LLAVA_RETRY_BACKOFF,
+    max_concurrency: int = LLAVA_MAX_CONCURRENCY,
+  ):
+    self.url = url
+    self.timeout = timeout
+    self.connect_timeout = connect_timeout
+    self.max_retries = max_retries
+    self.retry_backoff = retry_backoff
+    self.max_concurrency = max_concurrency
+    self._per_loop = weakref.WeakKeyDictionary()
+
+  def _for_loop(self) -> tuple:
+    loop = asyncio.get_running_loop()
+    entry = self._per_loop.get(loop)
+    if entry is None:
+      client = httpx.AsyncClient(
+        timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+        limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+      )
+      entry = self._per_loop[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+    return entry
+
+  async def post(self, payload: dict) -> httpx.Response:
+    client, semaphore = self._for_loop()
+    async with semaphore:
+      for attempt in range(self.max_retries + 1):
+        last_attempt = attempt == self.max_retries
+        try:
+          response = await client.post(self.url, json=payload)
+        except httpx.ReadTimeout:
+          # The model may still be generating; retrying would only add load
+          raise
+        except httpx.TransportError as e:
+          if last_attempt:
+            raise
+          logger.warning("LLaVA request failed (%s), retrying", e)
+        else:
+          if response.status_code not in LLAVA_RETRY_STATUSES or last_attempt:
+            return response
+          logger.warning("LLaVA server returned %s, retrying", response.status_code)
+        await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+
+  async def aclose(self):
+    entry = self._per_loop.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+      await entry[0].aclose()
+
+llava_client = LlavaClient()
+
 @app.post("/caption")
 async def caption(
   image: UploadFile = File(...),
   system_prompt: str = Form("You are a helpful assistant.")
 ):
   try:
-    logger.info(f"Received image for caption: {image.filename}")
+    logger.info("Received image for caption: %s", image.filename)
     if not LLAVA_USE:
       logger.warning("LLaVA integration is disabled.")
       raise HTTPException(
@@ -527,17 +4132,25 @@ async def caption(
     }
     
     # Send request to LLaVA server
-    response = requests.post(LLAVA_URL, json=payload)
+    response = await llava_client.post(payload)
     
     # Check if the request was successful
     if response.status_code != 200:
-      logger.error(f"LLaVA server error: {response.text}")
+      logger.error("LLaVA server error: %s", response.text)
       raise HTTPException(
         status_code=response.status_code,
         detail=f"LLaVA server error: {response.text}"
       )
     
     return response.json()
+  except HTTPException:
+    raise
+  except httpx.TimeoutException as e:
+    logger.error("LLaVA server timed out: %s", e)
+    raise HTTPException(status_code=504, detail="LLaVA server timed out.")
+  except httpx.TransportError as e:
+    logger.error("LLaVA server unreachable: %s", e)
+    raise HTTPException(status_code=502, detail=f"LLaVA server unreachable: {str(e)}")
   except Exception as e:
-    logger.error(f"Error in /caption: {e}", exc_info=True)
+    logger.error("Error in /caption: %s", e, exc_info=True)
     raise HTTPException(status_code=500, detail=f"Failed to process image with LLaVA: {str(e)}")
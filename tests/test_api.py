@@ -1,10 +1,21 @@
 from fastapi.testclient import TestClient
 from main import app
+import main
+import asyncio
+import json
+import threading
+import httpx
+import pytest
 import tempfile
 import os
 
 client = TestClient(app)
 
+@pytest.fixture(autouse=True)
+def fresh_result_cache(monkeypatch):
+  # Each test starts with an empty cache so results never leak between tests
+  monkeypatch.setattr(main, "result_cache", main.ParseResultCache(db_path=""))
+
 def test_parse_text_endpoint():
   with tempfile.NamedTemporaryFile(mode="w+", suffix=".txt", delete=False) as f:
     f.write("API text test")
@@ -47,3 +58,742 @@ def test_parse_ts_endpoint():
   data = response.json()
   assert data["filetype"] == "ts"
   assert "const x: number = 42;" in data["content"]
+
+async def _post_uploads(uploads):
+  transport = httpx.ASGITransport(app=app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+    return await asyncio.gather(*(
+      ac.post("/parse", files={"file": (name, body, "text/plain")}) for name, body in uploads
+    ))
+
+def test_parse_requests_overlap(monkeypatch):
+  barrier = threading.Barrier(2, timeout=5)
+  def blocking_parse(file_path):
+    # Only returns if both requests are being parsed at the same time
+    barrier.wait()
+    return "overlapped"
+  monkeypatch.setattr(main, "parse_text", blocking_parse)
+  monkeypatch.setattr(main, "parse_executor", main.ParseExecutor(thread_workers=2, process_workers=0))
+  responses = asyncio.run(_post_uploads([("a.txt", b"a"), ("b.txt", b"b")]))
+  assert [r.status_code for r in responses] == [200, 200]
+  assert all(r.json()["content"] == "overlapped" for r in responses)
+
+def test_health_check_not_blocked_by_parse(monkeypatch):
+  release = threading.Event()
+  def blocking_parse(file_path):
+    release.wait(timeout=5)
+    return "done"
+  monkeypatch.setattr(main, "parse_text", blocking_parse)
+  monkeypatch.setattr(main, "parse_executor", main.ParseExecutor(thread_workers=1, process_workers=0))
+  async def run():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+      parse = asyncio.ensure_future(ac.post("/parse", files={"file": ("a.txt", b"a", "text/plain")}))
+      await asyncio.sleep(0.1)
+      health = await ac.get("/")
+      assert not parse.done()
+      release.set()
+      return health, await parse
+  health, parse = asyncio.run(run())
+  assert health.status_code == 200
+  assert parse.status_code == 200
+
+def test_parse_queue_full_returns_503(monkeypatch):
+  release = threading.Event()
+  def blocking_parse(file_path):
+    release.wait(timeout=5)
+    return "done"
+  monkeypatch.setattr(main, "parse_text", blocking_parse)
+  monkeypatch.setattr(main, "parse_executor", main.ParseExecutor(thread_workers=1, process_workers=0, max_queue=0))
+  async def run():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+      first = asyncio.ensure_future(ac.post("/parse", files={"file": ("a.txt", b"a", "text/plain")}))
+      await asyncio.sleep(0.1)
+      rejected = await ac.post("/parse", files={"file": ("b.txt", b"b", "text/plain")})
+      release.set()
+      return await first, rejected
+  first, rejected = asyncio.run(run())
+  assert first.status_code == 200
+  assert rejected.status_code == 503
+  assert "Retry-After" in rejected.headers
+
+def test_parse_filetype_limit_returns_429(monkeypatch):
+  release = threading.Event()
+  def blocking_parse(file_path):
+    release.wait(timeout=5)
+    return "done"
+  monkeypatch.setattr(main, "parse_text", blocking_parse)
+  monkeypatch.setattr(main, "parse_executor", main.ParseExecutor(
+    thread_workers=2, process_workers=0, filetype_limits="txt=1", filetype_max_waiting=0
+  ))
+  async def run():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+      first = asyncio.ensure_future(ac.post("/parse", files={"file": ("a.txt", b"a", "text/plain")}))
+      await asyncio.sleep(0.1)
+      rejected = await ac.post("/parse", files={"file": ("b.txt", b"b", "text/plain")})
+      release.set()
+      return await first, rejected
+  first, rejected = asyncio.run(run())
+  assert first.status_code == 200
+  assert rejected.status_code == 429
+
+def test_upload_over_content_length_limit_rejected():
+  limited_client = TestClient(main.MaxBodySizeMiddleware(app, max_bytes=100))
+  response = limited_client.post("/parse", files={"file": ("big.txt", b"x" * 1000, "text/plain")})
+  assert response.status_code == 413
+
+def test_streamed_upload_rejected_before_fully_received():
+  preamble = b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="big.txt"\r\n\r\n'
+  chunks = [preamble] + [b"x" * 64 for _ in range(100)]
+  consumed = []
+  sent = []
+  async def receive():
+    if chunks:
+      consumed.append(1)
+      return {"type": "http.request", "body": chunks.pop(0), "more_body": bool(chunks)}
+    return {"type": "http.disconnect"}
+  async def send(message):
+    sent.append(message)
+  scope = {
+    "type": "http", "method": "POST", "path": "/parse", "raw_path": b"/parse", "root_path": "",
+    "query_string": b"", "scheme": "http", "server": ("test", 80), "client": ("test", 1234),
+    "http_version": "1.1",
+    "headers": [(b"content-type", b"multipart/form-data; boundary=xyz"), (b"transfer-encoding", b"chunked")],
+  }
+  asyncio.run(main.MaxBodySizeMiddleware(app, max_bytes=256)(scope, receive, send))
+  assert sent[0]["status"] == 413
+  assert len(consumed) < 10
+
+def test_parse_upload_streams_in_chunks(monkeypatch):
+  monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 4)
+  response = client.post("/parse", files={"file": ("chunks.txt", b"streamed in small chunks", "text/plain")})
+  assert response.status_code == 200
+  assert response.json()["content"] == "streamed in small chunks"
+
+def test_parse_upload_file_size_limit(monkeypatch):
+  monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 10)
+  response = client.post("/parse", files={"file": ("big.txt", b"x" * 100, "text/plain")})
+  assert response.status_code == 413
+
+def test_parse_upload_cache_hit(monkeypatch):
+  calls = []
+  def counting_parse(file_path):
+    calls.append(file_path)
+    return "cached content"
+  monkeypatch.setattr(main, "parse_text", counting_parse)
+  for _ in range(2):
+    response = client.post("/parse", files={"file": ("same.txt", b"same bytes", "text/plain")})
+    assert response.status_code == 200
+    assert response.json()["content"] == "cached content"
+  assert len(calls) == 1
+  stats = client.get("/cache-stats").json()
+  assert stats["hits"] == 1 and stats["misses"] == 1
+
+def test_parse_path_cache_skips_rehash_when_unchanged(monkeypatch):
+  hashed = []
+  real_hash_file = main.hash_file
+  def counting_hash(path):
+    hashed.append(path)
+    return real_hash_file(path)
+  monkeypatch.setattr(main, "hash_file", counting_hash)
+  with tempfile.NamedTemporaryFile(mode="w+", suffix=".txt", delete=False) as f:
+    f.write("path cache")
+    path = f.name
+  try:
+    for _ in range(2):
+      response = client.post("/parse-path", json={"filepath": path})
+      assert response.json()["content"] == "path cache"
+    assert len(hashed) == 1
+    # A modified file is hashed again and re-parsed
+    with open(path, "w") as f:
+      f.write("path cache changed!")
+    response = client.post("/parse-path", json={"filepath": path})
+    assert response.json()["content"] == "path cache changed!"
+    assert len(hashed) == 2
+  finally:
+    os.remove(path)
+
+def test_result_cache_disk_tier_survives_restart():
+  db_path = tempfile.mktemp(suffix=".sqlite")
+  try:
+    value = {"filetype": "txt", "metadata": {"size_bytes": 3}, "content": "abc"}
+    first = main.ParseResultCache(max_bytes=1024, db_path=db_path)
+    key = first.key("hash", "txt", {})
+    first.set(key, value)
+    restarted = main.ParseResultCache(max_bytes=1024, db_path=db_path)
+    assert restarted.get(key) == value
+    assert restarted.disk_hits == 1
+  finally:
+    os.remove(db_path)
+
+def test_lru_cache_evicts_by_bytes():
+  cache = main.LRUCache(max_bytes=10)
+  cache.set("a", "a", 4)
+  cache.set("b", "b", 4)
+  cache.get("a")
+  cache.set("c", "c", 4)
+  assert cache.get("b") is None
+  assert cache.get("a") == "a" and cache.get("c") == "c"
+  assert cache.current_bytes == 8
+
+def test_parse_stream_ndjson_pdf():
+  from fpdf import FPDF
+  path = tempfile.mktemp(suffix=".pdf")
+  pdf = FPDF()
+  pdf.set_font("Arial", size=12)
+  for i in range(3):
+    pdf.add_page()
+    pdf.cell(200, 10, txt=f"Streamed page {i + 1}", ln=True)
+  pdf.output(path)
+  try:
+    with open(path, "rb") as f:
+      response = client.post("/parse?stream=ndjson", files={"file": ("doc.pdf", f, "application/pdf")})
+  finally:
+    os.remove(path)
+  assert response.status_code == 200
+  assert response.headers["content-type"].startswith("application/x-ndjson")
+  records = [json.loads(line) for line in response.text.splitlines()]
+  assert records[0]["type"] == "metadata"
+  assert records[0]["metadata"]["page_count"] == 3
+  assert [r["content"] for r in records[1:-1]] == ["Streamed page 1", "Streamed page 2", "Streamed page 3"]
+  assert records[-1]["type"] == "summary" and records[-1]["count"] == 3
+  assert records[-1]["timings"]["counts"]["pdf_pages_text"] == 3
+
+def test_parse_stream_sse_text():
+  response = client.post("/parse?stream=sse", files={"file": ("a.txt", b"sse body", "text/plain")})
+  assert response.status_code == 200
+  events = [block for block in response.text.split("\n\n") if block]
+  assert [e.splitlines()[0] for e in events] == ["event: metadata", "event: document", "event: summary"]
+  assert json.loads(events[1].splitlines()[1][len("data: "):])["content"] == "sse body"
+
+def test_parse_stream_unknown_format():
+  response = client.post("/parse?stream=xml", files={"file": ("a.txt", b"x", "text/plain")})
+  assert response.status_code == 400
+
+def test_parse_batch_uploads():
+  files = [
+    ("files", ("one.txt", b"first file", "text/plain")),
+    ("files", ("two.csv", b"a,b\n1,2", "text/csv")),
+  ]
+  response = client.post("/parse-batch", files=files)
+  assert response.status_code == 200
+  data = response.json()
+  assert data["succeeded"] == 2 and data["failed"] == 0
+  assert [r["filename"] for r in data["results"]] == ["one.txt", "two.csv"]
+  assert data["results"][0]["content"] == "first file"
+  assert "1,2" in data["results"][1]["content"]
+
+def test_parse_path_batch_reports_errors_per_file():
+  with tempfile.NamedTemporaryFile(mode="w+", suffix=".txt", delete=False) as f:
+    f.write("batch path")
+    path = f.name
+  try:
+    response = client.post("/parse-path-batch", json={"filepaths": [path, "missing.txt"]})
+  finally:
+    os.remove(path)
+  assert response.status_code == 200
+  results = response.json()["results"]
+  assert results[0]["content"] == "batch path"
+  assert results[1]["error"]["status_code"] == 404
+
+def test_parse_batch_runs_concurrently_and_streams_as_completed(monkeypatch):
+  barrier = threading.Barrier(2, timeout=5)
+  def blocking_parse(file_path):
+    barrier.wait()
+    return os.path.basename(file_path)
+  monkeypatch.setattr(main, "parse_text", blocking_parse)
+  monkeypatch.setattr(main, "parse_executor", main.ParseExecutor(thread_workers=2, process_workers=0))
+  files = [
+    ("files", ("a.txt", b"a", "text/plain")),
+    ("files", ("b.txt", b"b", "text/plain")),
+  ]
+  response = client.post("/parse-batch?order=completed", files=files)
+  assert response.status_code == 200
+  results = [json.loads(line) for line in response.text.splitlines()]
+  assert sorted(r["index"] for r in results) == [0, 1]
+  assert all("error" not in r for r in results)
+
+def test_parse_zip_upload_returns_members():
+  import io
+  import zipfile
+  buffer = io.BytesIO()
+  with zipfile.ZipFile(buffer, "w") as zf:
+    zf.writestr("one.txt", "first member")
+    zf.writestr("two.txt", "second member")
+  response = client.post("/parse", files={"file": ("bundle.zip", buffer.getvalue(), "application/zip")})
+  assert response.status_code == 200
+  data = response.json()
+  assert data["filetype"] == "zip"
+  assert data["metadata"]["member_count"] == 2
+  assert data["metadata"]["members"]["two.txt"]["content"] == "second member"
+  assert "first member" in data["content"]
+
+def test_cached_zip_follows_member_options(monkeypatch):
+  import io
+  import zipfile
+  buffer = io.BytesIO()
+  with zipfile.ZipFile(buffer, "w") as zf:
+    zf.writestr("table.csv", "a,b\n1,2\n3,4\n5,6")
+  upload = lambda: client.post("/parse", files={"file": ("bundle.zip", buffer.getvalue(), "application/zip")}).json()
+  assert "5,6" in upload()["metadata"]["members"]["table.csv"]["content"]
+  # Changing a member parser's option or the enabled formats misses the cached result
+  monkeypatch.setattr(main, "TABULAR_MAX_ROWS", 1)
+  assert "5,6" not in upload()["metadata"]["members"]["table.csv"]["content"]
+  monkeypatch.setattr(main, "PARSER_DISABLED_FORMATS", "csv")
+  assert upload()["metadata"]["members"]["table.csv"]["error"] == "Unsupported file type"
+
+def test_cached_email_follows_attachment_options(monkeypatch):
+  from email.message import EmailMessage
+  msg = EmailMessage()
+  msg["Subject"] = "Figures"
+  msg.set_content("see attached")
+  msg.add_attachment(b"a,b\n1,2\n3,4\n5,6", maintype="text", subtype="csv", filename="table.csv")
+  upload = lambda: client.post("/parse", files={"file": ("figures.eml", msg.as_bytes(), "message/rfc822")}).json()
+  assert "5,6" in upload()["metadata"]["attachments"]["table.csv"]["content"]
+  monkeypatch.setattr(main, "TABULAR_MAX_ROWS", 1)
+  assert "5,6" not in upload()["metadata"]["attachments"]["table.csv"]["content"]
+
+def test_parse_zip_over_limit_rejected(monkeypatch):
+  import io
+  import zipfile
+  monkeypatch.setattr(main, "ARCHIVE_MAX_MEMBERS", 1)
+  buffer = io.BytesIO()
+  with zipfile.ZipFile(buffer, "w") as zf:
+    zf.writestr("one.txt", "1")
+    zf.writestr("two.txt", "2")
+  response = client.post("/parse", files={"file": ("bundle.zip", buffer.getvalue(), "application/zip")})
+  assert response.status_code == 400
+  assert "more than 1 members" in response.json()["detail"]
+
+def test_xlsx_to_markdown_streams_all_sheets():
+  import pandas as pd
+  path = tempfile.mktemp(suffix=".xlsx")
+  with pd.ExcelWriter(path) as writer:
+    pd.DataFrame({"a": [1]}).to_excel(writer, sheet_name="First", index=False)
+    pd.DataFrame().to_excel(writer, sheet_name="Empty", index=False)
+    pd.DataFrame({"b": ["x"]}).to_excel(writer, sheet_name="Second", index=False)
+  try:
+    with open(path, "rb") as f:
+      response = client.post("/xlsx-to-md", files={"file": ("book.xlsx", f, "application/octet-stream")})
+  finally:
+    os.remove(path)
+  assert response.status_code == 200
+  assert response.text == (
+    "## First\n\n| a |\n| --- |\n| 1 |\n"
+    "\n## Second\n\n| b |\n| --- |\n| x |\n"
+  )
+
+def test_xlsx_to_markdown_invalid_file():
+  response = client.post("/xlsx-to-md", files={"file": ("bad.xlsx", b"not a workbook", "application/octet-stream")})
+  assert response.status_code == 500
+
+def test_parse_timings_and_metrics():
+  before = main.stage_duration.value(filetype="txt", stage="parse")[1]
+  response = client.post("/parse?timings=true", files={"file": ("a.txt", b"timed", "text/plain")})
+  assert response.status_code == 200
+  timings = response.json()["timings"]
+  assert set(timings["stages"]) == {"upload_write", "parse", "metadata"}
+  assert timings["total_seconds"] >= timings["stages"]["parse"]["seconds"]
+  assert "timings" not in client.post("/parse", files={"file": ("a.txt", b"untimed", "text/plain")}).json()
+  assert main.stage_duration.value(filetype="txt", stage="parse")[1] == before + 2
+
+  client.post("/parse", files={"file": ("bad.pdf", b"not a pdf", "application/pdf")})
+  response = client.get("/metrics")
+  assert response.status_code == 200
+  assert response.headers["content-type"].startswith("text/plain")
+  text = response.text
+  assert "# TYPE docparser_stage_duration_seconds histogram" in text
+  assert 'docparser_stage_duration_seconds_bucket{filetype="txt",stage="parse",le="+Inf"}' in text
+  assert 'docparser_parse_errors_total{filetype="pdf",kind="rejected"}' in text
+  assert "docparser_http_requests_in_flight 1" in text
+
+def test_request_id_is_echoed_and_reaches_parse_worker(monkeypatch):
+  seen = []
+  original = main.parse_document
+  def recording_parse_document(*args):
+    seen.append(main._request_id.get())
+    return original(*args)
+  monkeypatch.setattr(main, "parse_document", recording_parse_document)
+  response = client.post(
+    "/parse", files={"file": ("a.txt", b"traced", "text/plain")}, headers={"X-Request-ID": "req-123"}
+  )
+  assert response.status_code == 200
+  assert response.headers["x-request-id"] == "req-123"
+  assert seen == ["req-123"]
+  assert len(client.get("/").headers["x-request-id"]) == 32
+
+def test_json_log_formatter_includes_request_id_and_extra_fields():
+  import logging
+  record = logging.LogRecord("main", logging.INFO, __file__, 1, "parsed %s pages", (3,), None)
+  record.pages = 3
+  token = main._request_id.set("req-456")
+  try:
+    main.RequestIdFilter().filter(record)
+  finally:
+    main._request_id.reset(token)
+  entry = json.loads(main.JsonLogFormatter().format(record))
+  assert entry["message"] == "parsed 3 pages"
+  assert entry["request_id"] == "req-456"
+  assert entry["pages"] == 3
+
+@pytest.fixture
+def llava_stub(monkeypatch):
+  # Local stand-in for the model server; counts concurrent requests and can
+  # answer with scripted statuses before succeeding
+  from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+  import time
+  state = {"active": 0, "peak": 0, "calls": 0, "statuses": [], "delay": 0.2}
+  lock = threading.Lock()
+
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+      self.rfile.read(int(self.headers["Content-Length"]))
+      with lock:
+        state["calls"] += 1
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        status = state["statuses"].pop(0) if state["statuses"] else 200
+      time.sleep(state["delay"])
+      with lock:
+        state["active"] -= 1
+      body = json.dumps({"choices": [{"message": {"content": "a cat"}}]}).encode()
+      self.send_response(status)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, *args):
+      pass
+
+  server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+  monkeypatch.setattr(main, "LLAVA_USE", True)
+  state["url"] = url
+  yield state
+  server.shutdown()
+  server.server_close()
+
+async def _post_captions(count):
+  transport = httpx.ASGITransport(app=app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+    return await asyncio.gather(*(
+      ac.post("/caption", files={"image": (f"{i}.png", b"\x89PNG", "image/png")}) for i in range(count)
+    ))
+
+def test_captions_run_concurrently_up_to_limit(llava_stub, monkeypatch):
+  import time
+  monkeypatch.setattr(main, "llava_client", main.LlavaClient(url=llava_stub["url"], max_concurrency=3))
+  start = time.perf_counter()
+  responses = asyncio.run(_post_captions(6))
+  elapsed = time.perf_counter() - start
+  assert [r.status_code for r in responses] == [200] * 6
+  assert responses[0].json()["choices"][0]["message"]["content"] == "a cat"
+  assert llava_stub["peak"] == 3
+  # Two waves of three instead of six calls in a row
+  assert elapsed < 6 * llava_stub["delay"] * 0.75
+
+def test_caption_retries_then_reports_upstream_errors(llava_stub, monkeypatch):
+  llava_stub["delay"] = 0
+  monkeypatch.setattr(main, "llava_client", main.LlavaClient(url=llava_stub["url"], retry_backoff=0, max_retries=2))
+  llava_stub["statuses"] = [503, 502]
+  response = client.post("/caption", files={"image": ("a.png", b"\x89PNG", "image/png")})
+  assert response.status_code == 200 and llava_stub["calls"] == 3
+  llava_stub["statuses"] = [503, 503, 503]
+  response = client.post("/caption", files={"image": ("a.png", b"\x89PNG", "image/png")})
+  assert response.status_code == 503 and llava_stub["calls"] == 6
+
+def test_caption_unreachable_server_returns_502(monkeypatch):
+  monkeypatch.setattr(main, "LLAVA_USE", True)
+  monkeypatch.setattr(main, "llava_client", main.LlavaClient(url="http://127.0.0.1:9/", max_retries=0))
+  response = client.post("/caption", files={"image": ("a.png", b"\x89PNG", "image/png")})
+  assert response.status_code == 502
+
+@pytest.fixture
+def job_runner(monkeypatch, tmp_path):
+  # A private job database and one worker per test
+  runner = main.JobRunner(main.JobStore(str(tmp_path / "jobs.sqlite3")), workers=1)
+  runner.poll_seconds = 0.05
+  runner.start()
+  monkeypatch.setattr(main, "_job_runner", runner)
+  yield runner
+  runner.stop()
+
+def _wait_for_job(job_id, statuses=("succeeded", "failed", "cancelled"), timeout=10):
+  import time
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    job = client.get(f"/jobs/{job_id}").json()
+    if job["status"] in statuses:
+      return job
+    time.sleep(0.02)
+  raise AssertionError(f"job {job_id} did not reach {statuses}")
+
+def test_job_is_queued_and_polled_to_completion(job_runner):
+  response = client.post("/jobs", files={"file": ("notes.txt", b"queued job text", "text/plain")})
+  assert response.status_code == 202
+  job = response.json()
+  assert response.headers["location"] == f"/jobs/{job['id']}"
+  assert job["status"] in ("queued", "running", "succeeded")
+  done = _wait_for_job(job["id"])
+  assert done["status"] == "succeeded"
+  assert done["content"] == "queued job text"
+  assert done["filetype"] == "txt"
+  assert "metadata" in done
+  assert done["finished_at"] is not None
+  # The uploaded copy is removed once the job is done
+  assert not os.path.exists(job_runner.store.get(job["id"])["file_path"])
+  assert client.get("/jobs/unknown").status_code == 404
+
+def test_running_job_reports_progress_and_can_be_cancelled(job_runner, monkeypatch, tmp_path):
+  import time
+  def slow_parse(file_path, filetype, max_pdf_pages=None):
+    for page in range(1, 1001):
+      time.sleep(0.01)
+      main.report_progress(page, 1000)
+    return "never", {}
+  monkeypatch.setattr(main, "parse_document", slow_parse)
+  monkeypatch.setattr(main, "parse_executor", main.ParseExecutor(thread_workers=1, process_workers=0))
+  job_runner.progress_seconds = 0
+  path = tmp_path / "big.pdf"
+  path.write_bytes(b"%PDF")
+  job = client.post("/jobs/path", json={"filepath": str(path)}).json()
+  running = _wait_for_job(job["id"], statuses=("running",))
+  while running["progress"]["done"] == 0:
+    running = client.get(f"/jobs/{job['id']}").json()
+  assert running["progress"]["total"] == 1000
+  assert client.delete(f"/jobs/{job['id']}").json()["cancel_requested"] is True
+  cancelled = _wait_for_job(job["id"])
+  assert cancelled["status"] == "cancelled"
+  assert cancelled["progress"]["done"] < 1000
+  assert "content" not in cancelled
+  # Path jobs never delete the caller's file
+  assert path.exists()
+
+def test_job_applies_upload_page_limit_to_cached_results(job_runner, monkeypatch, tmp_path):
+  # A result cached by /parse-path does not let a job skip the upload page limit
+  from fpdf import FPDF
+  monkeypatch.setattr(main, "parse_executor", main.ParseExecutor(thread_workers=1, process_workers=0))
+  monkeypatch.setattr(main, "PDF_UPLOAD_MAX_PAGES", 3)
+  pdf = FPDF()
+  pdf.set_font("Arial", size=12)
+  for i in range(5):
+    pdf.add_page()
+    pdf.cell(0, 10, txt=f"Page {i + 1}", ln=True)
+  path = tmp_path / "five.pdf"
+  pdf.output(str(path))
+  assert client.post("/parse-path", json={"filepath": str(path)}).status_code == 200
+  job = client.post("/jobs", files={"file": ("five.pdf", path.read_bytes(), "application/pdf")}).json()
+  done = _wait_for_job(job["id"])
+  assert done["status"] == "failed"
+  assert "page" in done["error"]
+
+def test_reading_a_job_does_not_start_workers(monkeypatch, tmp_path):
+  monkeypatch.setattr(main, "JOBS_DB", str(tmp_path / "jobs.sqlite3"))
+  monkeypatch.setattr(main, "_job_runner", None)
+  monkeypatch.setattr(main, "_job_store", None)
+  assert client.get("/jobs/unknown").status_code == 404
+  assert client.delete("/jobs/unknown").status_code == 404
+  assert main._job_runner is None
+
+def test_queued_job_survives_restart_and_is_cancellable(tmp_path, monkeypatch):
+  db = str(tmp_path / "jobs.sqlite3")
+  # Workers set to 0 only queue, as in an HTTP-only deployment
+  monkeypatch.setattr(main, "_job_runner", main.JobRunner(main.JobStore(db), workers=0))
+  path = tmp_path / "a.csv"
+  path.write_text("a,b\n1,2")
+  first = client.post("/jobs/path", json={"filepath": str(path)}).json()
+  second = client.post("/jobs/path", json={"filepath": str(path)}).json()
+  assert client.delete(f"/jobs/{second['id']}").json()["status"] == "cancelled"
+  runner = main.JobRunner(main.JobStore(db), workers=1)
+  runner.poll_seconds = 0.05
+  monkeypatch.setattr(main, "_job_runner", runner)
+  runner.start()
+  try:
+    done = _wait_for_job(first["id"])
+    assert done["status"] == "succeeded"
+    assert "a" in done["content"]
+    assert runner.store.get(second["id"])["status"] == "cancelled"
+  finally:
+    runner.stop()
+
+def test_job_callback_and_ttl_cleanup(job_runner, monkeypatch):
+  from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+  received = []
+  delivered = threading.Event()
+
+  class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+      received.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+      self.send_response(204)
+      self.end_headers()
+      delivered.set()
+
+    def log_message(self, *args):
+      pass
+
+  server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  try:
+    callback_url = f"http://127.0.0.1:{server.server_address[1]}/done"
+    assert client.post("/jobs", files={"file": ("x.txt", b"hi", "text/plain")}, data={"callback_url": "ftp://x"}).status_code == 400
+    job = client.post("/jobs", files={"file": ("x.txt", b"hi", "text/plain")}, data={"callback_url": callback_url}).json()
+    assert delivered.wait(10)
+  finally:
+    server.shutdown()
+    server.server_close()
+  assert received[0]["id"] == job["id"]
+  assert received[0]["status"] == "succeeded"
+  assert received[0]["content"] == "hi"
+  monkeypatch.setattr(main, "JOBS_TTL_SECONDS", -1)
+  job_runner.cleanup(force=True)
+  assert client.get(f"/jobs/{job['id']}").status_code == 404
+
+def test_parse_tables_options():
+  from fpdf import FPDF
+  pdf = FPDF()
+  pdf.set_font("Arial", size=10)
+  pdf.add_page()
+  for row in [["Item", "Cost"], ["Paper", "4"]]:
+    for cell in row:
+      pdf.cell(30, 8, txt=cell, border=1)
+    pdf.ln()
+  path = tempfile.mktemp(suffix=".pdf")
+  pdf.output(path)
+  try:
+    with open(path, "rb") as f:
+      response = client.post("/parse?tables=csv&table_pages=1", files={"file": ("t.pdf", f, "application/pdf")})
+    assert response.status_code == 200
+    data = response.json()
+    assert "```csv\nItem,Cost\nPaper,4\n```" in data["content"]
+    assert data["metadata"]["tables"]["tables"] == 1
+    # Table options are part of the cache key, so a plain parse is not served the tables
+    plain = client.post("/parse-path", json={"filepath": path}).json()
+    assert "```csv" not in plain["content"]
+    assert client.post("/parse-path", json={"filepath": path, "tables": "html"}).status_code == 400
+    assert client.post("/parse-path", json={"filepath": path, "tables": "csv", "table_pages": "2-1"}).status_code == 400
+    assert client.post("/parse-path", json={"filepath": path, "table_pages": "1"}).status_code == 400
+  finally:
+    os.remove(path)
+
+def test_formats_can_be_disabled_by_configuration(monkeypatch):
+  import io
+  import zipfile
+  monkeypatch.setattr(main, "PARSER_FORMATS", "text,pdf,zip")
+  monkeypatch.setattr(main, "PARSER_DISABLED_FORMATS", "md")
+  response = client.post("/parse", files={"file": ("a.csv", b"a,b\n1,2", "text/csv")})
+  assert response.status_code == 400
+  assert response.json()["detail"] == "Parsing .csv files is disabled on this server."
+  assert client.post("/parse", files={"file": ("a.md", b"# hi", "text/markdown")}).status_code == 400
+  assert client.post("/parse", files={"file": ("a.txt", b"still on", "text/plain")}).json()["content"] == "still on"
+  buffer = io.BytesIO()
+  with zipfile.ZipFile(buffer, "w") as archive:
+    archive.writestr("notes.txt", "inside")
+    archive.writestr("table.csv", "a,b\n1,2")
+  data = client.post("/parse", files={"file": ("a.zip", buffer.getvalue(), "application/zip")}).json()
+  assert data["metadata"]["members"]["table.csv"]["error"] == "Unsupported file type"
+  assert "inside" in data["content"]
+  formats = client.get("/formats").json()["formats"]
+  assert formats["text"]["enabled"] and formats["pdf"]["enabled"] and not formats["csv"]["enabled"]
+  assert formats["csv"]["modules"] == ["pandas"]
+
+def test_pdf_backend_per_request():
+  pytest.importorskip("pymupdf")
+  from fpdf import FPDF
+  pdf = FPDF()
+  pdf.set_font("Arial", size=12)
+  pdf.add_page()
+  pdf.cell(200, 10, txt="Backend choice", ln=True)
+  path = tempfile.mktemp(suffix=".pdf")
+  pdf.output(path)
+  try:
+    default = client.post("/parse-path", json={"filepath": path}).json()
+    assert default["metadata"]["pdf_backend"] == "pdfplumber"
+    fast = client.post("/parse-path", json={"filepath": path, "pdf_backend": "pymupdf"}).json()
+    assert fast["metadata"]["pdf_backend"] == "pymupdf"
+    assert fast["content"] == default["content"] == "Backend choice"
+    assert client.post("/parse-path", json={"filepath": path, "pdf_backend": "poppler"}).status_code == 400
+  finally:
+    os.remove(path)
+
+def test_responses_are_compressed_as_negotiated(tmp_path, monkeypatch):
+  path = tmp_path / "big.txt"
+  path.write_text("line of parsed text\n" * 5000)
+  response = client.post("/parse-path", json={"filepath": str(path)}, headers={"Accept-Encoding": "gzip"})
+  assert response.headers["content-encoding"] == "gzip"
+  assert "Accept-Encoding" in response.headers["vary"]
+  assert response.json()["content"].startswith("line of parsed text")
+  assert int(response.headers["content-length"]) < 5000
+  identity = client.post("/parse-path", json={"filepath": str(path)}, headers={"Accept-Encoding": "identity"})
+  assert "content-encoding" not in identity.headers
+  # Small responses are not worth compressing
+  assert "content-encoding" not in client.get("/", headers={"Accept-Encoding": "gzip"}).headers
+  # Streamed records are compressed too and decode chunk by chunk
+  with open(path, "rb") as f:
+    stream = client.post("/parse?stream=ndjson", files={"file": ("big.txt", f)}, headers={"Accept-Encoding": "gzip"})
+  assert stream.headers["content-encoding"] == "gzip"
+  assert [json.loads(line)["type"] for line in stream.text.splitlines()] == ["metadata", "document", "summary"]
+  monkeypatch.setattr(main, "ZSTD_AVAILABLE", False)
+  assert main.negotiate_encoding("gzip;q=0.5, zstd") == "gzip"
+  assert main.negotiate_encoding("gzip;q=0, br") is None
+  assert main.negotiate_encoding("*") == "gzip"
+  monkeypatch.setattr(main, "ZSTD_AVAILABLE", True)
+  assert main.negotiate_encoding("gzip, zstd") == "zstd"
+  assert main.negotiate_encoding("gzip, zstd;q=0.1") == "gzip"
+
+def test_content_handle_serves_pages_and_byte_ranges(tmp_path, monkeypatch):
+  from fpdf import FPDF
+  monkeypatch.setattr(main, "result_store", main.ResultStore(str(tmp_path / "results"), ttl=60))
+  pdf = FPDF()
+  pdf.set_font("Arial", size=12)
+  for i in range(3):
+    pdf.add_page()
+    pdf.cell(0, 10, txt=f"Page number {i + 1} text", ln=True)
+  path = tmp_path / "doc.pdf"
+  pdf.output(str(path))
+  inline = client.post("/parse-path", json={"filepath": str(path)}).json()
+  with open(path, "rb") as f:
+    data = client.post("/parse?content_handle=true", files={"file": ("doc.pdf", f, "application/pdf")}).json()
+  assert "content" not in data and data["metadata"]["page_count"] == 3
+  handle = data["content_handle"]
+  assert handle["pages"] == 3 and handle["bytes"] == len(inline["content"].encode("utf-8"))
+  assert client.get(handle["url"]).text == inline["content"]
+  page_two = client.get(handle["url"], params={"pages": "2"}).text
+  assert "Page number 2" in page_two and "Page number 1" not in page_two and "Page number 3" not in page_two
+  assert client.get(handle["url"], params={"pages": "1-3"}).text == inline["content"]
+  assert client.get(handle["url"], params={"pages": "4"}).status_code == 400
+  partial = client.get(handle["url"], headers={"Range": "bytes=0-10", "Accept-Encoding": "gzip"})
+  assert partial.status_code == 206 and partial.content == inline["content"].encode("utf-8")[:11]
+  assert "content-encoding" not in partial.headers
+  assert client.delete(f"/results/{handle['id']}").status_code == 200
+  assert client.get(handle["url"]).status_code == 404
+  assert client.get("/results/..%2Fetc/content").status_code == 404
+  # Expired handles are gone
+  expired = main.result_store.put("old")
+  monkeypatch.setattr(main.result_store, "ttl", -1)
+  assert client.get(expired["url"]).status_code == 404
+
+def test_upload_page_limit_applies_to_cached_results(tmp_path, monkeypatch):
+  from fpdf import FPDF
+  monkeypatch.setattr(main, "PDF_UPLOAD_MAX_PAGES", 3)
+  pdf = FPDF()
+  pdf.set_font("Arial", size=12)
+  for i in range(5):
+    pdf.add_page()
+    pdf.cell(0, 10, txt=f"Page {i + 1}", ln=True)
+  path = tmp_path / "five.pdf"
+  pdf.output(str(path))
+  upload = lambda: client.post("/parse", files={"file": ("five.pdf", path.read_bytes(), "application/pdf")})
+  assert upload().status_code == 400
+  # /parse-path has no page limit and caches the full result for the same bytes
+  assert client.post("/parse-path", json={"filepath": str(path)}).status_code == 200
+  assert main.result_cache.stats()["memory_entries"] == 1
+  assert upload().status_code == 400
+  batch = client.post("/parse-batch", files=[("files", ("five.pdf", path.read_bytes(), "application/pdf"))]).json()
+  assert batch["results"][0]["error"]["status_code"] == 400
@@ -1,6 +1,8 @@
 import os
 import tempfile
+import pytest
 from main import parse_docx, parse_text, parse_pdf, parse_csv, parse_xlsx, parse_pptx, parse_eml, parse_image, parse_feature
+from main import parse_document, DocumentRejectedError
 
 def test_parse_text():
   with tempfile.NamedTemporaryFile(mode="w+", suffix=".txt", delete=False) as f:
@@ -63,6 +65,457 @@ def test_parse_pdf():
   finally:
     os.remove(pdf_path)
 
+def _make_text_pdf(path, pages):
+  from fpdf import FPDF
+  pdf = FPDF()
+  pdf.set_font("Arial", size=12)
+  for i in range(pages):
+    pdf.add_page()
+    pdf.cell(200, 10, txt=f"Page {i + 1} text", ln=True)
+  pdf.output(path)
+
+def test_parse_document_pdf_opens_once(monkeypatch):
+  import pdfplumber
+  opened = []
+  real_open = pdfplumber.open
+  def counting_open(*args, **kwargs):
+    opened.append(args[0])
+    return real_open(*args, **kwargs)
+  monkeypatch.setattr(pdfplumber, "open", counting_open)
+  path = tempfile.mktemp(suffix=".pdf")
+  _make_text_pdf(path, 3)
+  try:
+    content, metadata = parse_document(path, "pdf", max_pdf_pages=210)
+    assert len(opened) == 1
+    assert "Page 3 text" in content
+    assert metadata["page_count"] == 3
+    assert [p["source"] for p in metadata["page_stats"]] == ["text", "text", "text"]
+  finally:
+    os.remove(path)
+
+def test_parse_document_pdf_page_limit():
+  path = tempfile.mktemp(suffix=".pdf")
+  _make_text_pdf(path, 3)
+  try:
+    with pytest.raises(DocumentRejectedError):
+      parse_document(path, "pdf", max_pdf_pages=2)
+  finally:
+    os.remove(path)
+
+def test_parse_pdf_parallel_ocr_keeps_page_order(monkeypatch):
+  import threading
+  import time
+  from concurrent.futures import ThreadPoolExecutor
+  from fpdf import FPDF
+  import main
+  from PIL import Image
+  path = tempfile.mktemp(suffix=".pdf")
+  image_path = tempfile.mktemp(suffix=".png")
+  Image.new("L", (50, 50), 128).save(image_path)
+  # Image-only pages, so the pre-scan sends every page to OCR
+  pdf = FPDF()
+  for _ in range(5):
+    pdf.add_page()
+    pdf.image(image_path, x=10, y=10, w=100)
+  pdf.output(path)
+  os.remove(image_path)
+  lock = threading.Lock()
+  active = []
+  peak = []
+  def fake_ocr(page_number):
+    with lock:
+      active.append(page_number)
+      peak.append(len(active))
+    # Later pages finish first so results arrive out of order
+    time.sleep(0.01 * (6 - page_number))
+    with lock:
+      active.remove(page_number)
+    if page_number == 2:
+      raise RuntimeError("tesseract crashed")
+    return f"scanned page {page_number}"
+  pool = ThreadPoolExecutor(max_workers=4)
+  monkeypatch.setattr(main, "get_ocr_pool", lambda: pool)
+  monkeypatch.setattr(main, "PDF_OCR_PAGE_CONCURRENCY", 2)
+  monkeypatch.setattr(main, "render_page_for_ocr", lambda page, page_number, ctx=None: page_number)
+  monkeypatch.setattr(main, "ocr_image", fake_ocr)
+  try:
+    result = parse_pdf(path)
+    assert result.index("scanned page 1") < result.index("[OCR failed on page 2]") < result.index("scanned page 3")
+    assert result.index("scanned page 3") < result.index("scanned page 4") < result.index("scanned page 5")
+    assert max(peak) <= 2
+  finally:
+    pool.shutdown()
+    os.remove(path)
+
+def test_closing_pdf_page_stream_cancels_queued_ocr(monkeypatch):
+  from concurrent.futures import Future
+  from fpdf import FPDF
+  import main
+  from PIL import Image
+  path = tempfile.mktemp(suffix=".pdf")
+  image_path = tempfile.mktemp(suffix=".png")
+  Image.new("L", (50, 50), 128).save(image_path)
+  pdf = FPDF()
+  for _ in range(3):
+    pdf.add_page()
+    pdf.image(image_path, x=10, y=10, w=100)
+  pdf.output(path)
+  os.remove(image_path)
+
+  # Each submission finishes the page before it, so page 1 is ready while page 2 is queued
+  class QueuePool:
+    def __init__(self):
+      self.futures = []
+
+    def submit(self, fn, img):
+      if self.futures:
+        self.futures[-1].set_result((f"scanned page {img - 1}", 0.0))
+      self.futures.append(Future())
+      return self.futures[-1]
+
+  pool = QueuePool()
+  monkeypatch.setattr(main, "get_ocr_pool", lambda: pool)
+  monkeypatch.setattr(main, "render_page_for_ocr", lambda page, page_number, ctx=None: page_number)
+  try:
+    pages = main.iter_pdf_pages(path)
+    assert next(pages) == "scanned page 1\n"
+    pages.close()
+    assert len(pool.futures) == 2 and pool.futures[1].cancelled()
+  finally:
+    os.remove(path)
+
+def test_pdf_ocr_in_parse_worker_process_runs_pages_concurrently():
+  # In a parse worker, pages are OCR'd on the worker's own threads: two pages
+  # must be in OCR at once to pass the barrier, and the process must still exit
+  import subprocess
+  import sys
+  from fpdf import FPDF
+  from PIL import Image
+  path = tempfile.mktemp(suffix=".pdf")
+  image_path = tempfile.mktemp(suffix=".png")
+  Image.new("L", (50, 50), 128).save(image_path)
+  pdf = FPDF()
+  for _ in range(4):
+    pdf.add_page()
+    pdf.image(image_path, x=10, y=10, w=100)
+  pdf.output(path)
+  os.remove(image_path)
+  script = (
+    "import asyncio, sys, threading, main\n"
+    "barrier = threading.Barrier(2, timeout=10)\n"
+    "def fake_ocr(img):\n"
+    "  barrier.wait()\n"
+    "  return threading.current_thread().name.split('_')[0]\n"
+    "main.ocr_image = fake_ocr\n"
+    "executor = main.ParseExecutor(thread_workers=1, process_workers=1, process_filetypes='pdf')\n"
+    "content, metadata, _ = asyncio.run(executor.run('pdf', main.timed_parse_document, sys.argv[1], 'pdf'))\n"
+    "print(sorted(set(content.split())), [s['source'] for s in metadata['page_stats']])\n"
+  )
+  env = dict(os.environ, PDF_OCR_WORKERS="2", PDF_OCR_PAGE_CONCURRENCY="2", LOG_LEVEL="WARNING")
+  try:
+    result = subprocess.run(
+      [sys.executable, "-c", script, path], capture_output=True, text=True, env=env, timeout=60,
+      cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+  finally:
+    os.remove(path)
+  assert result.returncode == 0, result.stderr
+  assert result.stdout.splitlines()[-1] == "['ocr'] ['ocr', 'ocr', 'ocr', 'ocr']"
+
+def test_render_page_for_ocr_renders_at_target_size(monkeypatch):
+  from fpdf import FPDF
+  import main
+  path = tempfile.mktemp(suffix=".pdf")
+  pdf = FPDF()
+  pdf.set_font("Arial", size=12)
+  pdf.add_page()
+  pdf.cell(200, 10, txt="Rasterized", ln=True)
+  pdf.output(path)
+  try:
+    with main.PdfContext(path) as ctx:
+      page = ctx.pdf.pages[0]
+      img = main.render_page_for_ocr(page, 1, ctx)
+      assert max(img.size) == 1000 and img.mode == "L"
+      monkeypatch.setattr(main, "OCR_COLOR_MODE", "binary")
+      assert main.render_page_for_ocr(page, 1, ctx).mode == "1"
+      monkeypatch.setattr(main, "OCR_TARGET_PX", 5000)
+      # Capped at OCR_MAX_DPI: an A4 page is 11.7in tall
+      assert max(main.render_page_for_ocr(page, 1).size) == round(page.height / 72 * 300)
+  finally:
+    os.remove(path)
+
+def test_pdf_ocr_plan_and_budget(monkeypatch):
+  from fpdf import FPDF
+  from PIL import Image
+  import main
+  path = tempfile.mktemp(suffix=".pdf")
+  image_path = tempfile.mktemp(suffix=".png")
+  Image.new("L", (50, 50), 128).save(image_path)
+  pdf = FPDF()
+  pdf.set_font("Arial", size=12)
+  pdf.add_page()
+  pdf.cell(200, 10, txt="Text page", ln=True)
+  for _ in range(3):
+    pdf.add_page()
+    pdf.image(image_path, x=0, y=0, w=210, h=297)
+  pdf.add_page()
+  pdf.output(path)
+  os.remove(image_path)
+  ocr_calls = []
+  monkeypatch.setattr(main, "get_ocr_pool", lambda: None)
+  monkeypatch.setattr(main, "ocr_image", lambda img: ocr_calls.append(img) or "scanned")
+  monkeypatch.setattr(main, "PDF_OCR_PAGE_BUDGET", 2)
+  try:
+    content, metadata = parse_document(path, "pdf")
+    plan = metadata["ocr_plan"]
+    assert (plan["text_pages"], plan["image_pages"], plan["empty_pages"]) == (1, 3, 1)
+    assert plan["ocr_pages"] == [2, 3] and plan["skipped_pages"] == [4]
+    assert plan["estimated_ocr_seconds"] == 2 * main.OCR_PAGE_COST_SECONDS
+    assert len(ocr_calls) == 2
+    assert [s["source"] for s in metadata["page_stats"]] == ["text", "ocr", "ocr", "ocr_skipped", "empty"]
+    assert "OCR budget of 2 pages is used up" in content
+  finally:
+    os.remove(path)
+
+def test_pymupdf_backend_extracts_text_and_renders_ocr_pages(monkeypatch):
+  pytest.importorskip("pymupdf")
+  from fpdf import FPDF
+  from PIL import Image
+  import main
+  path = tempfile.mktemp(suffix=".pdf")
+  image_path = tempfile.mktemp(suffix=".png")
+  Image.new("L", (50, 50), 128).save(image_path)
+  pdf = FPDF()
+  pdf.set_font("Arial", size=12)
+  for i in range(2):
+    pdf.add_page()
+    pdf.cell(200, 10, txt=f"Page {i + 1} text", ln=True)
+  pdf.add_page()
+  pdf.image(image_path, x=0, y=0, w=210, h=297)
+  pdf.output(path)
+  os.remove(image_path)
+  rendered = []
+  monkeypatch.setattr(main, "get_ocr_pool", lambda: None)
+  monkeypatch.setattr(main, "ocr_image", lambda img: rendered.append(img) or "scanned")
+  try:
+    content, metadata = parse_document(path, "pdf", 3, None, "pymupdf")
+    assert "Page 1 text" in content and "Page 2 text" in content and "scanned" in content
+    assert metadata["pdf_backend"] == "pymupdf" and metadata["page_count"] == 3
+    assert [s["source"] for s in metadata["page_stats"]] == ["text", "text", "ocr"]
+    assert max(rendered[0].size) == 1000 and rendered[0].mode == "L"
+    assert main.get_pdf_page_count(path, "pymupdf") == 3
+    # The page limit is enforced from the same handle
+    with pytest.raises(DocumentRejectedError):
+      parse_document(path, "pdf", 2, None, "pymupdf")
+  finally:
+    os.remove(path)
+
+def test_unknown_pdf_backend_setting_falls_back_to_pdfplumber(monkeypatch, caplog):
+  import importlib.util
+  import main
+  assert main.resolve_pdf_backend("pymupf") == "pdfplumber"
+  assert "Ignoring PDF_BACKEND: Unsupported pdf_backend: pymupf" in caplog.text
+  real_find_spec = importlib.util.find_spec
+  monkeypatch.setattr(importlib.util, "find_spec", lambda name: None if name == "pymupdf" else real_find_spec(name))
+  assert main.resolve_pdf_backend("pymupdf") == "pdfplumber"
+  assert main.resolve_pdf_backend("pdfplumber") == "pdfplumber"
+
+def _make_table_pdf(path):
+  # Page 1 is plain text; pages 2 and 3 hold a bordered table between two lines of text
+  from fpdf import FPDF
+  pdf = FPDF()
+  pdf.set_font("Arial", size=10)
+  pdf.add_page()
+  pdf.cell(0, 6, txt="Plain page", ln=True)
+  for page in (2, 3):
+    pdf.add_page()
+    pdf.cell(0, 6, txt=f"Revenue table {page}", ln=True)
+    for row in [["Region", "Q1", "Q2"], ["North", "10", "12"], ["South", "7", "9"]]:
+      for cell in row:
+        pdf.cell(30, 8, txt=cell, border=1)
+      pdf.ln()
+    pdf.cell(0, 6, txt="Figures in EUR", ln=True)
+  pdf.output(path)
+
+def test_pdf_tables_mode_emits_blocks_and_skips_unruled_pages(monkeypatch):
+  import main
+  path = tempfile.mktemp(suffix=".pdf")
+  _make_table_pdf(path)
+  try:
+    plain, metadata = parse_document(path, "pdf")
+    assert "North 10 12" in plain and "tables" not in metadata
+    markdown, metadata = parse_document(path, "pdf", None, {"format": "markdown", "pages": None})
+    assert markdown.count("| Region | Q1 | Q2 |\n| --- | --- | --- |\n| North | 10 | 12 |") == 2
+    assert "North 10 12" not in markdown and "Figures in EUR" in markdown
+    assert metadata["tables"] == {
+      "format": "markdown", "requested_pages": 3, "scanned_pages": 2, "skipped_pages": 1, "tables": 2
+    }
+    assert [s.get("tables") for s in metadata["page_stats"]] == [None, 1, 1]
+    content, metadata = parse_document(path, "pdf", None, {"format": "csv", "pages": main.parse_page_ranges("3")})
+    assert content.count("```csv\nRegion,Q1,Q2\nNorth,10,12\nSouth,7,9\n```") == 1
+    assert "North 10 12" in content
+    # Pages handed to the worker pool come back in order with the same output
+    monkeypatch.setattr(main, "PDF_TABLE_WORKERS", 2)
+    monkeypatch.setattr(main, "PDF_TABLE_PAGES_PER_TASK", 1)
+    pooled, _ = parse_document(path, "pdf", None, {"format": "markdown", "pages": None})
+    assert pooled == markdown
+  finally:
+    main.shutdown_table_pool()
+    os.remove(path)
+
+def test_pdf_tables_in_parse_worker_process_run_inline():
+  # A parse worker process extracts tables itself instead of starting a nested
+  # table pool that nothing shuts down, which would hang the interpreter at exit
+  import subprocess
+  import sys
+  path = tempfile.mktemp(suffix=".pdf")
+  _make_table_pdf(path)
+  script = (
+    "import asyncio, sys, main\n"
+    "executor = main.ParseExecutor(thread_workers=1, process_workers=1, process_filetypes='pdf')\n"
+    "tables = {'format': 'csv', 'pages': None}\n"
+    "content, metadata, _ = asyncio.run(executor.run('pdf', main.timed_parse_document, sys.argv[1], 'pdf', None, tables))\n"
+    "print(metadata['tables']['tables'], asyncio.run(executor.run('pdf', main.get_table_pool)))\n"
+  )
+  env = dict(os.environ, PDF_TABLE_WORKERS="2", PDF_OCR_WORKERS="2", LOG_LEVEL="WARNING")
+  try:
+    result = subprocess.run(
+      [sys.executable, "-c", script, path], capture_output=True, text=True, env=env, timeout=60,
+      cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+  finally:
+    os.remove(path)
+  assert result.returncode == 0, result.stderr
+  assert result.stdout.splitlines()[-1] == "2 None"
+
+def test_unused_table_pool_setting_is_reported(monkeypatch, caplog):
+  import main
+  monkeypatch.setattr(main, "PDF_TABLE_WORKERS", 2)
+  monkeypatch.setattr(main, "parse_executor", main.ParseExecutor(process_workers=2, process_filetypes="pdf"))
+  main.warn_unused_pool_settings()
+  assert "PDF_TABLE_WORKERS=2 is unused" in caplog.text
+  caplog.clear()
+  monkeypatch.setattr(main, "parse_executor", main.ParseExecutor(process_workers=2, process_filetypes="png"))
+  main.warn_unused_pool_settings()
+  assert "PDF_TABLE_WORKERS" not in caplog.text
+
+def test_parse_document_dispatches_through_the_format_registry(monkeypatch):
+  import main
+  calls = []
+  def parse_fake(file_path, filetype, options):
+    calls.append((filetype, options))
+    return "fake content", {"fake": True}
+  fake = main.DocumentFormat("fake", ["fake"], parse_fake)
+  monkeypatch.setitem(main.DOCUMENT_FORMATS, "fake", fake)
+  assert parse_document("any.fake", "fake", 5) == ("fake content", {"fake": True})
+  assert calls == [("fake", {"max_pdf_pages": 5, "tables": None, "pdf_backend": None})]
+  # A registered entry alone reproduces parse_document, page limit included
+  path = tempfile.mktemp(suffix=".pdf")
+  _make_text_pdf(path, 3)
+  try:
+    options = {"max_pdf_pages": None, "tables": None, "pdf_backend": None}
+    assert main.DOCUMENT_FORMATS["pdf"].parse(path, "pdf", options) == parse_document(path, "pdf")
+    with pytest.raises(DocumentRejectedError):
+      main.DOCUMENT_FORMATS["pdf"].parse(path, "pdf", dict(options, max_pdf_pages=2))
+  finally:
+    os.remove(path)
+
+def test_streamed_whole_document_times_parse_once(tmp_path):
+  import main
+  path = tmp_path / "notes.txt"
+  path.write_text("streamed text")
+  timings = main.StageTimings()
+  token = main._stage_timings.set(timings)
+  try:
+    records = list(main.stream_document(str(path), "txt"))
+  finally:
+    main._stage_timings.reset(token)
+  assert [record["type"] for record in records] == ["metadata", "document", "summary"]
+  assert records[1]["content"] == "streamed text"
+  assert records[-1]["timings"]["stages"]["parse"]["count"] == 1
+
+def test_parse_page_ranges():
+  import main
+  assert main.parse_page_ranges("1-3, 7") == [(1, 3), (7, 7)]
+  for spec in ["", "0", "3-1", "a", "1-"]:
+    with pytest.raises(ValueError):
+      main.parse_page_ranges(spec)
+
+class FakeVisionClient:
+  def __init__(self, answers):
+    self.answers = list(answers)
+    self.payloads = []
+
+  def post(self, url, json):
+    import httpx
+    self.payloads.append(json)
+    answer = self.answers.pop(0)
+    if isinstance(answer, Exception):
+      raise answer
+    return httpx.Response(200, json={"choices": [{"message": {"content": answer}}]}, request=httpx.Request("POST", url))
+
+def _use_fake_vision(monkeypatch, answers):
+  import main
+  model = main.VisionModel()
+  fake = FakeVisionClient(answers)
+  monkeypatch.setattr(model, "_get_client", lambda: fake)
+  monkeypatch.setattr(main, "vision_model", model)
+  monkeypatch.setattr(main, "LLAVA_USE", True)
+  return fake
+
+def test_parse_image_uses_vision_model_with_cache_and_ocr_fallback(monkeypatch):
+  import httpx
+  from PIL import Image
+  import main
+  fake = _use_fake_vision(monkeypatch, ["A red square", httpx.ConnectError("down")])
+  monkeypatch.setattr(main, "ocr_image", lambda img: "tesseract text")
+  red = tempfile.mktemp(suffix=".png")
+  blue = tempfile.mktemp(suffix=".png")
+  Image.new("RGB", (10, 10), "red").save(red)
+  Image.new("RGB", (10, 10), "blue").save(blue)
+  try:
+    assert main.parse_image(red) == "A red square"
+    assert main.parse_image(red) == "A red square"
+    assert len(fake.payloads) == 1
+    assert fake.payloads[0]["messages"][0]["content"][1]["image_url"]["url"].startswith("data:image/png;base64,")
+    # A failed call falls back to tesseract and the model is skipped while cooling down
+    assert main.parse_image(blue) == "tesseract text"
+    assert main.parse_image(blue) == "tesseract text"
+    assert len(fake.payloads) == 2
+  finally:
+    os.remove(red)
+    os.remove(blue)
+
+def test_failed_pdf_ocr_pages_are_batched_to_vision_model(monkeypatch):
+  from fpdf import FPDF
+  from PIL import Image
+  import main
+  path = tempfile.mktemp(suffix=".pdf")
+  image_paths = []
+  pdf = FPDF()
+  for shade in (0, 100, 200):
+    image_paths.append(tempfile.mktemp(suffix=".png"))
+    Image.new("L", (50, 50), shade).save(image_paths[-1])
+    pdf.add_page()
+    pdf.image(image_paths[-1], x=10, y=10, w=100)
+  pdf.output(path)
+  for image_path in image_paths:
+    os.remove(image_path)
+  def failing_ocr(img):
+    raise RuntimeError("tesseract crashed")
+  fake = _use_fake_vision(monkeypatch, ["[Image 1]\nfirst\n[Image 2]\nsecond", "third"])
+  monkeypatch.setattr(main, "LLAVA_PDF_PAGES", True)
+  monkeypatch.setattr(main, "LLAVA_BATCH_SIZE", 2)
+  monkeypatch.setattr(main, "get_ocr_pool", lambda: None)
+  monkeypatch.setattr(main, "ocr_image", failing_ocr)
+  try:
+    content, metadata = parse_document(path, "pdf")
+    assert content.split() == ["first", "second", "third"]
+    assert [len(p["messages"][0]["content"]) - 1 for p in fake.payloads] == [2, 1]
+    assert [s["source"] for s in metadata["page_stats"]] == ["vision"] * 3
+  finally:
+    os.remove(path)
+
 def test_parse_xlsx():
   import pandas as pd
   path = tempfile.mktemp(suffix=".xlsx")
@@ -74,6 +527,75 @@ def test_parse_xlsx():
   finally:
     os.remove(path)
 
+def test_parse_xlsx_all_sheets():
+  import pandas as pd
+  path = tempfile.mktemp(suffix=".xlsx")
+  with pd.ExcelWriter(path) as writer:
+    pd.DataFrame({"a": [1]}).to_excel(writer, sheet_name="First", index=False)
+    pd.DataFrame({"b": [2]}).to_excel(writer, sheet_name="Second", index=False)
+  try:
+    result = parse_xlsx(path)
+    assert result.index("[Sheet: First]") < result.index("[Sheet: Second]")
+    assert "a\n1" in result and "b\n2" in result
+  finally:
+    os.remove(path)
+
+def test_parse_csv_counts_rows_in_same_pass(monkeypatch):
+  import main
+  monkeypatch.setattr(main, "TABULAR_CHUNK_ROWS", 2)
+  monkeypatch.setattr(main, "TABULAR_MAX_ROWS", 3)
+  with tempfile.NamedTemporaryFile(mode="w+", suffix=".csv", delete=False) as f:
+    f.write("n,sq\n" + "".join(f"{i},{i * i}\n" for i in range(10)))
+    path = f.name
+  try:
+    content, metadata = parse_document(path, "csv")
+    assert content == "n,sq\n0,0\n1,1\n2,4\n"
+    assert metadata["rows"] == 10 and metadata["columns"] == 2
+    assert metadata["rows_emitted"] == 3
+  finally:
+    os.remove(path)
+
+def test_parse_csv_values_do_not_depend_on_chunk_boundaries(monkeypatch):
+  import main
+  with tempfile.NamedTemporaryFile(mode="w+", suffix=".csv", delete=False) as f:
+    f.write("id,v\n1,10\n2,20\n3,\n4,40\n")
+    path = f.name
+  try:
+    # The missing value is in the second chunk only
+    monkeypatch.setattr(main, "TABULAR_CHUNK_ROWS", 2)
+    chunked, metadata = parse_document(path, "csv")
+    assert chunked == "id,v\n1,10\n2,20\n3,\n4,40\n"
+    assert metadata["rows"] == 4 and metadata["columns"] == 2
+    monkeypatch.setattr(main, "TABULAR_CHUNK_ROWS", 50000)
+    assert parse_document(path, "csv")[0] == chunked
+  finally:
+    os.remove(path)
+
+def test_parse_xlsx_sampling(monkeypatch):
+  import pandas as pd
+  import main
+  monkeypatch.setattr(main, "TABULAR_SAMPLE_STEP", 3)
+  path = tempfile.mktemp(suffix=".xlsx")
+  pd.DataFrame({"n": list(range(7))}).to_excel(path, index=False)
+  try:
+    content, metadata = parse_document(path, "xlsx")
+    assert content == "n\n0\n3\n6\n"
+    assert metadata["rows"] == 7 and metadata["sheets"][0]["rows_emitted"] == 3
+  finally:
+    os.remove(path)
+
+def test_dataframe_to_markdown_escapes_and_aligns():
+  import pandas as pd
+  from main import dataframe_to_markdown
+  df = pd.DataFrame({"name": ["a|b", "multi\nline"], "n": [1, 22]})
+  assert dataframe_to_markdown(df) == (
+    "| name | n |\n| --- | --- |\n| a\\|b | 1 |\n| multi<br>line | 22 |"
+  )
+  aligned = dataframe_to_markdown(df, align=True).splitlines()
+  assert aligned[0] == "| name          | n   |"
+  assert aligned[1] == "| ------------- | --- |"
+  assert len({len(line) for line in aligned}) == 1
+
 def test_parse_pptx():
   from pptx import Presentation
   path = tempfile.mktemp(suffix=".pptx")
@@ -105,6 +627,101 @@ def test_parse_eml():
   finally:
     os.remove(path)
 
+def _make_email(subject, body=None, html=None, attachments=()):
+  import email.message
+  msg = email.message.EmailMessage()
+  msg["Subject"] = subject
+  msg["From"] = "from@example.com"
+  msg["To"] = "to@example.com"
+  if body is not None:
+    msg.set_content(body)
+  if html is not None:
+    msg.add_alternative(html, subtype="html") if body is not None else msg.set_content(html, subtype="html")
+  for item in attachments:
+    if isinstance(item, email.message.EmailMessage):
+      msg.add_attachment(item)
+    else:
+      name, data = item
+      msg.add_attachment(data, maintype="application", subtype="octet-stream", filename=name)
+  return msg
+
+def test_parse_eml_attachments_and_html_body(tmp_path):
+  import main
+  inner = _make_email("Forwarded", body="inner body", attachments=[("notes.txt", b"inner attachment")])
+  msg = _make_email(
+    "Report",
+    html="<html><style>p {color: red}</style><body><p>Hello &amp; welcome</p><p>Second</p></body></html>",
+    attachments=[("data.csv", b"a,b\n1,2\n"), ("readme.txt", b"attached text"), ("blob.xyz", b"?"), inner],
+  )
+  path = tmp_path / "report.eml"
+  path.write_bytes(msg.as_bytes())
+  content, metadata = main.parse_document(str(path), "eml")
+  assert content.startswith("Subject: Report\nFrom: from@example.com\nTo: to@example.com\n\nHello & welcome\nSecond")
+  assert "color" not in content
+  attachments = metadata["attachments"]
+  assert list(attachments) == ["data.csv", "readme.txt", "blob.xyz", "Forwarded.eml"]
+  assert attachments["readme.txt"]["content"] == "attached text"
+  assert attachments["blob.xyz"]["error"] == "Unsupported file type"
+  # The attached message is parsed with its own attachment
+  forwarded = attachments["Forwarded.eml"]
+  assert forwarded["metadata"]["attachments"]["notes.txt"]["content"] == "inner attachment"
+  assert "--- readme.txt ---\nattached text" in content
+  assert "--- notes.txt ---\ninner attachment" in forwarded["content"]
+
+def test_mail_attachments_in_flight_are_bounded(tmp_path, monkeypatch):
+  # Attachments are spooled and submitted at most ARCHIVE_WORKERS * 2 at a time
+  from concurrent.futures import Future
+  import main
+
+  class LazyFuture(Future):
+    def __init__(self, pool, fn, args):
+      super().__init__()
+      self.pool, self.fn, self.args = pool, fn, args
+
+    def result(self, timeout=None):
+      if not self.done():
+        self.pool.pending.remove(self)
+        self.set_result(self.fn(*self.args))
+      return super().result(timeout)
+
+  class LazyPool:
+    def __init__(self):
+      self.pending = []
+      self.peak = 0
+
+    def submit(self, fn, *args):
+      future = LazyFuture(self, fn, args)
+      self.pending.append(future)
+      self.peak = max(self.peak, len(self.pending))
+      return future
+
+  pool = LazyPool()
+  monkeypatch.setattr(main, "ARCHIVE_WORKERS", 1)
+  monkeypatch.setattr(main, "get_member_pool", lambda: pool)
+  msg = _make_email("Many", body="body", attachments=[(f"{i}.txt", f"attachment {i}".encode()) for i in range(5)])
+  path = tmp_path / "many.eml"
+  path.write_bytes(msg.as_bytes())
+  content, metadata = main.parse_document(str(path), "eml")
+  assert pool.peak == 2
+  assert list(metadata["attachments"]) == [f"{i}.txt" for i in range(5)]
+  assert [metadata["attachments"][f"{i}.txt"]["content"] for i in range(5)] == [f"attachment {i}" for i in range(5)]
+
+def test_parse_mbox_streams_one_record_per_message(tmp_path):
+  import main
+  path = tmp_path / "export.mbox"
+  with open(path, "wb") as f:
+    for i in range(3):
+      attachments = [("a.txt", f"attachment {i}".encode())] if i == 1 else []
+      f.write(f"From sender{i}@example.com Sat Jan  1 00:00:00 2022\n".encode())
+      f.write(_make_email(f"Message {i}", body=f"body {i}\n", attachments=attachments).as_bytes() + b"\n")
+  content, metadata = main.parse_document(str(path), "mbox")
+  assert metadata["message_count"] == 3 and metadata["attachment_count"] == 1
+  assert "--- message 2 ---\nSubject: Message 1" in content and "attachment 1" in content
+  records = list(main.stream_document(str(path), "mbox"))
+  messages = [record for record in records if record["type"] == "message"]
+  assert [record["content"].split("\n")[0] for record in messages] == [f"Subject: Message {i}" for i in range(3)]
+  assert records[-1]["count"] == 3
+
 def test_parse_image_ocr():
   from PIL import Image, ImageDraw, ImageFont
   path = tempfile.mktemp(suffix=".png")
@@ -154,8 +771,194 @@ def test_parse_feature():
   finally:
     os.remove(path)
 
+def test_parse_legacy_office_removes_converted_file(monkeypatch):
+  import docx
+  import subprocess
+  import main
+  outputs = []
+  def fake_unoconv(cmd, **kwargs):
+    out_path = cmd[cmd.index("-o") + 1]
+    outputs.append(out_path)
+    doc = docx.Document()
+    doc.add_paragraph("Converted legacy text")
+    doc.save(out_path)
+  monkeypatch.setattr(subprocess, "run", fake_unoconv)
+  result = main.parse_legacy_office("/tmp/legacy.doc", ".docx")
+  assert "Converted legacy text" in result
+  assert not os.path.exists(os.path.dirname(outputs[0]))
+
+def test_parse_legacy_office_timeout_cleans_up(monkeypatch):
+  import subprocess
+  import main
+  outputs = []
+  def hanging_unoconv(cmd, **kwargs):
+    out_path = cmd[cmd.index("-o") + 1]
+    outputs.append(out_path)
+    open(out_path, "wb").close()
+    raise subprocess.TimeoutExpired(cmd, kwargs.get("timeout"))
+  monkeypatch.setattr(subprocess, "run", hanging_unoconv)
+  result = main.parse_legacy_office("/tmp/legacy.xls", ".xlsx")
+  assert "requires unoconv/libreoffice" in result
+  assert not os.path.exists(os.path.dirname(outputs[0]))
+
+def test_soffice_pool_restarts_listener_after_failure(monkeypatch):
+  import subprocess
+  import main
+  class FakeListener:
+    def __init__(self, port):
+      self.port = port
+      self.connection = f"port={port}"
+      self.restarts = 0
+    def start(self):
+      pass
+    def is_healthy(self):
+      return True
+    def restart(self):
+      self.restarts += 1
+    def stop(self):
+      pass
+  def failing_unoconv(cmd, **kwargs):
+    raise subprocess.CalledProcessError(1, cmd)
+  monkeypatch.setattr(main, "SofficeListener", FakeListener)
+  monkeypatch.setattr(subprocess, "run", failing_unoconv)
+  pool = main.SofficePool(1, base_port=2100)
+  with pytest.raises(subprocess.CalledProcessError):
+    pool.convert("/tmp/in.doc", ".docx", "/tmp/out.docx", timeout=1)
+  assert pool.listeners[0].restarts == 1
+  # The listener goes back to the pool for the next conversion
+  assert pool._idle.qsize() == 1
+
+def _make_zip(path, members):
+  import zipfile
+  with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+    for name, data in members.items():
+      zf.writestr(name, data)
+
+def test_parse_archive_nested_zip(tmp_path):
+  from main import parse_archive
+  inner = tmp_path / "inner.zip"
+  _make_zip(inner, {"deep.txt": "deep text"})
+  outer = tmp_path / "outer.zip"
+  _make_zip(outer, {
+    "docs/a.txt": "alpha text",
+    "data.csv": "a,b\n1,2",
+    "nested/inner.zip": inner.read_bytes(),
+    "binary.xyz": "ignored",
+  })
+  content, members = parse_archive(str(outer), "zip")
+  assert list(members) == ["docs/a.txt", "data.csv", "nested/inner.zip/deep.txt", "binary.xyz"]
+  assert members["docs/a.txt"]["content"] == "alpha text"
+  assert members["nested/inner.zip/deep.txt"]["content"] == "deep text"
+  assert members["binary.xyz"]["error"] == "Unsupported file type"
+  assert "--- docs/a.txt ---\nalpha text" in content
+
+def test_parse_archive_tar_gz(tmp_path):
+  import io
+  import tarfile
+  from main import detect_file_type, parse_archive
+  path = tmp_path / "bundle.tar.gz"
+  with tarfile.open(path, "w:gz") as tf:
+    data = b"tar member text"
+    info = tarfile.TarInfo("notes/readme.md")
+    info.size = len(data)
+    tf.addfile(info, io.BytesIO(data))
+  assert detect_file_type(str(path)) == "tar"
+  _, members = parse_archive(str(path), "tar")
+  assert members["notes/readme.md"]["content"] == "tar member text"
+
+def test_parse_archive_limits(tmp_path, monkeypatch):
+  import main
+  path = tmp_path / "bomb.zip"
+  _make_zip(path, {"zeros.txt": "0" * 100000, "b.txt": "b", "c.txt": "c"})
+  monkeypatch.setattr(main, "ARCHIVE_MAX_TOTAL_BYTES", 1000)
+  with pytest.raises(main.ArchiveLimitError):
+    main.parse_archive(str(path), "zip")
+  monkeypatch.setattr(main, "ARCHIVE_MAX_TOTAL_BYTES", 10 ** 9)
+  monkeypatch.setattr(main, "ARCHIVE_MAX_MEMBERS", 2)
+  with pytest.raises(main.ArchiveLimitError):
+    main.parse_archive(str(path), "zip")
+  inner = tmp_path / "inner.zip"
+  _make_zip(inner, {"x.txt": "x"})
+  outer = tmp_path / "outer.zip"
+  _make_zip(outer, {"inner.zip": inner.read_bytes()})
+  monkeypatch.setattr(main, "ARCHIVE_MAX_MEMBERS", 1000)
+  monkeypatch.setattr(main, "ARCHIVE_MAX_DEPTH", 0)
+  with pytest.raises(main.ArchiveLimitError):
+    main.parse_archive(str(outer), "zip")
+
 # Stub for large legacy document test (manual/placeholder)
 def test_large_legacy_doc_stub():
   # This is a placeholder for manual stress testing with large .doc/.xls/.ppt files
   # To be run manually with real files if needed
   pass
+
+def test_parser_libraries_are_imported_on_first_use():
+  import subprocess
+  import sys
+  script = (
+    "import sys, main\n"
+    "heavy = ['pandas', 'pdfplumber', 'openpyxl', 'pptx', 'docx', 'extract_msg', 'PIL.Image', 'pypdfium2']\n"
+    "print(sorted(m for m in heavy if m in sys.modules))\n"
+    "main.preload_formats()\n"
+    "print(main.DOCUMENT_FORMATS['csv'].loaded, main.DOCUMENT_FORMATS['pdf'].loaded)\n"
+  )
+  env = dict(os.environ, PARSER_FORMATS="csv")
+  result = subprocess.run(
+    [sys.executable, "-c", script], capture_output=True, text=True, env=env,
+    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  )
+  assert result.returncode == 0, result.stderr
+  assert result.stdout.splitlines() == ["[]", "True False"]
+
+def test_ocr_engine_prefers_warm_tesserocr_per_thread(monkeypatch):
+  import importlib.machinery
+  import sys
+  import threading
+  import types
+  import main
+  created = []
+
+  class FakeApi:
+    def __init__(self, **kwargs):
+      self.kwargs = kwargs
+      self.image = None
+      created.append(self)
+
+    def SetImage(self, img):
+      self.image = img
+
+    def GetUTF8Text(self):
+      return f"text of {self.image}"
+
+    def Clear(self):
+      self.image = None
+
+  fake = types.ModuleType("tesserocr")
+  fake.__spec__ = importlib.machinery.ModuleSpec("tesserocr", None)
+  fake.PyTessBaseAPI = FakeApi
+  monkeypatch.setitem(sys.modules, "tesserocr", fake)
+  monkeypatch.setattr(main, "_ocr_engines", threading.local())
+  monkeypatch.setattr(main, "OCR_LANG", "deu+eng")
+  monkeypatch.setattr(main, "OCR_PSM", 6)
+  assert main.ocr_image("page-1") == "text of page-1"
+  assert main.ocr_image("page-2") == "text of page-2"
+  # Models load once per thread, not per page
+  assert len(created) == 1 and created[0].kwargs == {"lang": "deu+eng", "psm": 6}
+  other = []
+  thread = threading.Thread(target=lambda: other.append(main.get_ocr_engine()))
+  thread.start()
+  thread.join()
+  assert other[0] is not main.get_ocr_engine() and len(created) == 2
+
+def test_ocr_engine_falls_back_to_pytesseract(monkeypatch):
+  import importlib.util
+  import pytesseract
+  import main
+  calls = []
+  monkeypatch.setattr(importlib.util, "find_spec", lambda name: None)
+  monkeypatch.setattr(pytesseract, "image_to_string", lambda img, lang, config: calls.append((lang, config)) or "text")
+  monkeypatch.setattr(main, "OCR_PSM", 11)
+  engine = main.create_ocr_engine("tesserocr")
+  assert engine.name == "pytesseract"
+  assert engine.image_to_string("img") == "text"
+  assert calls == [("eng", "--psm 11")]